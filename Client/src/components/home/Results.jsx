@@ -1,7 +1,7 @@
 import React, { useEffect, useMemo, useRef, useState } from "react";
-import { Award, ChevronDown, ChevronUp, CheckCircle2, ImageIcon, FileText, BarChart2 } from "lucide-react";
+import { Award, ChevronDown, ChevronUp, CheckCircle2, AlertTriangle, ImageIcon, FileText, BarChart2 } from "lucide-react";
 
-function Results({ student_name, roll_number, comparisons }) {
+function Results({ student_name, roll_number, comparisons, complete = true, failedPages = [] }) {
   const [isSaved, setIsSaved] = useState(false);
   const [saving, setSaving] = useState(false);
   const [showDetails, setShowDetails] = useState(false);
@@ -50,6 +50,8 @@ function Results({ student_name, roll_number, comparisons }) {
     const autoSave = async () => {
       if (!student_name || !roll_number) return;
       if (!comparisons || Object.keys(comparisons).length === 0) return;
+      // ✅ Never save a partially graded script as if it were complete
+      if (!complete) return;
 
       if (hasSavedOnce.current) return;
       hasSavedOnce.current = true;
@@ -59,7 +61,10 @@ function Results({ student_name, roll_number, comparisons }) {
         const response = await fetch("http://127.0.0.1:5000/save-report", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify(reportData),
+          body: JSON.stringify({
+            ...reportData,
+            examId: sessionStorage.getItem("gradexExamId"),
+          }),
         });
 
         if (response.ok) {
@@ -75,7 +80,7 @@ function Results({ student_name, roll_number, comparisons }) {
     };
 
     autoSave();
-  }, [student_name, roll_number, comparisons, reportData]);
+  }, [student_name, roll_number, comparisons, reportData, complete]);
 
   // ✅ Badge showing evaluation type per page
   const EvalTypeBadge = ({ type }) => {
@@ -148,6 +153,14 @@ function Results({ student_name, roll_number, comparisons }) {
               {saving && (
                 <p className="text-sm text-gray-500">Saving report to database...</p>
               )}
+              {!complete && (
+                <p className="text-sm font-semibold text-amber-600 flex items-center gap-2">
+                  <AlertTriangle className="w-4 h-4" />
+                  {failedPages.length > 0
+                    ? `Page${failedPages.length > 1 ? "s" : ""} ${failedPages.join(", ")} could not be graded — report not saved`
+                    : "Grading did not finish — report not saved"}
+                </p>
+              )}
               {isSaved && (
                 <p className="text-sm font-semibold text-green-600 flex items-center gap-2">
                   <CheckCircle2 className="w-4 h-4" />
@@ -1,10 +1,37 @@
 import React, { useState } from "react";
-import axios from "axios";
 import { FileCheck } from "lucide-react";
 import Results from "./Results";
 
+// ✅ Reads Server-Sent Events from a fetch() response body
+const readEvents = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const chunk = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      let data = "";
+      chunk.split("\n").forEach((line) => {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      });
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+};
+
 function StudentUpload() {
   const [comparisons, setComparisons] = useState({});
+  const [grading, setGrading] = useState({ complete: true, failedPages: [] });
   const [studentDetails, setStudentDetails] = useState({
     student_name: "",
     roll_number: "",
@@ -16,6 +43,7 @@ function StudentUpload() {
 
   const [showResults, setShowResults] = useState(false);
   const [loading, setLoading] = useState(false);
+  const [progress, setProgress] = useState({ page: 0, totalPages: 0, questions: [] });
 
   const handleSubmit = async (event) => {
     event.preventDefault();
@@ -24,27 +52,66 @@ function StudentUpload() {
     formData.append("studentName", name);
     formData.append("rollNumber", rollNo);
 
+    // ✅ Scripts are always graded against an explicit exam
+    const examId = sessionStorage.getItem("gradexExamId");
+    if (!examId) {
+      alert("Upload the teacher answer key first.");
+      return;
+    }
+    formData.append("examId", examId);
+
     if (file) {
       formData.append("pdf", file);
     }
 
     setLoading(true);
+    setShowResults(false);
+    setProgress({ page: 0, totalPages: 0, questions: [] });
 
     try {
-      const response = await axios.post(
-        "http://localhost:5000/upload/student_api",
-        formData
-      );
+      // ✅ Streamed grading: pages and questions arrive as they are scored
+      const response = await fetch("http://localhost:5000/upload/student_stream", {
+        method: "POST",
+        body: formData,
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`Upload failed (${response.status})`);
+      }
+
+      let summary = null;
+      await readEvents(response, (event, data) => {
+        if (event === "page") {
+          setProgress((prev) => ({ ...prev, page: data.page, totalPages: data.total_pages }));
+        } else if (event === "question") {
+          setProgress((prev) => ({ ...prev, questions: [...prev.questions, data] }));
+        } else if (event === "summary") {
+          summary = data;
+        } else if (event === "error") {
+          console.error(data.error);
+        }
+      });
 
-      setComparisons(response.data.comparisons);
+      if (!summary) {
+        throw new Error("Grading stream ended without a summary");
+      }
+
+      setComparisons(summary.comparisons);
+      setGrading({
+        complete: summary.complete !== false,
+        failedPages: summary.failed_pages || [],
+      });
 
       setStudentDetails({
-        student_name: response.data.student_name,
-        roll_number: response.data.roll_number,
+        student_name: summary.student_name,
+        roll_number: summary.roll_number,
       });
 
       setShowResults(true);
-      alert("Student details and answer sheet uploaded successfully ✅");
+      if (summary.complete === false) {
+        alert("Some pages could not be graded. The report was not saved — please re-upload the script.");
+      } else {
+        alert("Student details and answer sheet uploaded successfully ✅");
+      }
     } catch (error) {
       console.error(error);
       alert("Error uploading student details. Please try again.");
@@ -134,11 +201,28 @@ function StudentUpload() {
             <div className="bg-white p-8 rounded-2xl shadow-xl text-center border border-gray-100">
               <div className="animate-spin rounded-full h-12 w-12 border-b-2 border-indigo-600 mx-auto"></div>
               <h2 className="text-xl font-bold text-gray-900 mt-4">
-                Uploading...
+                {progress.totalPages > 0
+                  ? `Evaluating page ${progress.page} of ${progress.totalPages}...`
+                  : "Uploading..."}
               </h2>
               <p className="text-gray-600 mt-1">
                 Please wait while we evaluate the sheet.
               </p>
+
+              {progress.questions.length > 0 && (
+                <ul className="mt-4 max-h-48 overflow-y-auto text-sm text-left space-y-1">
+                  {progress.questions.map((q) => (
+                    <li key={q.question} className="flex justify-between gap-6">
+                      <span className="text-gray-700">
+                        Question {q.question} ({q.evaluation_type})
+                      </span>
+                      <span className="font-semibold text-indigo-600">
+                        {q.total_score} / 10
+                      </span>
+                    </li>
+                  ))}
+                </ul>
+              )}
             </div>
           </div>
         )}
@@ -151,6 +235,8 @@ function StudentUpload() {
             student_name={studentDetails.student_name}
             roll_number={studentDetails.roll_number}
             comparisons={comparisons}
+            complete={grading.complete}
+            failedPages={grading.failedPages}
           />
         </div>
       )}
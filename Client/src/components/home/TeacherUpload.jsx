@@ -43,6 +43,8 @@ function TeacherUpload({ setIsTeacherUploaded, setLoading }) {
       );
 
       console.log(response);
+      // ✅ Remember the exam session so student uploads grade against this key
+      sessionStorage.setItem("gradexExamId", response.data.examId);
       alert("Answer Key uploaded successfully ✅");
       setIsTeacherUploaded(true);
     } catch (error) {
@@ -2,15 +2,23 @@ import React, { useEffect, useMemo, useState } from "react";
 import axios from "axios";
 import { FileText, RefreshCcw } from "lucide-react";
 
+const PAGE_SIZE = 100;
+
 function Reports() {
   const [reports, setReports] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(false);
 
-  const fetchReports = async () => {
+  // ✅ Fetch one page (summary only); pass a cursor to append the next page
+  const fetchReports = async (cursor = null) => {
     setLoading(true);
     try {
-      const res = await axios.get("http://127.0.0.1:5000/reports");
-      setReports(res.data || []);
+      const res = await axios.get("http://127.0.0.1:5000/reports", {
+        params: { limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      });
+      const page = res.data?.reports || [];
+      setReports((prev) => (cursor ? [...prev, ...page] : page));
+      setNextCursor(res.data?.next_cursor || null);
     } catch (err) {
       console.error(err);
       alert("Failed to fetch reports ❌");
@@ -76,7 +84,7 @@ function Reports() {
           </div>
 
           <button
-            onClick={fetchReports}
+            onClick={() => fetchReports()}
             className="px-5 py-2 rounded-xl bg-indigo-600 text-white font-semibold shadow-md hover:bg-indigo-700 transition flex items-center gap-2 w-fit"
           >
             <RefreshCcw className="w-4 h-4" />
@@ -170,6 +178,17 @@ function Reports() {
                 </tbody>
               </table>
             </div>
+
+            {nextCursor && (
+              <div className="bg-white border-t py-4 text-center">
+                <button
+                  onClick={() => fetchReports(nextCursor)}
+                  className="px-5 py-2 rounded-xl bg-indigo-600 text-white font-semibold shadow-md hover:bg-indigo-700 transition"
+                >
+                  Load more
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
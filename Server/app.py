@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, abort, make_response, request, jsonify, render_template
 from flask_cors import CORS
 import fitz  # PyMuPDF
 import pytesseract
@@ -6,42 +6,39 @@ from PIL import Image
 import os
 os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "false"
 
-from google import genai
-import nltk
-import torch
-import torch.nn.functional as F
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from sentence_transformers import SentenceTransformer, util
-from transformers import (
-    AutoModelForSequenceClassification,
-    AutoTokenizer,
-    ViTModel,
-    ViTFeatureExtractor,
-)
-from pymongo import MongoClient
+# Heavy ML libraries (torch, transformers, sentence-transformers, CLIP,
+# NLTK, scikit-image, google-genai) are imported lazily by the model
+# registry below so the server starts in well under a second.
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateOne
+from bson import ObjectId
+from bson.errors import InvalidId
 import cv2
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
 from dotenv import load_dotenv
 from datetime import datetime
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import Future, ThreadPoolExecutor
+import base64
+import bisect
+import csv
+import hashlib
+import inspect
+import io
+import json
+from multiprocessing.connection import Client as ConnectionClient
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+import zipfile
 
-# ---- CLIP ----
-try:
-    import clip as clip_lib
-    _CLIP_AVAILABLE = True
-except ImportError:
-    _CLIP_AVAILABLE = False
-    print("⚠️  clip package not installed. CLIP similarity will be skipped.")
-
-# ---- torchvision transforms (used for DINO pre-processing) ----
-try:
-    from torchvision import transforms as T
-    _TORCHVISION_AVAILABLE = True
-except ImportError:
-    _TORCHVISION_AVAILABLE = False
-    print("⚠️  torchvision not installed. DINO similarity will be skipped.")
+load_dotenv()
 
 
 # ------------------------
@@ -61,85 +58,682 @@ app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 client = MongoClient("mongodb://localhost:27017/")
 db = client["gradex_db"]
 reports_collection = db["reports"]
+exams_collection = db["exams"]
+graded_results_collection = db["graded_results"]   # result cache, see "Graded Result Cache"
+RESULT_CACHE_DAYS = float(os.getenv("GRADEX_RESULT_CACHE_DAYS", "30"))
+
+# ------------------------
+# MongoDB Indexes ✅
+# Created in a background thread at startup (a no-op when they exist) so
+# a slow or absent Mongo never delays boot. GRADEX_ENSURE_INDEXES=0 skips
+# it, e.g. when indexes are managed by migrations.
+#   reports: (exam_id, roll_number) for save-report upserts, and
+#            (created_at, _id) keyset order, optionally per exam
+#   exams:   exam_id lookups, newest-first listing
+#   graded_results: one entry per (key_hash, pdf_sha256, scoring_version),
+#            expired after GRADEX_RESULT_CACHE_DAYS by a TTL index
+# ------------------------
+ENSURE_INDEXES = os.getenv("GRADEX_ENSURE_INDEXES", "1").strip().lower() in ("1", "true", "yes", "on")
+
+
+def ensure_indexes():
+    try:
+        reports_collection.create_index([("exam_id", ASCENDING), ("roll_number", ASCENDING)])
+        reports_collection.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+        reports_collection.create_index([("exam_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+        reports_collection.create_index([("exam_name", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+        exams_collection.create_index([("exam_id", ASCENDING)], unique=True)
+        exams_collection.create_index([("created_at", DESCENDING)])
+        graded_results_collection.create_index(
+            [("key_hash", ASCENDING), ("pdf_sha256", ASCENDING), ("scoring_version", ASCENDING)], unique=True
+        )
+        graded_results_collection.create_index(
+            [("created_at", ASCENDING)], expireAfterSeconds=int(RESULT_CACHE_DAYS * 86400)
+        )
+        print("✅ MongoDB indexes ready.")
+    except Exception as e:
+        print(f"⚠️  MongoDB index creation failed: {e}")
+
+
+if ENSURE_INDEXES:
+    threading.Thread(target=ensure_indexes, name="gradex-indexes", daemon=True).start()
+
+
+# ------------------------
+# Metrics ✅
+# Latency histograms and counters for every pipeline stage, rendered in
+# Prometheus text format at /metrics. Values are per process: with
+# several workers, scrape each one and sum in Prometheus.
+#   gradex_stage_seconds{stage}        render, text_split, page_analysis,
+#                                      sbert, cross_encoder, clip_embed,
+#                                      dino_embed, diagram_<model>, mongo_write…
+#   gradex_ocr_seconds{backend}        one OCR backend call
+#   gradex_ocr_pages_total{backend,outcome}  ok / empty / error / timeout
+# Gauges (jobs, cache, models) are computed at scrape time.
+# ------------------------
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRICS = []
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", " ").replace('"', '\\"')
+
+
+def _metric_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_metric_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # label values → [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, [list(v[0]), v[1], v[2]]) for key, v in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_metric_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_metric_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_metric_labels(self.labels, key)} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """Gauge (or externally counted counter) whose values are read at scrape time."""
+
+    def __init__(self, name, help_text, collect, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.collect = collect   # → {label values tuple: value}
+        self.labels = tuple(labels)
+        self.kind = kind
+        METRICS.append(self)
+
+    def samples(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Metric {self.name} collection failed: {e}")
+            return []
+        return [f"{self.name}{_metric_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("gradex_stage_seconds", "Wall time of one pipeline stage call.", ("stage",))
+OCR_SECONDS = Histogram("gradex_ocr_seconds", "Wall time of one OCR backend call.", ("backend",))
+OCR_PAGES = Counter("gradex_ocr_pages_total", "Pages sent to OCR by backend and outcome.", ("backend", "outcome"))
+OCR_RETRIES = Counter("gradex_ocr_retries_total", "OCR calls retried after an error.", ("backend",))
+MONGO_WRITES = Counter("gradex_mongo_writes_total", "MongoDB writes by operation and outcome.", ("operation", "outcome"))
+
+
+def timed_stage(stage):
+    """Decorator: records each call in gradex_stage_seconds{stage}."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def mongo_write(operation):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        MONGO_WRITES.inc(operation=operation, outcome="error")
+        raise
+    else:
+        MONGO_WRITES.inc(operation=operation, outcome="ok")
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="mongo_write")
+
+
+# ------------------------
+# Page Store ✅
+# Rendered pages are kept as compact grayscale uint8 arrays (1 byte per
+# pixel instead of a 3-byte RGB PIL image). Every visual consumer works
+# in grayscale anyway; CLIP/DINO get an RGB view on demand.
+#
+# GRADEX_PAGE_STORE_SCALE < 1 keeps a downscaled copy for visual scoring
+# (OCR still reads the full render before it is released).
+# GRADEX_PAGE_CACHE_DIR, when set, spills every page to a .npy file and
+# keeps only a read-only memory map, so resident memory stays bounded no
+# matter how many pages a script has.
+# ------------------------
+PAGE_STORE_SCALE = float(os.getenv("GRADEX_PAGE_STORE_SCALE", "1.0"))
+PAGE_CACHE_DIR = os.getenv("GRADEX_PAGE_CACHE_DIR")
+
+
+class PageStore:
+    """
+    Dict-like page_index → grayscale page array, optionally memory-mapped from disk.
+
+    persist_dir → keep the pages in this directory (e.g. an exam's teacher
+                  key) instead of a temporary one removed with the store.
+    """
+
+    def __init__(self, cache_dir=PAGE_CACHE_DIR, scale=PAGE_STORE_SCALE, persist_dir=None):
+        self.scale = scale
+        self._pages = {}
+        self._dir = None
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+            self._dir = persist_dir
+        elif cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._dir = tempfile.mkdtemp(prefix="pages_", dir=cache_dir)
+            # Remove the spilled pages once nothing references this store
+            weakref.finalize(self, shutil.rmtree, self._dir, True)
+
+    @classmethod
+    def load(cls, persist_dir):
+        """Re-opens pages saved under persist_dir as read-only memory maps."""
+        store = cls(persist_dir=persist_dir)
+        for name in os.listdir(persist_dir):
+            if name.endswith(".npy"):
+                page_idx = int(name[:-4])
+                store._pages[page_idx] = np.load(os.path.join(persist_dir, name), mmap_mode="r")
+        return store
+
+    def __setitem__(self, page_idx, gray):
+        if self.scale < 1.0:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if self._dir is not None:
+            path = os.path.join(self._dir, f"{page_idx}.npy")
+            np.save(path, gray)
+            gray = np.load(path, mmap_mode="r")
+        self._pages[page_idx] = gray
+
+    def __getitem__(self, page_idx):
+        return self._pages[page_idx]
+
+    def __contains__(self, page_idx):
+        return page_idx in self._pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, page_idx, default=None):
+        return self._pages.get(page_idx, default)
+
+    def keys(self):
+        return self._pages.keys()
+
+    def relocate(self, persist_dir):
+        """Points the store at persist_dir after its directory was renamed there (open maps stay valid)."""
+        self._dir = persist_dir
+
+    def discard(self, page_idx):
+        """Drops one page (and its spilled file) once it is no longer needed."""
+        if self._pages.pop(page_idx, None) is not None and self._dir is not None:
+            path = os.path.join(self._dir, f"{page_idx}.npy")
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        self._pages.clear()
+        if self._dir is not None:
+            for name in os.listdir(self._dir):
+                os.remove(os.path.join(self._dir, name))
+
+
+def to_gray(img):
+    """Grayscale uint8 array for a page/strip stored as an array or given as a PIL image."""
+    if isinstance(img, np.ndarray):
+        return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return cv2.cvtColor(np.array(img.convert("RGB")), cv2.COLOR_RGB2GRAY)
+
+
+def to_pil_rgb(img):
+    """RGB PIL view of a page/strip, for the CLIP/DINO preprocessors."""
+    if isinstance(img, np.ndarray):
+        return Image.fromarray(np.ascontiguousarray(img)).convert("RGB")
+    return img.convert("RGB")
 
 
 # ------------------------
 # Globals
 # ------------------------
-processing_mode = None
-teacher_answers = []
-exam_name = None
+# ✅ Background grading jobs (job_id → job record)
+GRADING_WORKERS = int(os.getenv("GRADEX_GRADING_WORKERS", "2"))
+MAX_PENDING_JOBS = int(os.getenv("GRADEX_MAX_PENDING_JOBS", "50"))
+JOB_RETENTION_SECONDS = int(os.getenv("GRADEX_JOB_RETENTION_SECONDS", "3600"))
+
+grading_jobs = {}
+grading_jobs_lock = threading.Lock()
+grading_executor = ThreadPoolExecutor(max_workers=GRADING_WORKERS, thread_name_prefix="gradex-job")
+
+# ✅ Bulk class grading (batch_id → batch record); one worker per core by default
+BATCH_WORKERS = int(os.getenv("GRADEX_BATCH_WORKERS", str(os.cpu_count() or 2)))
+MAX_BATCH_SIZE = int(os.getenv("GRADEX_MAX_BATCH_SIZE", "500"))
+# Size limits per script and per batch (ZIP members uncompressed + multipart PDFs).
+# ZIP members are checked against the archive's directory before anything is decompressed.
+MAX_BATCH_MEMBER_MB = float(os.getenv("GRADEX_MAX_BATCH_MEMBER_MB", "50"))
+MAX_BATCH_TOTAL_MB = float(os.getenv("GRADEX_MAX_BATCH_TOTAL_MB", "2048"))
+BATCH_REPORT_FLUSH_SIZE = int(os.getenv("GRADEX_BATCH_REPORT_FLUSH_SIZE", "50"))
 
-# ✅ Store page images
-teacher_page_images = {}
-student_page_images = {}
+grading_batches = {}
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="gradex-batch")
 
 
 # ------------------------
-# NLTK Setup
+# Model Registry ✅
+# Every model is loaded on first use (or by /warmup), once per process,
+# and the registry records load time and memory for each one.
+# /health/ready reports whether the models in GRADEX_READY_MODELS are
+# loaded; /health/live only says the process is up.
 # ------------------------
-nltk.download("punkt", quiet=True)
-nltk.download("stopwords", quiet=True)
-nltk.download("wordnet", quiet=True)
-nltk.download("punkt_tab", quiet=True)
+def _rss_mb():
+    """Resident set size of this process in MB (Linux), or None."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _module_mb(*objects):
+    """Parameter + buffer size of any torch modules among objects, in MB."""
+    total = 0
+    for obj in objects:
+        if hasattr(obj, "parameters") and hasattr(obj, "buffers"):
+            for tensor in list(obj.parameters()) + list(obj.buffers()):
+                total += tensor.numel() * tensor.element_size()
+    return total / (1024 * 1024) if total else None
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._locks = {}
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+
+    def names(self):
+        return list(self._loaders)
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get(self, name):
+        """Returns the loaded model, loading it on first use. Raises if loading failed."""
+        if name in self._models:
+            return self._models[name]
+        with self._locks[name]:
+            if name in self._models:
+                return self._models[name]
+            stats = self._stats.get(name)
+            if stats is not None and stats["error"]:
+                raise RuntimeError(stats["error"])
+
+            rss_before = _rss_mb()
+            started = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                print(f"⚠️  {name} model load failed: {e}")
+                self._stats[name] = {"error": str(e)}
+                raise
+            load_seconds = time.perf_counter() - started
+            rss_after = _rss_mb()
+
+            model_objects = model if isinstance(model, tuple) else (model,)
+            param_mb = _module_mb(*model_objects)
+            self._stats[name] = {
+                "error": None,
+                "load_seconds": round(load_seconds, 3),
+                "param_mb": round(param_mb, 1) if param_mb else None,
+                "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before and rss_after else None,
+            }
+            self._models[name] = model
+            print(f"✅ {name} model loaded in {load_seconds:.1f}s.")
+            return model
+
+    def try_get(self, name):
+        """Like get(), but returns None when the model is unavailable."""
+        try:
+            return self.get(name)
+        except Exception:
+            return None
+
+    def status(self):
+        return {
+            name: {"loaded": name in self._models, **self._stats.get(name, {})}
+            for name in self._loaders
+        }
+
+
+models = ModelRegistry()
 
-lemmatizer = WordNetLemmatizer()
-stop_words = set(stopwords.words("english"))
+
+# ------------------------
+# NLTK Setup
+# Downloads only the resources that are not installed yet, so a
+# provisioned server starts without network access.
+# ------------------------
+NLTK_RESOURCES = {
+    "punkt": "tokenizers/punkt",
+    "punkt_tab": "tokenizers/punkt_tab",
+    "stopwords": "corpora/stopwords",
+    "wordnet": "corpora/wordnet",
+}
 negation_words = {"not", "never", "no", "none", "cannot", "n't"}
 
 
+def _load_nltk():
+    import nltk
+    from nltk.corpus import stopwords
+    from nltk.stem import WordNetLemmatizer
+    from nltk.tokenize import word_tokenize
+
+    for resource, path in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(resource, quiet=True)
+
+    return {
+        "word_tokenize": word_tokenize,
+        "lemmatizer": WordNetLemmatizer(),
+        "stop_words": set(stopwords.words("english")),
+    }
+
+
+models.register("nltk", _load_nltk)
+
+
 # ------------------------
 # Load ENV + Models
 # ------------------------
-load_dotenv()
+def _load_sbert():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer("all-MiniLM-L6-v2")
 
-sbert_model = SentenceTransformer("all-MiniLM-L6-v2")
 
-gemini_client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+models.register("sbert", _load_sbert)
+
+
+def get_sbert():
+    return models.get("sbert")
+
+
+# Per-request HTTP timeout for Gemini OCR calls, in seconds (the client takes milliseconds)
+OCR_REQUEST_TIMEOUT = float(os.getenv("GRADEX_OCR_REQUEST_TIMEOUT", "60"))
+
+
+def _load_gemini():
+    from google import genai
+    return genai.Client(
+        api_key=os.getenv("GOOGLE_API_KEY"),
+        http_options={"timeout": int(OCR_REQUEST_TIMEOUT * 1000)},
+    )
+
+
+models.register("gemini", _load_gemini)
+
+# ------------------------
+# Cross-Encoder Scoring Tier ✅
+#   full      → stsb-roberta-large, fp32 (reference scores)
+#   int8      → stsb-roberta-large with dynamic int8 quantization of Linear layers
+#   distilled → stsb-distilroberta-base, a smaller STS cross-encoder
+# Selected with GRADEX_CROSS_ENCODER_TIER; use calibrate_cross_encoder.py
+# to measure agreement with the full model before switching.
+# ------------------------
+CROSS_ENCODER_TIERS = {
+    "full": "cross-encoder/stsb-roberta-large",
+    "int8": "cross-encoder/stsb-roberta-large",
+    "distilled": "cross-encoder/stsb-distilroberta-base",
+}
+CROSS_ENCODER_TIER = os.getenv("GRADEX_CROSS_ENCODER_TIER", "full").strip().lower()
+if CROSS_ENCODER_TIER not in CROSS_ENCODER_TIERS:
+    print(f"⚠️  Unknown cross-encoder tier '{CROSS_ENCODER_TIER}', using 'full'.")
+    CROSS_ENCODER_TIER = "full"
+
+
+def load_cross_encoder(tier):
+    """Returns (model, tokenizer) for a scoring tier."""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    model_name = CROSS_ENCODER_TIERS[tier]
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model.eval()
+    if tier == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, tokenizer
+
+
+models.register("cross_encoder", lambda: load_cross_encoder(CROSS_ENCODER_TIER))
+
+
+def get_cross_encoder():
+    """(model, tokenizer) for the configured tier."""
+    return models.get("cross_encoder")
 
-cross_encoder_model = AutoModelForSequenceClassification.from_pretrained(
-    "cross-encoder/stsb-roberta-large"
-)
-cross_encoder_tokenizer = AutoTokenizer.from_pretrained(
-    "cross-encoder/stsb-roberta-large"
-)
 
 # ------------------------
 # Load CLIP Model ✅
 # ------------------------
-if _CLIP_AVAILABLE:
+def _torch_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _load_clip():
     try:
-        _clip_device = "cuda" if torch.cuda.is_available() else "cpu"
-        _clip_model, _clip_preprocess = clip_lib.load("ViT-B/32", device=_clip_device)
-        _clip_model.eval()
-        print("✅ CLIP model loaded.")
-    except Exception as _e:
-        _CLIP_AVAILABLE = False
-        print(f"⚠️  CLIP model load failed: {_e}")
+        import clip as clip_lib
+    except ImportError:
+        raise RuntimeError("clip package not installed. CLIP similarity will be skipped.")
+    device = _torch_device()
+    clip_model, clip_preprocess = clip_lib.load("ViT-B/32", device=device)
+    clip_model.eval()
+    return clip_model, clip_preprocess, device
+
+
+models.register("clip", _load_clip)
+
 
 # ------------------------
 # Load DINO Model (facebook/dino-vitb16) ✅
 # ------------------------
-_DINO_AVAILABLE = False
-if _TORCHVISION_AVAILABLE:
+def _load_dino():
+    try:
+        import torchvision  # noqa: F401  (DINO pre-processing dependency)
+    except ImportError:
+        raise RuntimeError("torchvision not installed. DINO similarity will be skipped.")
+    from transformers import ViTFeatureExtractor, ViTModel
+
+    device = _torch_device()
+    dino_extractor = ViTFeatureExtractor.from_pretrained("facebook/dino-vitb16")
+    dino_model = ViTModel.from_pretrained("facebook/dino-vitb16")
+    dino_model.eval()
+    dino_model.to(device)
+    return dino_extractor, dino_model, device
+
+
+models.register("dino", _load_dino)
+
+
+# ------------------------
+# Inference Sidecar Client ✅
+# With GRADEX_INFERENCE_ADDRESS set (host:port or a Unix socket path),
+# SBERT, the cross-encoder, CLIP and DINO run in one shared
+# inference_server.py process instead of in every web worker. The
+# sidecar batches requests from all workers together.
+#
+# The channel carries pickled messages, so both ends must share a secret
+# GRADEX_INFERENCE_AUTHKEY (e.g. `python -c "import secrets; print(secrets.token_hex(32))"`);
+# there is no default key.
+# ------------------------
+INFERENCE_ADDRESS = os.getenv("GRADEX_INFERENCE_ADDRESS", "").strip()
+INFERENCE_AUTHKEY = os.getenv("GRADEX_INFERENCE_AUTHKEY", "").strip().encode()
+REMOTE_MODELS = ("sbert", "cross_encoder", "clip", "dino")
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+if INFERENCE_ADDRESS and not INFERENCE_AUTHKEY:
+    raise RuntimeError("GRADEX_INFERENCE_ADDRESS is set but GRADEX_INFERENCE_AUTHKEY is not")
+
+
+def parse_inference_address(value):
+    """"127.0.0.1:6001" → ("127.0.0.1", 6001); anything else is a Unix socket path."""
+    host, sep, port = value.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return value
+
+
+class InferenceClient:
+    """One connection per thread; reconnects once if the sidecar restarted."""
+
+    def __init__(self, address, authkey):
+        self.address = parse_inference_address(address)
+        self.authkey = authkey
+        self._local = threading.local()
+        self._available = {}
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = ConnectionClient(self.address, authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def call(self, op, payload=None):
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((op, payload))
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._local.conn = None
+                if attempt == 1:
+                    raise
+        if status != "ok":
+            raise RuntimeError(f"inference server {op} failed: {result}")
+        return result
+
+    def available(self, name):
+        if name not in self._available:
+            self._available[name] = self.call("available", name)
+        return self._available[name]
+
+
+inference_client = InferenceClient(INFERENCE_ADDRESS, INFERENCE_AUTHKEY) if INFERENCE_ADDRESS else None
+
+
+def clip_available():
+    if inference_client is not None:
+        try:
+            return inference_client.available("clip")
+        except Exception as e:
+            print(f"⚠️  Inference server unavailable: {e}")
+            return False
+    return models.try_get("clip") is not None
+
+
+def dino_available():
+    if inference_client is not None:
+        try:
+            return inference_client.available("dino")
+        except Exception as e:
+            print(f"⚠️  Inference server unavailable: {e}")
+            return False
+    return models.try_get("dino") is not None
+
+
+def model_status():
+    """Registry status, with the sidecar's view of the models it owns."""
+    status = models.status()
+    if inference_client is None:
+        return status
     try:
-        _dino_device = "cuda" if torch.cuda.is_available() else "cpu"
-        _dino_extractor = ViTFeatureExtractor.from_pretrained("facebook/dino-vitb16")
-        _dino_model = ViTModel.from_pretrained("facebook/dino-vitb16")
-        _dino_model.eval()
-        _dino_model.to(_dino_device)
-        _DINO_AVAILABLE = True
-        print("✅ DINO model loaded.")
-    except Exception as _e:
-        print(f"⚠️  DINO model load failed: {_e}")
+        remote = inference_client.call("status")
+    except Exception as e:
+        remote = {name: {"loaded": False, "error": f"inference server unreachable: {e}"} for name in REMOTE_MODELS}
+    for name in REMOTE_MODELS:
+        status[name] = {**remote.get(name, {"loaded": False}), "remote": True}
+    return status
 
 
 # ------------------------
 # Image Preprocessing
 # ------------------------
 def clean_for_handwriting(pil_img):
-    img = np.array(pil_img)
-    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    gray = to_gray(pil_img)
     blur = cv2.GaussianBlur(gray, (3, 3), 0)
 
     thresh = cv2.adaptiveThreshold(
@@ -158,94 +752,672 @@ def clean_for_handwriting(pil_img):
 # NLP Similarity
 # ------------------------
 def preprocess_text(text):
-    tokens = word_tokenize(text.lower())
-    tokens = [lemmatizer.lemmatize(word) for word in tokens if word not in stop_words]
+    nlp = models.get("nltk")
+    tokens = nlp["word_tokenize"](text.lower())
+    tokens = [nlp["lemmatizer"].lemmatize(word) for word in tokens if word not in nlp["stop_words"]]
     return " ".join(tokens)
 
 
 def contains_negation(text):
-    tokens = set(word_tokenize(text.lower()))
+    tokens = set(models.get("nltk")["word_tokenize"](text.lower()))
     return any(word in negation_words for word in tokens)
 
 
-def bert_similarity(student_answer, original_answer):
-    student_answer_clean = preprocess_text(student_answer)
-    original_answer_clean = preprocess_text(original_answer)
+TEXT_BATCH_SIZE = int(os.getenv("GRADEX_TEXT_BATCH_SIZE", "32"))
+
+
+def _local_sbert_encode(texts):
+    return get_sbert().encode(texts, convert_to_tensor=True, batch_size=max(len(texts), 1))
+
+
+def _local_cross_encoder_scores(pairs):
+    """sigmoid(logit) * 100 for cleaned (student, original) pairs, in input order."""
+    import torch
+
+    cross_encoder_model, cross_encoder_tokenizer = get_cross_encoder()
+
+    # Sort by length so each padded cross-encoder batch wastes little padding
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+    scores = [0.0] * len(pairs)
+    for offset in range(0, len(order), TEXT_BATCH_SIZE):
+        chunk = order[offset: offset + TEXT_BATCH_SIZE]
+        inputs = cross_encoder_tokenizer(
+            [pairs[i][0] for i in chunk],
+            [pairs[i][1] for i in chunk],
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+        )
+        with torch.no_grad():
+            logits = cross_encoder_model(**inputs).logits
+        for i, score in zip(chunk, (torch.sigmoid(logits[:, 0]) * 100).tolist()):
+            scores[i] = score
+    return scores
+
+
+@timed_stage("sbert")
+def sbert_encode(texts):
+    """SBERT embeddings, one row per text (through the inference sidecar when configured)."""
+    if inference_client is not None:
+        import torch
+        return torch.from_numpy(np.asarray(inference_client.call("sbert_encode", list(texts))))
+    return _local_sbert_encode(list(texts))
+
+
+@timed_stage("cross_encoder")
+def cross_encoder_scores(pairs):
+    if inference_client is not None:
+        return inference_client.call("cross_encoder", list(pairs))
+    return _local_cross_encoder_scores(list(pairs))
+
+
+def text_features(text):
+    """
+    Teacher-side half of bert_similarity_batch: cleaned text, SBERT embedding
+    and negation flag. Computed once per answer-key question.
+    """
+    text_clean = preprocess_text(text)
+    return {
+        "clean": text_clean,
+        "embedding": sbert_encode([text_clean])[0],
+        "has_negation": contains_negation(text),
+    }
+
+
+def text_features_batch(texts):
+    """text_features for many texts with one SBERT batch (e.g. a script's answers)."""
+    if not texts:
+        return []
+    clean = [preprocess_text(text) for text in texts]
+    embeddings = sbert_encode(clean)
+    return [
+        {"clean": text_clean, "embedding": embedding, "has_negation": contains_negation(text)}
+        for text, text_clean, embedding in zip(texts, clean, embeddings)
+    ]
+
+
+def bert_similarity_batch(pairs, original_features=None, student_features=None):
+    """
+    SBERT cosine and cross-encoder scores for many (student_answer, original_answer)
+    pairs, e.g. every question of a script or of a whole class.
+
+    Students are encoded in one padded SBERT batch (originals too, unless
+    original_features from the compiled key are given) and all pairs go
+    through the cross-encoder in padded batches of TEXT_BATCH_SIZE.
+    student_features → optional text_features of the students (live or stored
+    artifacts, embeddings as tensors or lists); their SBERT pass is skipped.
+    Returns [(similarity_score, contextual_score), ...] in input order,
+    both halved when only one side of a pair contains a negation.
+    """
+    if not pairs:
+        return []
+
+    import torch
+    from sentence_transformers import util
+
+    if original_features is None:
+        original_features = [None] * len(pairs)
 
-    emb1 = sbert_model.encode(student_answer_clean, convert_to_tensor=True)
-    emb2 = sbert_model.encode(original_answer_clean, convert_to_tensor=True)
+    if student_features is None:
+        student_clean = [preprocess_text(student) for student, _ in pairs]
+        texts_to_encode = list(student_clean)
+    else:
+        student_clean = [features["clean"] for features in student_features]
+        texts_to_encode = []
+
+    # Teacher-side features: reuse compiled ones, batch-encode the rest
+    missing = [i for i, features in enumerate(original_features) if features is None]
+    original_clean = [
+        features["clean"] if features is not None else preprocess_text(pairs[i][1])
+        for i, features in enumerate(original_features)
+    ]
+
+    texts_to_encode += [original_clean[i] for i in missing]
+    embeddings = sbert_encode(texts_to_encode) if texts_to_encode else []
+    if student_features is None:
+        student_emb = embeddings[: len(pairs)]
+    else:
+        student_emb = torch.stack([
+            torch.as_tensor(features["embedding"]).float().cpu() for features in student_features
+        ])
+    missing_emb = dict(zip(missing, embeddings[len(texts_to_encode) - len(missing):]))
+    original_emb = torch.stack([
+        missing_emb[i] if features is None else features["embedding"]
+        for i, features in enumerate(original_features)
+    ]).to(student_emb.device)
+
+    similarities = (util.pairwise_cos_sim(student_emb, original_emb) * 100).tolist()
+    contextual = cross_encoder_scores(list(zip(student_clean, original_clean)))
+
+    results = []
+    for i, (student_answer, original_answer) in enumerate(pairs):
+        similarity, contextual_score = similarities[i], contextual[i]
+        if student_features is not None:
+            student_has_negation = student_features[i]["has_negation"]
+        else:
+            student_has_negation = contains_negation(student_answer)
+        if original_features[i] is not None:
+            original_has_negation = original_features[i]["has_negation"]
+        else:
+            original_has_negation = contains_negation(original_answer)
+
+        if student_has_negation != original_has_negation:
+            similarity *= 0.5
+            contextual_score *= 0.5
+        results.append((similarity, contextual_score))
+    return results
+
+
+# ------------------------
+# OCR Backends ✅
+#   gemini → Gemini vision model (production)
+#   stub   → deterministic local text with simulated latency, for
+#            load-testing the concurrent OCR path offline
+# Selected with GRADEX_OCR_BACKEND; register_ocr_backend() adds more.
+# A backend takes a PIL image and returns raw text, raising on failure.
+# ------------------------
+OCR_BACKEND = os.getenv("GRADEX_OCR_BACKEND", "gemini").strip().lower()
+OCR_CONCURRENCY = int(os.getenv("GRADEX_OCR_CONCURRENCY", "4"))
+OCR_RATE_PER_MINUTE = float(os.getenv("GRADEX_OCR_RATE_PER_MINUTE", "120"))
+OCR_MAX_RETRIES = int(os.getenv("GRADEX_OCR_MAX_RETRIES", "3"))
+OCR_BACKOFF_SECONDS = float(os.getenv("GRADEX_OCR_BACKOFF_SECONDS", "1.0"))
+OCR_PAGE_TIMEOUT = float(os.getenv("GRADEX_OCR_PAGE_TIMEOUT", "180"))
+STUB_OCR_LATENCY = float(os.getenv("GRADEX_STUB_OCR_LATENCY", "0.5"))
+
+GEMINI_OCR_MODEL = "models/gemini-2.5-flash"
+GEMINI_OCR_PROMPT = (
+    "You are an OCR engine. Read this handwritten answer sheet. "
+    "Extract ALL visible handwritten text exactly as written. "
+    "Do NOT summarize. Do NOT explain. Output only the raw text."
+)
+# Bump when the prompt or the page pre-processing changes so cached OCR is not reused
+OCR_PROMPT_VERSION = "1"
+
+
+def gemini_ocr(image):
+    response = models.get("gemini").models.generate_content(
+        model=GEMINI_OCR_MODEL,
+        contents=[GEMINI_OCR_PROMPT, image],
+    )
+    return response.text or ""
 
-    similarity = util.pytorch_cos_sim(emb1, emb2).item() * 100
 
-    inputs = cross_encoder_tokenizer(
-        student_answer_clean,
-        original_answer_clean,
-        return_tensors="pt",
-        truncation=True,
+def stub_ocr(image):
+    """Fake handwriting OCR: sleeps like a network call, returns text derived from the pixels."""
+    time.sleep(STUB_OCR_LATENCY)
+    digest = hashlib.sha1(image.tobytes()).hexdigest()
+    return (
+        f"1) Stub question one\nStub answer {digest[:8]} describing the first concept.\n"
+        f"2) Stub question two\nStub answer {digest[8:16]} describing the second concept."
     )
 
-    with torch.no_grad():
-        logits = cross_encoder_model(**inputs).logits
-    contextual_score = torch.sigmoid(logits).item() * 100
-    student_has_negation = contains_negation(student_answer)
-    original_has_negation = contains_negation(original_answer)
 
-    if student_has_negation != original_has_negation:
-        similarity *= 0.5
-        contextual_score *= 0.5
-    return similarity, contextual_score
+OCR_BACKENDS = {
+    "gemini": gemini_ocr,
+    "stub": stub_ocr,
+}
+
+
+def register_ocr_backend(name, fn):
+    OCR_BACKENDS[name] = fn
+
+
+if OCR_BACKEND not in OCR_BACKENDS:
+    print(f"⚠️  Unknown OCR backend '{OCR_BACKEND}', using 'gemini'.")
+    OCR_BACKEND = "gemini"
 
 
 # ------------------------
-# OCR Using Gemini
+# OCR Rate Limiting ✅
+# Token bucket shared by every request in the process so concurrent
+# scripts together stay under the Gemini quota.
 # ------------------------
-def extract_text_from_image(image):
-    try:
-        response = gemini_client.models.generate_content(
-            model="models/gemini-2.5-flash",
-            contents=[
-                "You are an OCR engine. Read this handwritten answer sheet. "
-                "Extract ALL visible handwritten text exactly as written. "
-                "Do NOT summarize. Do NOT explain. Output only the raw text.",
-                image,
-            ],
-        )
-        text = response.text.strip()
-        if len(text) < 5:
-            return "NO_TEXT_DETECTED"
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Blocks until a token is available; returns False if timeout elapses first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+ocr_rate_limiter = TokenBucket(OCR_RATE_PER_MINUTE / 60.0, capacity=max(OCR_CONCURRENCY, 1))
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_CONCURRENCY, thread_name_prefix="gradex-ocr")
+
+
+# ------------------------
+# OCR Using Gemini (or the configured backend) ✅
+# Rate-limited, retried with exponential backoff + jitter, and bounded
+# by a per-page deadline. Only a page that keeps failing becomes OCR_ERROR.
+# ------------------------
+def extract_text_from_image(image, backend=None):
+    backend = backend or OCR_BACKEND
+    ocr_fn = OCR_BACKENDS[backend]
+    deadline = time.monotonic() + OCR_PAGE_TIMEOUT
+
+    for attempt in range(OCR_MAX_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not ocr_rate_limiter.acquire(timeout=remaining):
+            print(f"{backend} OCR timed out after {attempt} attempt(s)")
+            OCR_PAGES.inc(backend=backend, outcome="timeout")
+            return "OCR_ERROR"
+        try:
+            with OCR_SECONDS.time(backend=backend):
+                text = ocr_fn(image).strip()
+            if len(text) < 5:
+                OCR_PAGES.inc(backend=backend, outcome="empty")
+                return "NO_TEXT_DETECTED"
+            OCR_PAGES.inc(backend=backend, outcome="ok")
+            return text
+        except Exception as e:
+            print(f"{backend} OCR failed (attempt {attempt + 1}/{OCR_MAX_RETRIES + 1}):", e)
+            if attempt == OCR_MAX_RETRIES:
+                break
+            backoff = OCR_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random())
+            if time.monotonic() + backoff >= deadline:
+                break
+            OCR_RETRIES.inc(backend=backend)
+            time.sleep(backoff)
+
+    OCR_PAGES.inc(backend=backend, outcome="error")
+    return "OCR_ERROR"
+
+
+# ------------------------
+# OCR Result Cache ✅
+# Content-addressed on-disk cache: the key is a hash of the rendered
+# page pixels plus the OCR backend and prompt version, so a re-uploaded
+# PDF (e.g. after fixing a name) skips OCR entirely.
+# Least-recently-used entries are evicted once the cache exceeds
+# GRADEX_OCR_CACHE_MAX_MB (file mtime is refreshed on every hit).
+# ------------------------
+OCR_CACHE_DIR = os.getenv("GRADEX_OCR_CACHE_DIR", os.path.join(UPLOAD_FOLDER, "ocr_cache"))
+OCR_CACHE_MAX_MB = float(os.getenv("GRADEX_OCR_CACHE_MAX_MB", "256"))
+OCR_CACHE_ENABLED = os.getenv("GRADEX_OCR_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Page texts that mean "OCR did not produce a result" are never cached
+_UNCACHEABLE_OCR = ("OCR_ERROR", "EXTRACTION_ERROR")
+
+
+class OCRCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None   # total bytes on disk, computed on first write
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(width, height, samples, backend, version):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{backend}|{version}|{width}x{height}|".encode())
+        h.update(samples)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)   # mark as recently used
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
         return text
-    except Exception as e:
-        print("Gemini OCR failed:", e)
-        return "OCR_ERROR"
+
+    def put(self, key, text):
+        if text in _UNCACHEABLE_OCR:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            previous_size = os.path.getsize(path)   # overwriting a key replaces its bytes
+        except OSError:
+            previous_size = 0
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            new_size = os.path.getsize(path)
+        except OSError as e:
+            print(f"OCR cache write failed: {e}")
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += new_size - previous_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".txt"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Deletes least-recently-used entries down to 90% of max_bytes. Caller holds the lock."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            self.evictions += 1
+        self._size = size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "size_bytes": self._size if self._size is not None else self._disk_usage(),
+                "max_bytes": self.max_bytes,
+            }
+
+
+ocr_cache = OCRCache(OCR_CACHE_DIR, int(OCR_CACHE_MAX_MB * 1024 * 1024)) if OCR_CACHE_ENABLED else None
+
+
+def _ocr_student_page(img, cache_key):
+    """Worker task: clean + OCR one student page, then store it in the OCR cache."""
+    text = extract_text_from_image(clean_for_handwriting(img))
+    if ocr_cache is not None:
+        ocr_cache.put(cache_key, text)
+    return text
+
+
+# ------------------------
+# PDF Text Layer ✅
+# Typed answer keys exported to PDF already carry their text. Reading
+# the PyMuPDF text layer is near-instant and exact, so Tesseract only
+# runs on scanned pages (no or too little embedded text).
+# ------------------------
+TEXT_LAYER_MIN_CHARS = int(os.getenv("GRADEX_TEXT_LAYER_MIN_CHARS", "20"))
+
+
+def extract_text_layer(page):
+    """
+    Returns the page's embedded text in reading order, or None when the
+    page looks scanned. Text blocks are ordered top-to-bottom, then
+    left-to-right, using their bounding boxes.
+    """
+    blocks = [
+        (y0, x0, text.strip())
+        for x0, y0, x1, y1, text, block_no, block_type in page.get_text("blocks")
+        if block_type == 0 and text.strip()
+    ]
+    blocks.sort(key=lambda block: (round(block[0], 1), block[1]))
+    text = "\n".join(block_text for _, _, block_text in blocks)
+    if len(text.replace(" ", "").replace("\n", "")) < TEXT_LAYER_MIN_CHARS:
+        return None
+    return text
+
+
+# ------------------------
+# Uploaded PDFs ✅ (content-addressed)
+# Uploads are read into memory and opened with fitz straight from the
+# bytes; nothing is re-read from disk. A copy is kept once per distinct
+# file under uploads/pdfs/<sha256>.pdf, so re-submissions share it and
+# same-named uploads never collide. Copies older than
+# GRADEX_UPLOAD_RETENTION_HOURS, or beyond GRADEX_UPLOAD_STORE_MAX_MB
+# (oldest first), are pruned. A retention of 0 keeps no copies.
+# ------------------------
+UPLOAD_STORE_DIR = os.getenv("GRADEX_UPLOAD_STORE_DIR", os.path.join(UPLOAD_FOLDER, "pdfs"))
+UPLOAD_RETENTION_HOURS = float(os.getenv("GRADEX_UPLOAD_RETENTION_HOURS", "72"))
+UPLOAD_STORE_MAX_MB = float(os.getenv("GRADEX_UPLOAD_STORE_MAX_MB", "2048"))
+UPLOAD_PRUNE_INTERVAL = 600   # seconds between retention sweeps
+
+
+def pdf_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def open_pdf(source):
+    """fitz document from a file path or from the PDF bytes themselves."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    return fitz.open(source)
+
+
+class UploadStore:
+    """sha256 → stored PDF copy, with age and size based retention."""
+
+    def __init__(self, directory, retention_hours, max_mb):
+        self.directory = directory
+        self.retention = retention_hours * 3600
+        self.max_bytes = max_mb * 1024 * 1024
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        if self.retention > 0:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.pdf")
+
+    def put(self, data):
+        """Stores the PDF bytes (once per content) and returns their sha256."""
+        digest = pdf_digest(data)
+        if self.retention <= 0:
+            return digest
+        path = self.path(digest)
+        try:
+            if os.path.exists(path):
+                os.utime(path)   # re-submitted → restart its retention window
+            else:
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  Could not store upload {digest[:12]}: {e}")
+        self.prune()
+        return digest
+
+    def prune(self, force=False):
+        """Drops expired copies, then the oldest ones while over the size budget."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_prune < UPLOAD_PRUNE_INTERVAL:
+                return
+            self._last_prune = now
+
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Leftover partial writes count as expired after the same window
+            if now - stat.st_mtime > self.retention:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass   # already pruned by a concurrent sweep
+
+
+upload_store = UploadStore(UPLOAD_STORE_DIR, UPLOAD_RETENTION_HOURS, UPLOAD_STORE_MAX_MB)
+
+
+def read_pdf_upload(pdf_file):
+    """Request file → (PDF bytes, sha256); the bytes are also kept in upload_store."""
+    data = pdf_file.read()
+    return data, upload_store.put(data)
 
 
 # ------------------------
 # Extract PDF text + store page images ✅
 # ------------------------
-def extract_text_from_pdf(pdf_path):
-    global processing_mode, teacher_page_images, student_page_images
-    doc = fitz.open(pdf_path)
-    extracted_text_list = []
+PDF_RENDER_ZOOM = 4   # 72 dpi × 4 = 288 dpi page images
+
+
+def _future_page_text(future):
+    try:
+        return future.result() or "NO_TEXT_DETECTED"
+    except Exception:
+        return "EXTRACTION_ERROR"
+
+
+def extract_text_from_pdf(pdf_source, mode="student", page_images=None, on_page=None, page_sources=None,
+                          on_text=None, page_slots=None):
+    """
+    OCRs every page of the PDF and stores the rendered page images.
+
+    pdf_source   → PDF bytes (uploads) or a file path.
+    mode         → "teacher" or "student".
+    page_images  → PageStore to fill with grayscale page arrays; every request
+                   or job passes its own store so concurrent scripts don't share state.
+    on_page      → optional callback(page_index, total_pages) after each page.
+    page_sources → optional dict filled with page_index → "text_layer" / "cache" / "ocr".
+    on_text      → optional callback(page_index, text, total_pages), called in page
+                   order as soon as each page's text is ready (from OCR threads),
+                   while later pages are still being rendered and OCR'd.
+    page_slots   → optional semaphore acquired before each page is rendered; the
+                   caller releases it once it is done with that page (grading pipeline).
+    """
+    if page_sources is None:
+        page_sources = {}
+    if page_images is None:
+        page_images = PageStore()
+
+    doc = open_pdf(pdf_source)
+    total_pages = len(doc)
+
+    ready_texts, next_emit, emit_lock = {}, [0], threading.Lock()
+
+    def emit(page_idx, text):
+        if on_text is None:
+            return
+        with emit_lock:
+            ready_texts[page_idx] = text
+            while next_emit[0] in ready_texts:
+                on_text(next_emit[0], ready_texts.pop(next_emit[0]), total_pages)
+                next_emit[0] += 1
+
+    # Student pages are rendered here and OCR'd concurrently on ocr_executor;
+    # each slot holds either the page text or a Future for it. At most
+    # 2 × OCR_CONCURRENCY full-resolution pages are in flight at once, so
+    # memory does not grow with the page count.
+    page_results = []
+    inflight = threading.BoundedSemaphore(max(OCR_CONCURRENCY, 1) * 2)
     for i, page in enumerate(doc):
+        if page_slots is not None:
+            page_slots.acquire()
         try:
-            pix = page.get_pixmap(matrix=fitz.Matrix(4, 4))
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-            if processing_mode == "teacher":
-                teacher_page_images[i] = img
-                text = pytesseract.image_to_string(img).strip()
+            with STAGE_SECONDS.time(stage="render"):
+                pix = page.get_pixmap(matrix=fitz.Matrix(PDF_RENDER_ZOOM, PDF_RENDER_ZOOM), colorspace=fitz.csGRAY)
+            gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width).copy()
+            page_images[i] = gray
+
+            # ✅ Digital teacher keys: use the embedded text, no OCR needed
+            result = extract_text_layer(page) if mode == "teacher" else None
+            if result is not None:
+                page_sources[i] = "text_layer"
             else:
-                student_page_images[i] = img
-                clean_img = clean_for_handwriting(img)
-                text = extract_text_from_image(clean_img)
-
-            extracted_text_list.append(text if text else "NO_TEXT_DETECTED")
+                if mode == "teacher":
+                    backend, version = "tesseract", "1"
+                else:
+                    backend, version = OCR_BACKEND, f"{OCR_PROMPT_VERSION}|{GEMINI_OCR_MODEL}"
+                cache_key = OCRCache.make_key(pix.width, pix.height, pix.samples, backend, version)
+                result = ocr_cache.get(cache_key) if ocr_cache is not None else None
+                page_sources[i] = "cache" if result is not None else "ocr"
+
+                # ✅ On a cache hit the page skips OCR entirely
+                if result is None and mode == "teacher":
+                    with OCR_SECONDS.time(backend="tesseract"):
+                        result = pytesseract.image_to_string(Image.fromarray(gray)).strip()
+                    OCR_PAGES.inc(backend="tesseract", outcome="ok" if result else "empty")
+                    if ocr_cache is not None:
+                        ocr_cache.put(cache_key, result)
+                elif result is None:
+                    inflight.acquire()
+                    result = ocr_executor.submit(_ocr_student_page, gray, cache_key)
+                    result.add_done_callback(lambda _: inflight.release())
+            del pix, gray   # release the full-resolution render
 
         except Exception as e:
             print(f"Page {i+1} failed: {e}")
-            extracted_text_list.append("EXTRACTION_ERROR")
+            result = "EXTRACTION_ERROR"
+        page_results.append(result)
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future, i=i: emit(i, _future_page_text(future)))
+        else:
+            emit(i, result or "NO_TEXT_DETECTED")
 
     doc.close()
+
+    # ✅ Collect in page order so results line up with the page images
+    extracted_text_list = []
+    for i, result in enumerate(page_results):
+        if isinstance(result, Future):
+            try:
+                result = result.result()
+            except Exception as e:
+                print(f"Page {i+1} failed: {e}")
+                result = "EXTRACTION_ERROR"
+        extracted_text_list.append(result if result else "NO_TEXT_DETECTED")
+
+        if on_page:
+            on_page(i, total_pages)
+
     return extracted_text_list
 
 
@@ -254,6 +1426,10 @@ def extract_text_from_pdf(pdf_path):
 # ------------------------
 import re
 
+QUESTION_PATTERN = r'(?:^|\n)\s*(?:Q\.?\s*)?(\d+)[.)]\s*'
+
+
+@timed_stage("text_split")
 def split_text_by_questions(text):
     """
     Splits a block of text into individual question answers.
@@ -261,8 +1437,7 @@ def split_text_by_questions(text):
     Strips the question/prompt line — returns ONLY the student's answer text.
     Returns a list of (question_number, answer_text) tuples.
     """
-    pattern = r'(?:^|\n)\s*(?:Q\.?\s*)?(\d+)[.)]\s*'
-    splits = list(re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE))
+    splits = list(re.finditer(QUESTION_PATTERN, text, re.IGNORECASE | re.MULTILINE))
 
     if len(splits) < 1:
         return [(1, text.strip())]
@@ -289,45 +1464,178 @@ def split_text_by_questions(text):
     return questions
 
 
+def revise_question_text(text, q_idx, answer_text):
+    """
+    Page text with the answer of its q_idx-th question (as split by
+    split_text_by_questions) replaced; the question/prompt line is kept.
+    Returns None when the new answer would not split back out unchanged
+    (e.g. it starts its own numbered line), so the caller can ask for a
+    whole-page revision instead.
+    """
+    splits = list(re.finditer(QUESTION_PATTERN, text, re.IGNORECASE | re.MULTILINE))
+    if not splits:
+        revised = answer_text.strip()
+    else:
+        start = splits[q_idx].end()
+        end = splits[q_idx + 1].start() if q_idx + 1 < len(splits) else len(text)
+        lines = text[start:end].strip().split("\n")
+        prompt = lines[0] + "\n" if len(lines) > 1 else ""
+        revised = text[:start] + prompt + answer_text.strip() + text[end:]
+
+    questions = split_text_by_questions(revised)
+    if len(questions) != max(len(splits), 1) or questions[q_idx][1] != answer_text.strip():
+        return None
+    return revised
+
+
 
 # ------------------------
 # ✅ Split a page image into question regions by horizontal position
 # Uses the same question split boundaries found in teacher text
 # to crop the image proportionally
 # ------------------------
+def strip_bounds(height, num_questions):
+    """(top, bottom) rows of each of `num_questions` equal horizontal strips."""
+    if num_questions <= 1:
+        return [(0, height)]
+    strip_height = height // num_questions
+    return [
+        (i * strip_height, (i + 1) * strip_height if i < num_questions - 1 else height)
+        for i in range(num_questions)
+    ]
+
+
 def split_image_by_question_count(pil_img, num_questions):
     """
     Divides the page image into `num_questions` equal horizontal strips.
-    Returns a list of PIL images, one per question region.
+    Returns a list of strips, one per question region: row views for
+    grayscale page arrays (no copy), crops for PIL images.
     """
     if num_questions <= 1:
         return [pil_img]
 
-    width, height = pil_img.size
-    strip_height = height // num_questions
-    strips = []
-    for i in range(num_questions):
-        top = i * strip_height
-        bottom = (i + 1) * strip_height if i < num_questions - 1 else height
-        strip = pil_img.crop((0, top, width, bottom))
-        strips.append(strip)
-    return strips
+    is_array = isinstance(pil_img, np.ndarray)
+    if is_array:
+        height, width = pil_img.shape[:2]
+    else:
+        width, height = pil_img.size
+    return [
+        pil_img[top:bottom] if is_array else pil_img.crop((0, top, width, bottom))
+        for top, bottom in strip_bounds(height, num_questions)
+    ]
 
 
 # ------------------------
 # ✅ Image Similarity + Image Marks
 # ------------------------
-def image_similarity(img1, img2):
-    img1 = cv2.cvtColor(np.array(img1), cv2.COLOR_RGB2GRAY)
-    img2 = cv2.cvtColor(np.array(img2), cv2.COLOR_RGB2GRAY)
+def ssim_input(img):
+    """Grayscale 500x500 array used by image_similarity (cacheable per strip)."""
+    return cv2.resize(to_gray(img), (500, 500))
+
+
+# ------------------------
+# Image Similarity Backends ✅
+#   skimage → scikit-image SSIM at 500x500 (reference)
+#   fast    → box-filter SSIM in OpenCV/NumPy, numerically skimage's SSIM
+#             at the default GRADEX_FAST_SSIM_SCALES=1.0; scales below 1
+#             average over downsampled copies, which drifts off the
+#             image_marks bands (measure with the benchmark first)
+#   phash   → byte-identical strip pairs score 1.0 without SSIM (a hash
+#             match alone is not enough: a noisy rescan matches too), the
+#             rest use skimage
+# Default from GRADEX_IMAGE_SIMILARITY; an exam can pick its own at
+# /upload/teacher (imageSimilarity). benchmark_image_similarity.py
+# reports speed and image_marks band agreement against skimage.
+# A backend takes two 500x500 grayscale arrays and returns SSIM-like
+# similarity.
+# ------------------------
+IMAGE_SIMILARITY_BACKEND = os.getenv("GRADEX_IMAGE_SIMILARITY", "skimage").strip().lower()
+FAST_SSIM_SCALES = [
+    float(s) for s in os.getenv("GRADEX_FAST_SSIM_SCALES", "1.0").split(",") if s.strip()
+]
 
-    img1 = cv2.resize(img1, (500, 500))
-    img2 = cv2.resize(img2, (500, 500))
 
-    score, _ = ssim(img1, img2, full=True)
+def skimage_ssim(gray1, gray2):
+    from skimage.metrics import structural_similarity as ssim
+
+    score, _ = ssim(gray1, gray2, full=True)
     return score
 
 
+def box_ssim(gray1, gray2, win_size=7):
+    """
+    skimage's default SSIM (uniform 7x7 window, sample covariance,
+    data_range 255) with cv2.blur in place of scipy's uniform_filter.
+    """
+    a = gray1.astype(np.float32)
+    b = gray2.astype(np.float32)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    window = (win_size, win_size)
+    cov_norm = win_size * win_size / (win_size * win_size - 1)
+
+    mu_a, mu_b = cv2.blur(a, window), cv2.blur(b, window)
+    var_a = cov_norm * (cv2.blur(a * a, window) - mu_a * mu_a)
+    var_b = cov_norm * (cv2.blur(b * b, window) - mu_b * mu_b)
+    cov_ab = cov_norm * (cv2.blur(a * b, window) - mu_a * mu_b)
+
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov_ab + c2)) / (
+        (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    )
+    pad = (win_size - 1) // 2
+    return float(ssim_map[pad:-pad, pad:-pad].mean())
+
+
+def fast_ssim(gray1, gray2):
+    scores = []
+    for scale in FAST_SSIM_SCALES or [1.0]:
+        if scale >= 1:
+            scores.append(box_ssim(gray1, gray2))
+            continue
+        size = (max(7, int(gray1.shape[1] * scale)), max(7, int(gray1.shape[0] * scale)))
+        scores.append(box_ssim(
+            cv2.resize(gray1, size, interpolation=cv2.INTER_AREA),
+            cv2.resize(gray2, size, interpolation=cv2.INTER_AREA),
+        ))
+    return sum(scores) / len(scores)
+
+
+def phash_ssim(gray1, gray2):
+    if gray1.shape == gray2.shape and np.array_equal(gray1, gray2):
+        return 1.0   # same pixels → skimage would return exactly 1.0
+    return skimage_ssim(gray1, gray2)
+
+
+IMAGE_SIMILARITY_BACKENDS = {
+    "skimage": skimage_ssim,
+    "fast": fast_ssim,
+    "phash": phash_ssim,
+}
+
+
+def register_image_similarity_backend(name, fn):
+    """Adds an image similarity backend: fn(gray1, gray2) → similarity."""
+    IMAGE_SIMILARITY_BACKENDS[name] = fn
+
+
+if IMAGE_SIMILARITY_BACKEND not in IMAGE_SIMILARITY_BACKENDS:
+    print(f"⚠️  Unknown image similarity backend '{IMAGE_SIMILARITY_BACKEND}', using 'skimage'.")
+    IMAGE_SIMILARITY_BACKEND = "skimage"
+
+
+@timed_stage("image_similarity")
+def image_similarity(img1, img2, gray2=None, backend=None):
+    img1 = ssim_input(img1)
+    img2 = gray2 if gray2 is not None else ssim_input(img2)
+
+    compare = IMAGE_SIMILARITY_BACKENDS.get(backend or IMAGE_SIMILARITY_BACKEND, skimage_ssim)
+    return compare(img1, img2)
+
+
+def non_white_ratio(img):
+    img_arr = to_gray(img)
+    return np.sum(img_arr < 240) / img_arr.size
+
+
 def image_marks(score):
     if score > 0.85:
         return 10
@@ -346,58 +1654,182 @@ def image_marks(score):
 # ==========================================================
 
 # ------------------------
-# Diagram Detection ✅
-# Decides whether a page contains a meaningful diagram by
-# measuring edge density and large non-text contour presence.
+# Page Analysis ✅
+# Decides whether a question strip contains a meaningful diagram by
+# edge density (Canny edges / pixels) plus the presence of a large
+# contour — text characters are small, diagram shapes are large.
+#
+# Each strip is measured on its own DIAGRAM_STRIP_SIZE x DIAGRAM_STRIP_SIZE
+# resize, the geometry the 0.04 density and 3000 px contour thresholds were
+# tuned on: a whole-page edge map keeps the page's aspect ratio, which
+# raises the density of short strips and turns text answers into diagrams
+# once a page holds several questions. The page is converted to grayscale
+# once, ink ratios come from per-row prefix sums, and each strip's edge
+# stats are computed once per PageAnalysis.
 # ------------------------
-def detect_diagram(pil_img, edge_density_threshold=0.04, min_contour_area=3000):
-    """
-    Returns True when the page is judged to contain a diagram.
+DIAGRAM_STRIP_SIZE = 800
+
+
+class PageAnalysis:
+    @timed_stage("page_analysis")
+    def __init__(self, page):
+        self._gray = to_gray(page)
+        self.height, self.width = self._gray.shape[:2]
+
+        # Ink (non_white_ratio) at full resolution → exact
+        ink_rows = np.count_nonzero(self._gray < 240, axis=1)
+        self._ink_rows = np.concatenate(([0], np.cumsum(ink_rows, dtype=np.int64)))
+        self._edges = {}   # (top, bottom) → (edge density, largest contour area)
+
+    def ink_ratio(self, top, bottom):
+        pixels = (bottom - top) * self.width
+        return (self._ink_rows[bottom] - self._ink_rows[top]) / pixels if pixels else 0.0
+
+    def _edge_stats(self, top, bottom):
+        stats = self._edges.get((top, bottom))
+        if stats is None:
+            strip = self._gray[top:bottom]
+            if strip.size == 0 or strip.min() == strip.max():
+                stats = (0.0, 0.0)   # flat strip → no edges at any size
+            else:
+                img = cv2.resize(strip, (DIAGRAM_STRIP_SIZE, DIAGRAM_STRIP_SIZE))
+                edges = cv2.Canny(cv2.GaussianBlur(img, (5, 5), 0), 50, 150)
+                contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                stats = (
+                    np.count_nonzero(edges) / edges.size,
+                    max((cv2.contourArea(contour) for contour in contours), default=0.0),
+                )
+            self._edges[(top, bottom)] = stats
+        return stats
+
+    def edge_density(self, top, bottom):
+        return self._edge_stats(top, bottom)[0]
+
+    def max_contour_area(self, top, bottom):
+        """Largest contour of the strip, in DIAGRAM_STRIP_SIZE² pixels."""
+        return self._edge_stats(top, bottom)[1]
+
+    def has_diagram(self, top, bottom, edge_density_threshold=0.04, min_contour_area=3000):
+        """True when the strip [top, bottom) looks like a diagram."""
+        density, max_area = self._edge_stats(top, bottom)
+        return density >= edge_density_threshold and max_area > min_contour_area
+
+    def strips(self, num_questions):
+        """Per-question strip bounds and stats, in split_image_by_question_count order."""
+        return [
+            {
+                "top": top,
+                "bottom": bottom,
+                "has_diagram": self.has_diagram(top, bottom),
+                "non_white": self.ink_ratio(top, bottom),
+            }
+            for top, bottom in strip_bounds(self.height, num_questions)
+        ]
+
+
+# ------------------------
+# CLIP-based Semantic Image Similarity ✅
+# Encodes both images with CLIP ViT-B/32 and returns cosine similarity.
+# Captures high-level semantic meaning (e.g., "flowchart" vs "circuit").
+# ------------------------
+IMAGE_BATCH_SIZE = int(os.getenv("GRADEX_IMAGE_BATCH_SIZE", "16"))
+
 
-    Strategy:
-    - Convert to grayscale and apply Canny edge detection.
-    - Compute edge pixel density (edges / total pixels).
-    - Find contours; count those larger than min_contour_area
-      (text characters are small; diagram shapes are large).
-    - Page is a diagram if edge_density >= threshold AND at least
-      one large contour exists.
+def _batched_forward(tensors, forward, label):
     """
-    img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2GRAY)
-    img = cv2.resize(img, (800, 800))
+    Stacks preprocessed image tensors into batches of IMAGE_BATCH_SIZE and runs
+    one forward pass per batch. Returns one (1, D) embedding per input, None
+    where preprocessing or the batch failed.
+    """
+    import torch
 
-    blurred = cv2.GaussianBlur(img, (5, 5), 0)
-    edges = cv2.Canny(blurred, 50, 150)
+    embeddings = [None] * len(tensors)
+    valid = [i for i, t in enumerate(tensors) if t is not None]
+    for offset in range(0, len(valid), IMAGE_BATCH_SIZE):
+        chunk = valid[offset: offset + IMAGE_BATCH_SIZE]
+        try:
+            with torch.no_grad():
+                out = forward(torch.stack([tensors[i] for i in chunk]))
+        except Exception as e:
+            print(f"{label} embedding error: {e}")
+            continue
+        for row, i in enumerate(chunk):
+            embeddings[i] = out[row: row + 1]
+    return embeddings
 
-    edge_density = np.sum(edges > 0) / edges.size
 
-    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    large_contours = [c for c in contours if cv2.contourArea(c) > min_contour_area]
+def _local_clip_embed(images):
+    """CLIP image embeddings, each (1, 512), or None per image that failed."""
+    clip_bundle = models.try_get("clip")
+    if clip_bundle is None:
+        return [None] * len(images)
 
-    return edge_density >= edge_density_threshold and len(large_contours) > 0
+    clip_model, clip_preprocess, clip_device = clip_bundle
+    tensors = []
+    for img in images:
+        try:
+            tensors.append(clip_preprocess(to_pil_rgb(img)))
+        except Exception as e:
+            print(f"CLIP embedding error: {e}")
+            tensors.append(None)
+    return _batched_forward(tensors, lambda batch: clip_model.encode_image(batch.to(clip_device)), "CLIP")
 
 
-# ------------------------
-# CLIP-based Semantic Image Similarity ✅
-# Encodes both images with CLIP ViT-B/32 and returns cosine similarity.
-# Captures high-level semantic meaning (e.g., "flowchart" vs "circuit").
-# ------------------------
-def clip_similarity(pil_img1, pil_img2):
-    if not _CLIP_AVAILABLE:
-        return 0.0
+def _remote_embed(op, images):
+    import torch
+
     try:
-        t1 = _clip_preprocess(pil_img1).unsqueeze(0).to(_clip_device)
-        t2 = _clip_preprocess(pil_img2).unsqueeze(0).to(_clip_device)
+        embeddings = inference_client.call(op, [to_gray(img) for img in images])
+    except Exception as e:
+        print(f"Inference server {op} error: {e}")
+        return [None] * len(images)
+    return [None if emb is None else torch.from_numpy(emb) for emb in embeddings]
+
+
+@timed_stage("clip_embed")
+def clip_embeddings(images):
+    """CLIP embeddings for many strips in stacked forward passes (e.g. every diagram on a page)."""
+    if not images:
+        return []
+    if inference_client is not None:
+        return _remote_embed("clip_embed", images)
+    return _local_clip_embed(images)
+
+
+def clip_embedding(pil_img):
+    return clip_embeddings([pil_img])[0]
 
-        with torch.no_grad():
-            f1 = _clip_model.encode_image(t1)
-            f2 = _clip_model.encode_image(t2)
 
-        score = F.cosine_similarity(f1, f2).item()
-        # cosine is in [-1, 1]; map to [0, 1]
-        return (score + 1) / 2
+def embedding_similarities(embs1, embs2):
+    """
+    Cosine similarity of each (embs1[i], embs2[i]) pair in one vectorized call,
+    mapped from [-1, 1] to [0, 1]. Pairs with a missing embedding score 0.0.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    scores = [0.0] * len(embs1)
+    valid = [i for i, (e1, e2) in enumerate(zip(embs1, embs2)) if e1 is not None and e2 is not None]
+    if not valid:
+        return scores
+    try:
+        a = torch.cat([embs1[i].float().cpu() for i in valid])
+        b = torch.cat([embs2[i].float().cpu() for i in valid])
+        cosine = F.cosine_similarity(a, b, dim=-1)
+        for i, score in zip(valid, ((cosine + 1) / 2).tolist()):
+            scores[i] = score
     except Exception as e:
-        print(f"CLIP similarity error: {e}")
+        print(f"Embedding similarity error: {e}")
+    return scores
+
+
+@timed_stage("diagram_clip")
+def clip_similarity(pil_img1, pil_img2, emb1=None, emb2=None):
+    if not clip_available():
         return 0.0
+    f1 = emb1 if emb1 is not None else clip_embedding(pil_img1)
+    f2 = emb2 if emb2 is not None else clip_embedding(pil_img2)
+    return embedding_similarities([f1], [f2])[0]
 
 
 # ------------------------
@@ -405,26 +1837,49 @@ def clip_similarity(pil_img1, pil_img2):
 # Uses facebook/dino-vitb16 CLS token embeddings.
 # More robust to drawing style variations than pixel-level methods.
 # ------------------------
-def dino_similarity(pil_img1, pil_img2):
-    if not _DINO_AVAILABLE:
-        return 0.0
-    try:
-        def get_embedding(img):
-            inputs = _dino_extractor(images=img.convert("RGB"), return_tensors="pt")
-            inputs = {k: v.to(_dino_device) for k, v in inputs.items()}
-            with torch.no_grad():
-                outputs = _dino_model(**inputs)
-            # CLS token = outputs.last_hidden_state[:, 0, :]
-            return outputs.last_hidden_state[:, 0, :]
+def _local_dino_embed(images):
+    """DINO CLS embeddings, each (1, 768), or None per image that failed."""
+    dino_bundle = models.try_get("dino")
+    if dino_bundle is None:
+        return [None] * len(images)
+
+    dino_extractor, dino_model, dino_device = dino_bundle
+    tensors = []
+    for img in images:
+        try:
+            tensors.append(dino_extractor(images=to_pil_rgb(img), return_tensors="pt")["pixel_values"][0])
+        except Exception as e:
+            print(f"DINO embedding error: {e}")
+            tensors.append(None)
+    # CLS token = outputs.last_hidden_state[:, 0, :]
+    return _batched_forward(
+        tensors,
+        lambda batch: dino_model(pixel_values=batch.to(dino_device)).last_hidden_state[:, 0, :],
+        "DINO",
+    )
 
-        e1 = get_embedding(pil_img1)
-        e2 = get_embedding(pil_img2)
 
-        score = F.cosine_similarity(e1, e2).item()
-        return (score + 1) / 2
-    except Exception as e:
-        print(f"DINO similarity error: {e}")
+@timed_stage("dino_embed")
+def dino_embeddings(images):
+    """DINO embeddings for many strips in stacked forward passes."""
+    if not images:
+        return []
+    if inference_client is not None:
+        return _remote_embed("dino_embed", images)
+    return _local_dino_embed(images)
+
+
+def dino_embedding(pil_img):
+    return dino_embeddings([pil_img])[0]
+
+
+@timed_stage("diagram_dino")
+def dino_similarity(pil_img1, pil_img2, emb1=None, emb2=None):
+    if not dino_available():
         return 0.0
+    e1 = emb1 if emb1 is not None else dino_embedding(pil_img1)
+    e2 = emb2 if emb2 is not None else dino_embedding(pil_img2)
+    return embedding_similarities([e1], [e2])[0]
 
 
 # ------------------------
@@ -433,21 +1888,25 @@ def dino_similarity(pil_img1, pil_img2):
 # Evaluates structural/spatial layout similarity of diagrams.
 # Returns ratio of good matches to total keypoints detected.
 # ------------------------
-def orb_similarity(pil_img1, pil_img2, max_features=1000, good_match_ratio=0.75):
+def orb_features(pil_img, max_features=1000):
+    """Returns (keypoint_count, descriptors) for a strip resized to 600x600."""
+    gray = cv2.resize(to_gray(pil_img), (600, 600))
+    orb = cv2.ORB_create(nfeatures=max_features)
+    kp, des = orb.detectAndCompute(gray, None)
+    return len(kp), des
+
+
+@timed_stage("diagram_orb")
+def orb_similarity(pil_img1, pil_img2, max_features=1000, good_match_ratio=0.75, features1=None):
     try:
-        def to_gray(img):
-            arr = cv2.cvtColor(np.array(img.convert("RGB")), cv2.COLOR_RGB2GRAY)
-            return cv2.resize(arr, (600, 600))
-        g1, g2 = to_gray(pil_img1), to_gray(pil_img2)
-        orb = cv2.ORB_create(nfeatures=max_features)
-        kp1, des1 = orb.detectAndCompute(g1, None)
-        kp2, des2 = orb.detectAndCompute(g2, None)
-        if des1 is None or des2 is None or len(kp1) == 0 or len(kp2) == 0:
+        n_kp1, des1 = features1 if features1 is not None else orb_features(pil_img1, max_features)
+        n_kp2, des2 = orb_features(pil_img2, max_features)
+        if des1 is None or des2 is None or n_kp1 == 0 or n_kp2 == 0:
             return 0.0
         bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
         raw_matches = bf.knnMatch(des1, des2, k=2)
         good = [m for m, n in raw_matches if m.distance < good_match_ratio * n.distance]
-        total = min(len(kp1), len(kp2))
+        total = min(n_kp1, n_kp2)
         score = len(good) / total if total > 0 else 0.0
         return min(score, 1.0)
     except Exception as e:
@@ -462,25 +1921,39 @@ def orb_similarity(pil_img1, pil_img2, max_features=1000, good_match_ratio=0.75)
 # Handles cases where diagrams have different but semantically
 # equivalent annotations.
 # ------------------------
-def ocr_label_similarity(pil_img1, pil_img2):
+def extract_diagram_labels(img):
+    gray = to_gray(img)
+    # Threshold to isolate text within the diagram
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    text = pytesseract.image_to_string(
+        Image.fromarray(thresh),
+        config="--psm 11 --oem 3",   # sparse text mode — good for labels
+    ).strip()
+    return text if text else "NO_LABELS"
+
+
+def label_features(img):
+    """Returns (labels, SBERT embedding or None) for a diagram strip."""
+    labels = extract_diagram_labels(img)
+    if labels == "NO_LABELS":
+        return labels, None
+    return labels, sbert_encode([labels])[0]
+
+
+@timed_stage("diagram_ocr_labels")
+def ocr_label_similarity(pil_img1, pil_img2, features1=None):
     try:
-        def extract_labels(img):
-            gray = cv2.cvtColor(np.array(img.convert("RGB")), cv2.COLOR_RGB2GRAY)
-            # Threshold to isolate text within the diagram
-            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            text = pytesseract.image_to_string(
-                Image.fromarray(thresh),
-                config="--psm 11 --oem 3",   # sparse text mode — good for labels
-            ).strip()
-            return text if text else "NO_LABELS"
-        labels1 = extract_labels(pil_img1)
-        labels2 = extract_labels(pil_img2)
+        from sentence_transformers import util
+
+        labels1, e1 = features1 if features1 is not None else (extract_diagram_labels(pil_img1), None)
+        labels2 = extract_diagram_labels(pil_img2)
         if labels1 == "NO_LABELS" and labels2 == "NO_LABELS":
             return 1.0   # neither has labels → no penalty
         if labels1 == "NO_LABELS" or labels2 == "NO_LABELS":
             return 0.0   
-        e1 = sbert_model.encode(labels1, convert_to_tensor=True)
-        e2 = sbert_model.encode(labels2, convert_to_tensor=True)
+        if e1 is None:
+            e1 = sbert_encode([labels1])[0]
+        e2 = sbert_encode([labels2])[0]
 
         score = util.pytorch_cos_sim(e1, e2).item()
         return max(0.0, score)   # clamp negatives to 0
@@ -488,6 +1961,29 @@ def ocr_label_similarity(pil_img1, pil_img2):
         print(f"OCR label similarity error: {e}")
         return 0.0
 
+
+def diagram_features(pil_img, clip_emb=None, dino_emb=None):
+    """
+    Precomputes the per-image half of diagram_similarity_details
+    (CLIP/DINO embeddings, ORB descriptors, OCR labels) for an answer-key strip.
+    clip_emb/dino_emb → embeddings already computed in a batch.
+    """
+    features = {
+        "clip": clip_emb if clip_emb is not None else clip_embedding(pil_img),
+        "dino": dino_emb if dino_emb is not None else dino_embedding(pil_img),
+        "labels": None,
+    }
+    try:
+        features["orb"] = orb_features(pil_img)
+    except Exception as e:
+        print(f"ORB feature error: {e}")
+        features["orb"] = (0, None)
+    try:
+        features["labels"] = label_features(pil_img)
+    except Exception as e:
+        print(f"OCR label feature error: {e}")
+    return features
+
 # ------------------------
 # Advanced Diagram Similarity (Multi-Model Fusion) ✅
 #
@@ -497,41 +1993,119 @@ def ocr_label_similarity(pil_img1, pil_img2):
 #   ORB   (structural) → 20%
 #   OCR   (labels)     → 15%
 #
+# The four models are independent and run concurrently on
+# diagram_executor (torch, OpenCV and Tesseract all release the GIL).
+#
+# Cascade mode (GRADEX_DIAGRAM_CASCADE=1): the cheap signals (ORB, CLIP
+# cosine) run first; when their weighted score ± GRADEX_DIAGRAM_CASCADE_MARGIN
+# stays inside one diagram_marks band, DINO and the OCR labels are skipped
+# and the cheap score is used.
+#
 # Falls back gracefully when a model is unavailable.
 # Returns a normalised score in [0, 1].
 # ------------------------
-def advanced_diagram_similarity(pil_img1, pil_img2):
-    weights = {"clip": 0.35, "dino": 0.30, "orb": 0.20, "ocr": 0.15}
-    scores = {}
+DIAGRAM_WEIGHTS = {"clip": 0.35, "dino": 0.30, "orb": 0.20, "ocr": 0.15}
+DIAGRAM_CHEAP_MODELS = ("orb", "clip")
+DIAGRAM_WORKERS = int(os.getenv("GRADEX_DIAGRAM_WORKERS", "4"))
+DIAGRAM_CASCADE = os.getenv("GRADEX_DIAGRAM_CASCADE", "0").strip().lower() in ("1", "true", "yes", "on")
+DIAGRAM_CASCADE_MARGIN = float(os.getenv("GRADEX_DIAGRAM_CASCADE_MARGIN", "0.05"))
+diagram_executor = ThreadPoolExecutor(max_workers=DIAGRAM_WORKERS, thread_name_prefix="gradex-diagram")
 
-    scores["clip"] = clip_similarity(pil_img1, pil_img2)
-    scores["dino"] = dino_similarity(pil_img1, pil_img2)
-    scores["orb"]  = orb_similarity(pil_img1, pil_img2)
-    scores["ocr"]  = ocr_label_similarity(pil_img1, pil_img2)
 
-    # Re-normalise weights for any unavailable model (score == 0 due to import fail)
-    active_weight_sum = sum(
-        w for k, w in weights.items()
-        if not (k == "clip" and not _CLIP_AVAILABLE)
-        and not (k == "dino" and not _DINO_AVAILABLE)
-    )
+def _run_diagram_models(scorers, names):
+    if len(names) <= 1:
+        return {name: scorers[name]() for name in names}
+    futures = {name: diagram_executor.submit(scorers[name]) for name in names}
+    return {name: future.result() for name, future in futures.items()}
 
-    combined = 0.0
-    for k, w in weights.items():
-        # Skip models that failed to load — don't penalise the student
-        if k == "clip" and not _CLIP_AVAILABLE:
-            continue
-        if k == "dino" and not _DINO_AVAILABLE:
-            continue
-        normalised_w = w / active_weight_sum if active_weight_sum > 0 else 0
-        combined += normalised_w * scores[k]
+
+def _weighted_diagram_score(scores):
+    """Weighted mean of the scores that ran, re-normalised over their weights."""
+    weight_sum = sum(DIAGRAM_WEIGHTS[k] for k in scores)
+    if weight_sum <= 0:
+        return 0.0
+    return sum(DIAGRAM_WEIGHTS[k] * s for k, s in scores.items()) / weight_sum
+
+
+def diagram_similarity_details(pil_img1, pil_img2, features1=None, cascade=None, known_scores=None):
+    """
+    features1    → optional diagram_features(pil_img1), e.g. from the compiled answer key.
+    known_scores → model scores already computed elsewhere (e.g. batched CLIP/DINO).
+    Returns {"score", "scores", "models_run"}.
+    """
+    features1 = features1 or {}
+    cascade = DIAGRAM_CASCADE if cascade is None else cascade
+
+    scorers = {
+        "clip": lambda: clip_similarity(pil_img1, pil_img2, emb1=features1.get("clip")),
+        "dino": lambda: dino_similarity(pil_img1, pil_img2, emb1=features1.get("dino")),
+        "orb": lambda: orb_similarity(pil_img1, pil_img2, features1=features1.get("orb")),
+        "ocr": lambda: ocr_label_similarity(pil_img1, pil_img2, features1=features1.get("labels")),
+    }
+
+    # Skip models that failed to load — don't penalise the student
+    clip_ok, dino_ok = clip_available(), dino_available()
+    active = [
+        k for k in DIAGRAM_WEIGHTS
+        if not (k == "clip" and not clip_ok)
+        and not (k == "dino" and not dino_ok)
+    ]
+
+    scores = {k: s for k, s in (known_scores or {}).items() if k in active}
+    first = [k for k in active if k not in scores and (k in DIAGRAM_CHEAP_MODELS or not cascade)]
+    scores.update(_run_diagram_models(scorers, first))
+
+    rest = [k for k in active if k not in scores]
+    if rest:
+        estimate = _weighted_diagram_score(scores)
+        low = max(0.0, estimate - DIAGRAM_CASCADE_MARGIN)
+        high = min(1.0, estimate + DIAGRAM_CASCADE_MARGIN)
+        if diagram_marks(low) != diagram_marks(high):
+            scores.update(_run_diagram_models(scorers, rest))
+
+    combined = _weighted_diagram_score(scores)
+    models_run = [k for k in DIAGRAM_WEIGHTS if k in scores]
 
     print(
-        f"📊 Diagram scores → CLIP: {scores['clip']:.3f}, "
-        f"DINO: {scores['dino']:.3f}, ORB: {scores['orb']:.3f}, "
-        f"OCR: {scores['ocr']:.3f} → Combined: {combined:.3f}"
+        "📊 Diagram scores → "
+        + ", ".join(f"{k.upper()}: {scores[k]:.3f}" if k in scores else f"{k.upper()}: skipped" for k in DIAGRAM_WEIGHTS)
+        + f" → Combined: {combined:.3f}"
     )
-    return combined
+    return {"score": combined, "scores": scores, "models_run": models_run}
+
+
+@timed_stage("diagram_similarity")
+def score_diagram_pairs(pairs, cascade=None):
+    """
+    diagram_similarity_details for many (teacher_img, student_img, teacher_features)
+    pairs, e.g. every diagram question on a page. The student strips go through
+    CLIP (and DINO, unless cascading) in one stacked batch, and those scores come
+    from one vectorized cosine per model.
+    """
+    if not pairs:
+        return []
+    cascade = DIAGRAM_CASCADE if cascade is None else cascade
+    student_imgs = [student_img for _, student_img, _ in pairs]
+    teacher_features = [features or {} for _, _, features in pairs]
+
+    known = [{} for _ in pairs]
+    batched = [("clip", clip_available, clip_embeddings)]
+    if not cascade:
+        # In cascade mode DINO only runs for the strips the cheap signals leave undecided
+        batched.append(("dino", dino_available, dino_embeddings))
+    for name, available, embed in batched:
+        if not available():
+            continue
+        student_embs = embed(student_imgs)
+        teacher_embs = [features.get(name) for features in teacher_features]
+        for i, score in enumerate(embedding_similarities(teacher_embs, student_embs)):
+            if teacher_embs[i] is not None and student_embs[i] is not None:
+                known[i][name] = score
+
+    return [
+        diagram_similarity_details(teacher_img, student_img, features, cascade, known_scores=known[i])
+        for i, (teacher_img, student_img, features) in enumerate(pairs)
+    ]
 
 
 # ------------------------
@@ -553,38 +2127,1271 @@ def diagram_marks(score):
     else:
         return 0
 
+# ------------------------
+# Compiled Answer Key ✅
+# Everything that depends only on the teacher key is computed once at
+# /upload/teacher: split question text, SBERT embeddings, diagram flags,
+# non-white ratios, SSIM inputs, CLIP/DINO embeddings, ORB descriptors
+# and OCR labels. Student grading then only computes the student half.
+#
+# Strips are cached per (page, question count) because a student page
+# with a different number of answers splits the teacher page differently;
+# those splits are filled in lazily on first use.
+# ------------------------
+class CompiledAnswerKey:
+    def __init__(self, page_texts, page_images, image_backend=None, key_hash=None):
+        self.page_texts = list(page_texts)
+        self.page_images = page_images
+        self.image_backend = image_backend or IMAGE_SIMILARITY_BACKEND
+        self._key_hash = key_hash
+        self._questions = {}   # page_idx → [(q_num, answer_text)]
+        self._text = {}        # answer_text → text_features()
+        self._strips = {}      # (page_idx, num_questions, q_idx) → strip entry
+        self._analysis = {}    # page_idx → PageAnalysis
+        self._lock = threading.Lock()
+
+    def key_hash(self):
+        """sha256 of the key's page texts, page images and image backend, computed once."""
+        if self._key_hash is None:
+            h = hashlib.sha256(self.image_backend.encode())
+            for page_idx, text in enumerate(self.page_texts):
+                h.update(f"\0{page_idx}\0{text}".encode())
+                page_img = self.page_images.get(page_idx)
+                if page_img is not None:
+                    h.update(str(page_img.shape).encode())
+                    h.update(np.ascontiguousarray(page_img).data)
+            self._key_hash = h.hexdigest()
+        return self._key_hash
+
+    def revised(self, page_texts):
+        """Key with revised page texts over the same page images; visual artifacts are shared."""
+        key = CompiledAnswerKey(page_texts, self.page_images, self.image_backend)
+        with self._lock:
+            key._text = dict(self._text)
+            key._strips = dict(self._strips)
+            key._analysis = dict(self._analysis)
+        return key
+
+    def questions(self, page_idx):
+        """Split teacher questions for a page (a copy, callers pad it)."""
+        with self._lock:
+            questions = self._questions.get(page_idx)
+        if questions is None:
+            questions = split_text_by_questions(self.page_texts[page_idx])
+            with self._lock:
+                self._questions[page_idx] = questions
+        return list(questions)
+
+    def text_entry(self, answer_text):
+        with self._lock:
+            entry = self._text.get(answer_text)
+        if entry is None:
+            entry = text_features(answer_text)
+            with self._lock:
+                self._text[answer_text] = entry
+        return entry
+
+    def strip_entry(self, page_idx, num_questions, q_idx):
+        """
+        Teacher strip for one question plus its cheap visual artifacts.
+        Returns None when the page has no stored image.
+        """
+        key = (page_idx, num_questions, q_idx)
+        with self._lock:
+            entry = self._strips.get(key)
+        if entry is not None:
+            return entry
+
+        page_img = self.page_images.get(page_idx)
+        if page_img is None:
+            return None
+
+        with self._lock:
+            analysis = self._analysis.get(page_idx)
+        if analysis is None:
+            analysis = PageAnalysis(page_img)
+            with self._lock:
+                self._analysis.setdefault(page_idx, analysis)
+
+        entries = {}
+        strips = split_image_by_question_count(page_img, num_questions)
+        for idx, (strip, stats) in enumerate(zip(strips, analysis.strips(num_questions))):
+            entries[(page_idx, num_questions, idx)] = {
+                "image": strip,
+                "has_diagram": stats["has_diagram"],
+                "non_white": stats["non_white"],
+                "ssim_gray": ssim_input(strip),
+                "diagram": None,
+            }
+        with self._lock:
+            for k, v in entries.items():
+                self._strips.setdefault(k, v)
+            return self._strips.get(key)
+
+    def diagram_entry(self, page_idx, num_questions, q_idx):
+        """CLIP/DINO/ORB/OCR-label features of a teacher strip, computed on first use."""
+        return self.diagram_entries(page_idx, num_questions, [q_idx])[0]
+
+    def diagram_entries(self, page_idx, num_questions, q_indices):
+        """diagram_entry for several strips of a page; missing ones share one CLIP and one DINO batch."""
+        entries = [self.strip_entry(page_idx, num_questions, q_idx) for q_idx in q_indices]
+        missing = [entry for entry in entries if entry is not None and entry["diagram"] is None]
+        if missing:
+            images = [entry["image"] for entry in missing]
+            for entry, clip_emb, dino_emb in zip(missing, clip_embeddings(images), dino_embeddings(images)):
+                entry["diagram"] = diagram_features(entry["image"], clip_emb=clip_emb, dino_emb=dino_emb)
+        return [entry["diagram"] if entry is not None else None for entry in entries]
+
+    def compile(self):
+        """Precomputes every artifact for the teacher's own question split."""
+        for page_idx in range(len(self.page_texts)):
+            questions = self.questions(page_idx)
+            for _, answer_text in questions:
+                self.text_entry(answer_text)
+
+            num_questions = len(questions)
+            diagram_questions = []
+            for q_idx in range(num_questions):
+                entry = self.strip_entry(page_idx, num_questions, q_idx)
+                if entry is not None and entry["has_diagram"]:
+                    diagram_questions.append(q_idx)
+            self.diagram_entries(page_idx, num_questions, diagram_questions)
+        return self
+
+
+# ------------------------
+# Exam Session Store ✅
+# Each teacher upload creates an exam session keyed by exam id, so several
+# exams can be graded at once and any worker process can serve any exam.
+#   - exam metadata + teacher page texts → MongoDB `exams` collection
+#     (GRADEX_EXAM_STORE=mongo, default) or exam.json on local disk
+#     (GRADEX_EXAM_STORE=disk)
+#   - teacher page arrays → .npy files under GRADEX_EXAM_DATA_DIR
+# Workers keep recently used sessions in memory and compile the answer
+# key lazily the first time they load an exam created elsewhere.
+# ------------------------
+EXAM_STORE_BACKEND = os.getenv("GRADEX_EXAM_STORE", "mongo").strip().lower()
+EXAM_DATA_DIR = os.getenv("GRADEX_EXAM_DATA_DIR", os.path.join(UPLOAD_FOLDER, "exams"))
+MAX_CACHED_EXAMS = int(os.getenv("GRADEX_MAX_CACHED_EXAMS", "8"))
+
+
+class ExamSession:
+    def __init__(self, exam_id, exam_name, page_texts, page_images, created_at, image_backend=None,
+                 key_hash=None):
+        self.exam_id = exam_id
+        self.exam_name = exam_name
+        self.page_texts = list(page_texts)
+        self.page_images = page_images
+        self.created_at = created_at
+        self.image_backend = image_backend or IMAGE_SIMILARITY_BACKEND
+        self.answer_key = CompiledAnswerKey(self.page_texts, page_images, self.image_backend, key_hash)
+
+    def revised(self, page_texts):
+        """Same exam with revised teacher page texts (see CompiledAnswerKey.revised)."""
+        session = ExamSession(
+            self.exam_id, self.exam_name, page_texts, self.page_images, self.created_at,
+            image_backend=self.image_backend,
+        )
+        session.answer_key = self.answer_key.revised(session.page_texts)
+        return session
+
+    def summary(self):
+        return {
+            "examId": self.exam_id,
+            "examName": self.exam_name,
+            "pages": len(self.page_texts),
+            "created_at": self.created_at,
+            "imageSimilarity": self.image_backend,
+        }
+
+
+EXAM_ID_PATTERN = re.compile(r"^[0-9a-f]{12}$")   # ExamStore.new_exam_id format
+
+
+def is_valid_exam_id(exam_id):
+    return isinstance(exam_id, str) and EXAM_ID_PATTERN.match(exam_id) is not None
+
+
+class ExamStore:
+    def __init__(self, backend, data_dir, max_cached):
+        self.backend = backend
+        self.data_dir = data_dir
+        self.max_cached = max_cached
+        self._sessions = OrderedDict()   # exam_id → ExamSession, most recent last
+        self._lock = threading.Lock()
+        os.makedirs(data_dir, exist_ok=True)
+
+    def exam_dir(self, exam_id):
+        """Directory of one exam; ValueError for ids that could leave data_dir."""
+        if not is_valid_exam_id(exam_id):
+            raise ValueError(f"Invalid exam id {exam_id!r}")
+        path = os.path.realpath(os.path.join(self.data_dir, exam_id))
+        if os.path.dirname(path) != os.path.realpath(self.data_dir):
+            raise ValueError(f"Exam directory for {exam_id!r} is outside {self.data_dir}")
+        return path
+
+    def pages_dir(self, exam_id):
+        return os.path.join(self.exam_dir(exam_id), "pages")
+
+    def staging_pages_dir(self, exam_id):
+        """Fresh directory next to pages_dir to render a replacement key into."""
+        return os.path.join(self.exam_dir(exam_id), f"pages.{uuid.uuid4().hex[:8]}.tmp")
+
+    def install_pages(self, exam_id, staging_dir, page_images):
+        """Swaps staged pages in for the exam's current ones (running jobs keep their memory maps)."""
+        pages_dir = self.pages_dir(exam_id)
+        retired = f"{pages_dir}.{uuid.uuid4().hex[:8]}.old"
+        if os.path.isdir(pages_dir):
+            os.replace(pages_dir, retired)
+        os.replace(staging_dir, pages_dir)
+        page_images.relocate(pages_dir)
+        shutil.rmtree(retired, ignore_errors=True)
+
+    def new_exam_id(self):
+        return uuid.uuid4().hex[:12]
+
+    def _remember(self, session):
+        with self._lock:
+            self._sessions[session.exam_id] = session
+            self._sessions.move_to_end(session.exam_id)
+            while len(self._sessions) > self.max_cached:
+                self._sessions.popitem(last=False)
+
+    def _meta_path(self, exam_id):
+        return os.path.join(self.exam_dir(exam_id), "exam.json")
+
+    def save(self, session):
+        """Persists the exam metadata (pages are already under pages_dir) and caches the session."""
+        doc = {
+            "exam_id": session.exam_id,
+            "exam_name": session.exam_name,
+            "teacher_answers": session.page_texts,
+            "created_at": session.created_at,
+            "image_similarity": session.image_backend,
+            "key_hash": session.answer_key.key_hash(),
+        }
+        if self.backend == "disk":
+            with open(self._meta_path(session.exam_id), "w", encoding="utf-8") as f:
+                json.dump(doc, f)
+        else:
+            with mongo_write("exam_save"):
+                exams_collection.replace_one({"exam_id": session.exam_id}, doc, upsert=True)
+        self._remember(session)
+        return session
+
+    def _load_doc(self, exam_id):
+        if self.backend == "disk":
+            try:
+                with open(self._meta_path(exam_id), encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+        return exams_collection.find_one({"exam_id": exam_id}, {"_id": 0})
+
+    def _stored_key_hash(self, exam_id):
+        """(exists, key_hash) of the stored exam — a projected lookup, no texts or pages."""
+        if self.backend == "disk":
+            doc = self._load_doc(exam_id)
+        else:
+            doc = exams_collection.find_one({"exam_id": exam_id}, {"_id": 0, "key_hash": 1})
+        if doc is None:
+            return False, None
+        return True, doc.get("key_hash")
+
+    def _session_from_doc(self, doc):
+        pages_dir = self.pages_dir(doc["exam_id"])
+        if not os.path.isdir(pages_dir):
+            # Grading without the key's pages would silently drop all visual scoring
+            print(f"❌ Exam {doc['exam_id']} has no page images at {pages_dir}")
+            raise FileNotFoundError(f"Page images of exam {doc['exam_id']} are missing")
+        page_images = PageStore.load(pages_dir)
+        return ExamSession(
+            doc["exam_id"], doc["exam_name"], doc["teacher_answers"], page_images, doc["created_at"],
+            image_backend=doc.get("image_similarity"), key_hash=doc.get("key_hash"),
+        )
+
+    def get(self, exam_id):
+        """
+        Cached session, checked against the stored key_hash so re-uploads,
+        revisions and deletes made by other workers aren't served stale.
+        """
+        if not is_valid_exam_id(exam_id):
+            return None
+        with self._lock:
+            session = self._sessions.get(exam_id)
+        if session is not None:
+            exists, key_hash = self._stored_key_hash(exam_id)
+            if exists and key_hash in (None, session.answer_key.key_hash()):
+                with self._lock:
+                    if exam_id in self._sessions:
+                        self._sessions.move_to_end(exam_id)
+                return session
+            with self._lock:
+                if self._sessions.get(exam_id) is session:
+                    del self._sessions[exam_id]
+            if not exists:
+                return None
+        doc = self._load_doc(exam_id)
+        if doc is None:
+            return None
+        session = self._session_from_doc(doc)
+        self._remember(session)
+        return session
+
+    def _all_docs(self):
+        if self.backend == "disk":
+            docs = []
+            for exam_id in os.listdir(self.data_dir):
+                if not is_valid_exam_id(exam_id):
+                    continue
+                doc = self._load_doc(exam_id)
+                if doc is not None:
+                    docs.append(doc)
+            return docs
+        return list(exams_collection.find({}, {"_id": 0, "teacher_answers": 0}))
+
+    def list(self):
+        docs = sorted(self._all_docs(), key=lambda doc: doc["created_at"], reverse=True)
+        return [
+            {"examId": doc["exam_id"], "examName": doc["exam_name"], "created_at": doc["created_at"]}
+            for doc in docs
+        ]
+
+    def delete(self, exam_id):
+        """Removes an exam. Jobs already holding the session keep working."""
+        exam_dir = self.exam_dir(exam_id)   # validates before anything is deleted
+        with self._lock:
+            self._sessions.pop(exam_id, None)
+        if self.backend != "disk":
+            exams_collection.delete_one({"exam_id": exam_id})
+        shutil.rmtree(exam_dir, ignore_errors=True)
+
+
+exam_store = ExamStore(EXAM_STORE_BACKEND, EXAM_DATA_DIR, MAX_CACHED_EXAMS)
+
+
+def resolve_exam(exam_id):
+    """Session for an explicit exam id; there is no fallback to another exam."""
+    if not is_valid_exam_id(exam_id):
+        return None
+    return exam_store.get(exam_id)
+
+
+def request_exam_id(required=True):
+    """
+    Exam id from the form, query string or JSON body (examId / exam_id).
+    Aborts with 400 when it is missing (unless not required) or isn't in
+    the new_exam_id format.
+    """
+    data = request.get_json(silent=True) or {}
+    exam_id = (
+        request.form.get("examId")
+        or request.args.get("examId")
+        or data.get("examId")
+        or data.get("exam_id")
+    )
+    if not exam_id:
+        if required:
+            abort(make_response(jsonify({"error": "Missing examId"}), 400))
+        return None
+    if not is_valid_exam_id(exam_id):
+        abort(make_response(jsonify({"error": "Invalid exam id"}), 400))
+    return exam_id
+
+
 # ------------------------
 # Teacher Upload ✅
 # ------------------------
 @app.route("/upload/teacher", methods=["POST"])
 def upload_teacher_pdf():
-    global processing_mode, exam_name, teacher_answers
-    global teacher_page_images, student_page_images
-
-    # ✅ Reset old data
-    teacher_page_images.clear()
-    student_page_images.clear()
-    teacher_answers = []
-
     if "pdf" not in request.files or "examName" not in request.form:
         return jsonify({"error": "Missing file or exam name"}), 400
 
     exam_name = request.form["examName"]
     pdf_file = request.files["pdf"]
 
-    pdf_path = os.path.join(UPLOAD_FOLDER, pdf_file.filename)
-    pdf_file.save(pdf_path)
+    image_backend = request.form.get("imageSimilarity") or IMAGE_SIMILARITY_BACKEND
+    if image_backend not in IMAGE_SIMILARITY_BACKENDS:
+        return jsonify({
+            "error": f"Unknown image similarity backend '{image_backend}'",
+            "backends": list(IMAGE_SIMILARITY_BACKENDS),
+        }), 400
 
-    processing_mode = "teacher"
-    teacher_answers = extract_text_from_pdf(pdf_path)
+    # ✅ A new exam session, or a replacement key for an existing exam id
+    exam_id = request_exam_id(required=False) or exam_store.new_exam_id()
+    pdf_data, _ = read_pdf_upload(pdf_file)
+
+    # ✅ Render into a staging directory; the exam's current pages stay until the new key is saved
+    staging_dir = exam_store.staging_pages_dir(exam_id)
+    try:
+        page_sources = {}
+        teacher_images = PageStore(persist_dir=staging_dir)
+        teacher_answers = extract_text_from_pdf(
+            pdf_data, mode="teacher", page_images=teacher_images, page_sources=page_sources
+        )
+
+        session = ExamSession(
+            exam_id, exam_name, teacher_answers, teacher_images, datetime.utcnow().isoformat(),
+            image_backend=image_backend,
+        )
+        # ✅ Compile the answer key once for every student graded against it
+        session.answer_key.compile()
+    except Exception as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        print(f"Teacher key upload for exam {exam_id} failed: {e}")
+        return jsonify({"error": f"Could not process the answer key: {e}"}), 400
+
+    try:
+        exam_store.save(session)
+    except Exception as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        print(f"Saving exam {exam_id} failed: {e}")
+        return jsonify({"error": "Failed to save the answer key"}), 500
+    exam_store.install_pages(exam_id, staging_dir, teacher_images)
 
     return jsonify(
         {
             "message": "Teacher answers uploaded successfully ✅",
+            "examId": exam_id,
             "examName": exam_name,
             "pages": len(teacher_answers),
+            "imageSimilarity": image_backend,
+            "text_layer_pages": sum(1 for source in page_sources.values() if source == "text_layer"),
+        }
+    )
+
+
+@app.route("/exams", methods=["GET"])
+def list_exams():
+    try:
+        return jsonify(exam_store.list()), 200
+    except Exception as e:
+        print(f"Error listing exams: {e}")
+        return jsonify({"error": "Failed to list exams"}), 500
+
+
+@app.route("/exams/<exam_id>", methods=["GET"])
+def get_exam(exam_id):
+    session = exam_store.get(exam_id)
+    if session is None:
+        return jsonify({"error": "Exam not found"}), 404
+    return jsonify(session.summary()), 200
+
+
+@app.route("/exams/<exam_id>", methods=["DELETE"])
+def delete_exam(exam_id):
+    """Resets one exam's teacher answers; the id is always explicit."""
+    if not is_valid_exam_id(exam_id):
+        return jsonify({"error": "Invalid exam id"}), 400
+    if exam_store.get(exam_id) is None:
+        return jsonify({"error": "Exam not found"}), 404
+
+    exam_store.delete(exam_id)
+    return jsonify({"message": "Teacher answers reset successfully ✅", "examId": exam_id}), 200
+
+
+# ------------------------
+# Student Grading Engine ✅ TEXT + IMAGE scoring
+# Scores extracted student pages against the teacher key.
+# The upload routes and job workers go through grade_script_pipelined,
+# which runs these steps page by page as OCR text arrives.
+# ------------------------
+def grade_page(page_idx, student_page_text, student_img_full, answer_key):
+    """
+    Visual scoring for one page. Returns its question items in order;
+    their text is scored afterwards by score_text_items.
+    """
+    graded = []
+
+    # ── Split text into per-question segments ──
+    teacher_questions = answer_key.questions(page_idx)
+    student_questions = split_text_by_questions(student_page_text)
+
+    num_questions = max(len(teacher_questions), len(student_questions))
+
+    # ── Split page images into per-question strips ──
+    if student_img_full is not None:
+        student_strips = split_image_by_question_count(student_img_full, num_questions)
+        student_stats = PageAnalysis(student_img_full).strips(num_questions)
+    else:
+        student_strips = [None] * num_questions
+
+    # Pad shorter list so zip works safely
+    while len(teacher_questions) < num_questions:
+        teacher_questions.append((len(teacher_questions) + 1, ""))
+    while len(student_questions) < num_questions:
+        student_questions.append((len(student_questions) + 1, ""))
+
+    # ── Evaluate each question on this page ──
+    page_diagrams = []   # (graded index, q_idx, teacher strip, student strip)
+    for q_idx in range(num_questions):
+        _, teacher_text = teacher_questions[q_idx]
+        _, student_text = student_questions[q_idx]
+
+        teacher_entry = answer_key.strip_entry(page_idx, num_questions, q_idx)
+        teacher_img = teacher_entry["image"] if teacher_entry else None
+        student_img = student_strips[q_idx] if q_idx < len(student_strips) else None
+
+        # ── Determine what content exists in this question strip ──
+        has_meaningful_text = bool(
+            student_text.strip()
+            and student_text not in ("NO_TEXT_DETECTED", "OCR_ERROR", "EXTRACTION_ERROR")
+            and len(student_text.strip()) > 5
+        )
+
+        has_visual = False
+        evaluation_type = "text"
+        img_sim = 0.0
+        img_score = 0
+
+        if teacher_img is not None and student_img is not None:
+            has_diagram = teacher_entry["has_diagram"] or student_stats[q_idx]["has_diagram"]
+            if has_diagram:
+                has_visual = True
+                # Scored below together with the page's other diagrams
+                page_diagrams.append((len(graded), q_idx, teacher_img, student_img))
+                evaluation_type = "diagram" if not has_meaningful_text else "mixed_diagram"
+            else:
+                # Check whether the strip has any non-trivial image content
+                # (pure white / near-blank strips → no visual to evaluate)
+                if teacher_entry["non_white"] > 0.02:   # >2% non-white pixels → real image content
+                    has_visual = True
+                    raw_sim = image_similarity(
+                        student_img, teacher_img, gray2=teacher_entry["ssim_gray"],
+                        backend=answer_key.image_backend,
+                    )
+                    img_score = image_marks(raw_sim)
+                    img_sim = round(raw_sim, 3)
+                    evaluation_type = "image" if not has_meaningful_text else "mixed_image"
+
+        # ── Text is scored afterwards in one batch (score_text_items) ──
+        graded.append({
+            "page": page_idx,
+            "q_idx": q_idx,
+            "num_questions": num_questions,
+            "student_text": student_text,
+            "teacher_text": teacher_text,
+            "has_meaningful_text": has_meaningful_text,
+            "has_visual": has_visual,
+            "evaluation_type": evaluation_type,
+            "img_sim": img_sim,
+            "img_score": img_score,
+            "models_run": [],
+        })
+
+    # ── Diagram questions of this page: one batched CLIP/DINO pass ──
+    if page_diagrams:
+        teacher_features = answer_key.diagram_entries(
+            page_idx, num_questions, [q_idx for _, q_idx, _, _ in page_diagrams]
+        )
+        diagrams = score_diagram_pairs([
+            (teacher_img, student_img, features)
+            for (_, _, teacher_img, student_img), features in zip(page_diagrams, teacher_features)
+        ])
+        for (item_idx, _, _, _), diagram in zip(page_diagrams, diagrams):
+            graded[item_idx]["img_score"] = diagram_marks(diagram["score"])
+            graded[item_idx]["img_sim"] = round(diagram["score"], 3)
+            graded[item_idx]["models_run"] = diagram["models_run"]
+            graded[item_idx]["diagram_scores"] = diagram["scores"]
+
+    return graded
+
+
+def score_text_items(items, answer_key):
+    """
+    ✅ Batched text scoring: one SBERT batch + padded cross-encoder batches.
+    Items that already carry student text_features (stored artifacts) skip SBERT.
+    """
+    text_items = [item for item in items if item["has_meaningful_text"]]
+    fresh = [item for item in text_items if item.get("text_features") is None]
+    for item, features in zip(fresh, text_features_batch([item["student_text"] for item in fresh])):
+        item["text_features"] = features
+
+    text_scores = bert_similarity_batch(
+        [(item["student_text"], item["teacher_text"]) for item in text_items],
+        [answer_key.text_entry(item["teacher_text"]) for item in text_items],
+        [item["text_features"] for item in text_items],
+    )
+    for item, (similarity_score, contextual_score) in zip(text_items, text_scores):
+        item["similarity_score"] = similarity_score
+        item["contextual_score"] = contextual_score
+    return items
+
+
+def build_comparison(item):
+    """Combines the text and visual results of one question into a comparison entry."""
+    has_meaningful_text = item["has_meaningful_text"]
+    has_visual = item["has_visual"]
+    evaluation_type = item["evaluation_type"]
+    img_score = item["img_score"]
+
+    # ── Compute text score only when there is text to evaluate ──
+    if has_meaningful_text:
+        similarity_score, contextual_score = item["similarity_score"], item["contextual_score"]
+        text_score = 10 * (
+            0.4 * (similarity_score / 100) + 0.6 * (contextual_score / 100)
+        )
+    else:
+        similarity_score, contextual_score, text_score = 0.0, 0.0, 0.0
+
+    # ── Final score based on content type ──
+    if has_meaningful_text and has_visual:
+        # Mixed: 70% text + 30% image/diagram
+        final_score = round((0.7 * text_score) + (0.3 * img_score), 1)
+        # Normalise evaluation_type label for the frontend
+        evaluation_type = "diagram" if "diagram" in evaluation_type else "image"
+    elif has_meaningful_text:
+        # Text only: 100% text score
+        final_score = round(text_score, 1)
+        evaluation_type = "text"
+    elif has_visual:
+        # Visual only: 100% image/diagram score
+        final_score = round(float(img_score), 1)
+        evaluation_type = "diagram" if "diagram" in evaluation_type else "image"
+    else:
+        # Nothing detected
+        final_score = 0.0
+        evaluation_type = "none"
+
+    return {
+        "student_text": item["student_text"] if has_meaningful_text else "",
+        "teacher_text": item["teacher_text"] if has_meaningful_text else "",
+        "similarity_score": round(similarity_score, 1) if has_meaningful_text else 0,
+        "contextual_score": round(contextual_score, 1) if has_meaningful_text else 0,
+        "text_marks": round(text_score, 1) if has_meaningful_text else 0,
+        "image_similarity": item["img_sim"],
+        "image_marks": img_score,
+        "evaluation_type": evaluation_type,
+        "models_run": item.get("models_run", []),
+        "total_score": final_score,
+    }
+
+
+# ------------------------
+# Script Artifacts ✅
+# Per-question intermediates of a graded script: OCR page text, split
+# answers, the student's SBERT features and the text/diagram scores.
+# They are stored with the script's graded result (see Graded Result
+# Cache), so a key revision can re-score single questions without OCR,
+# splitting, student-side SBERT or any diagram model.
+# ------------------------
+ARTIFACT_FIELDS = (
+    "page", "q_idx", "num_questions", "student_text", "teacher_text", "has_meaningful_text",
+    "has_visual", "evaluation_type", "img_sim", "img_score", "models_run", "diagram_scores",
+    "similarity_score", "contextual_score",
+)
+
+
+def question_artifact(item):
+    """Graded item → storable artifact (the SBERT embedding as a float list)."""
+    artifact = {field: item[field] for field in ARTIFACT_FIELDS if field in item}
+    features = item.get("text_features")
+    if features is not None:
+        embedding = features["embedding"]
+        artifact["text_features"] = {
+            "clean": features["clean"],
+            "embedding": embedding.tolist() if hasattr(embedding, "tolist") else list(embedding),
+            "has_negation": features["has_negation"],
         }
+    return artifact
+
+
+# ------------------------
+# Pipelined Grading Engine ✅
+# render → OCR → split + visual analysis → text scoring for one script.
+# Each stage runs on its own thread(s) and hands pages on through bounded
+# queues, so page N+1 is rendered and OCR'd while page N is analysed and
+# page N's text is scored while page N+1's strips are compared. A script
+# takes about as long as its slowest stage instead of the sum of them.
+# At most PIPELINE_DEPTH rendered pages wait for visual analysis.
+# ------------------------
+PIPELINE_DEPTH = max(int(os.getenv("GRADEX_PIPELINE_DEPTH", str(max(OCR_CONCURRENCY, 1) * 2))), 1)
+
+
+@timed_stage("grade_script")
+def grade_script_pipelined(pdf_source, answer_key, student_images=None, on_extracted=None,
+                           on_page=None, on_question=None, on_error=None, artifacts=None):
+    """
+    Renders, OCRs and grades one student PDF; returns its `comparisons` dict.
+
+    pdf_source     → PDF bytes or a file path (see extract_text_from_pdf).
+    answer_key     → CompiledAnswerKey of the exam.
+    student_images → optional PageStore for the rendered pages; each page is
+                     dropped from it once its visual analysis is done.
+    on_extracted   → optional callback(page_index, total_pages) when a page's text is ready.
+    on_page        → optional callback(page_index, total_pages) after a page is fully scored.
+    on_question    → optional callback(question_number, page_index, comparison).
+    on_error       → optional callback(page_index, message); with it a failed page is
+                     reported and skipped, without it the first failure is raised.
+    artifacts      → optional dict filled with "page_texts" (OCR text per page) and
+                     "questions" (question_artifact per comparison, in order).
+    """
+    if student_images is None:
+        student_images = PageStore()
+
+    # Every queued page holds one of the PIPELINE_DEPTH slots, so puts never block
+    page_slots = threading.Semaphore(PIPELINE_DEPTH)
+    texts = queue.Queue(maxsize=PIPELINE_DEPTH + 1)    # OCR → analysis
+    analysed = queue.Queue(maxsize=PIPELINE_DEPTH)     # analysis → text scoring
+    errors = []
+    if artifacts is not None:
+        artifacts.update(page_texts=[], questions=[])
+
+    def fail(page_idx, e):
+        print(f"Grading pipeline failed on page {page_idx + 1 if page_idx is not None else '?'}: {e}")
+        if on_error:
+            on_error(page_idx, str(e))
+        else:
+            errors.append(e)
+
+    def on_text(page_idx, text, total_pages):
+        if artifacts is not None:
+            artifacts["page_texts"].append(text)   # called in page order
+        texts.put(("page", page_idx, text, total_pages))
+        if on_extracted:
+            on_extracted(page_idx, total_pages)
+
+    # ── Stages 1 + 2: render on this thread, OCR on ocr_executor ──
+    def render():
+        try:
+            extracted = extract_text_from_pdf(
+                pdf_source, mode="student", page_images=student_images,
+                on_text=on_text, page_slots=page_slots,
+            )
+            texts.put(("done", len(extracted)))
+        except Exception as e:
+            fail(None, e)
+            texts.put(("done", None))
+
+    # ── Stages 3 + 4: split each page into questions, score strips/diagrams ──
+    def analyse():
+        expected, seen = None, 0
+        while expected is None or seen < expected:
+            message = texts.get()
+            if message[0] == "done":
+                # A failed render stops at the pages already received
+                expected = seen if message[1] is None else message[1]
+                continue
+
+            _, page_idx, text, total_pages = message
+            seen += 1
+            items = None
+            try:
+                if not errors and page_idx < len(answer_key.page_texts):
+                    items = grade_page(page_idx, text, student_images.get(page_idx), answer_key)
+            except Exception as e:
+                fail(page_idx, e)
+            finally:
+                student_images.discard(page_idx)
+                page_slots.release()
+            if items is not None:
+                analysed.put((page_idx, items, total_pages))
+        analysed.put(None)
+
+    threading.Thread(target=render, name="gradex-render", daemon=True).start()
+    threading.Thread(target=analyse, name="gradex-analyse", daemon=True).start()
+
+    # ── Stage 5: text scoring; pages that queued up meanwhile share one batch ──
+    comparisons = {}
+    finished = False
+    while not finished:
+        batch = [analysed.get()]
+        while batch[-1] is not None:
+            try:
+                batch.append(analysed.get_nowait())
+            except queue.Empty:
+                break
+        finished = batch[-1] is None
+        pages = [entry for entry in batch if entry is not None]
+        if not pages or errors:
+            continue
+
+        try:
+            score_text_items([item for _, items, _ in pages for item in items], answer_key)
+        except Exception as e:
+            fail(pages[0][0], e)
+            continue
+
+        for page_idx, items, total_pages in pages:
+            for item in items:
+                question = len(comparisons) + 1
+                comparisons[question] = build_comparison(item)
+                if artifacts is not None:
+                    artifacts["questions"].append(question_artifact(item))
+                if on_question:
+                    on_question(question, page_idx, comparisons[question])
+            if on_page:
+                on_page(page_idx, total_pages)
+
+    if errors:
+        raise errors[0]
+    return comparisons
+
+
+# ------------------------
+# Re-submitted Scripts ✅
+# The same PDF (by sha256) uploaded again for the same answer key gets
+# the grade computed the first time, straight from memory. While the first
+# upload is still being graded its duplicates wait for that run instead
+# of starting a second pipeline (frontend retries after a timeout).
+# A run with failed pages is never shared: its waiters grade the script
+# again themselves. Entries live as long as the stored upload
+# (GRADEX_UPLOAD_RETENTION_HOURS).
+# ------------------------
+GRADE_MEMO_SIZE = int(os.getenv("GRADEX_GRADE_MEMO_SIZE", "1000"))
+
+
+class IncompleteGrade(Exception):
+    """Set on a memo future whose run had failed pages; waiters re-grade."""
+
+
+class GradeMemo:
+    """script key → Future of its `comparisons`, most recently used last."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key → (stored_at, Future)
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """Live future for key, or None. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, future = entry
+        if future.done() and time.time() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return future
+
+    def _store(self, key, future):
+        """Caller holds the lock."""
+        self._entries[key] = (time.time(), future)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Finished comparisons for key, or None."""
+        with self._lock:
+            future = self._lookup(key) if self.ttl > 0 else None
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def put(self, key, comparisons):
+        if self.ttl <= 0:
+            return
+        future = Future()
+        future.set_result(comparisons)
+        with self._lock:
+            self._store(key, future)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def grade(self, key, grade_fn):
+        """
+        Returns (comparisons, cached). grade_fn() → (comparisons, complete) only
+        runs when no identical script is memoised or already being graded. An
+        incomplete run is returned to its caller alone; anyone waiting on it
+        grades the script again.
+        """
+        if self.ttl <= 0:
+            return grade_fn()[0], False
+
+        while True:
+            with self._lock:
+                future = self._lookup(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._store(key, future)
+
+            if not owner:
+                try:
+                    return future.result(), True
+                except IncompleteGrade:
+                    continue
+
+            try:
+                comparisons, complete = grade_fn()
+            except Exception as e:
+                self._forget(key, future)   # let the next upload retry
+                future.set_exception(e)
+                raise
+            if complete:
+                future.set_result(comparisons)
+            else:
+                self._forget(key, future)
+                future.set_exception(IncompleteGrade())
+            return comparisons, False
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._entries.get(key, (None, None))[1] is future:
+                del self._entries[key]
+
+
+graded_scripts = GradeMemo(UPLOAD_RETENTION_HOURS * 3600, GRADE_MEMO_SIZE)
+
+
+# ------------------------
+# Graded Result Cache ✅ (MongoDB `graded_results`)
+# Persistent layer under the in-process memo. There is one document per
+# (answer key hash, student PDF sha256, SCORING_VERSION) holding its
+# `comparisons`. It survives restarts and is shared by every worker, so
+# disputed marks, re-opened sessions and client retries skip the
+# pipeline. SCORING_VERSION hashes the scoring code (thresholds,
+# weights, model loaders) and every setting that changes a score.
+# Editing any of them misses the old entries, and the TTL index clears
+# them. GRADEX_RESULT_CACHE=0 turns the cache off. GRADEX_SCORING_SALT
+# forces a new version by hand.
+# ------------------------
+RESULT_CACHE_ENABLED = os.getenv("GRADEX_RESULT_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+RESULT_CACHE_LOOKUPS = Counter(
+    "gradex_result_cache_lookups_total", "Graded result cache lookups by outcome.", ("outcome",)
+)
+
+SCORING_CODE = (
+    _load_sbert, load_cross_encoder, _load_clip, _load_dino, _ocr_student_page, extract_text_from_image,
+    clean_for_handwriting, *OCR_BACKENDS.values(), extract_text_from_pdf, extract_text_layer, to_gray,
+    _local_sbert_encode, _local_cross_encoder_scores, sbert_encode, cross_encoder_scores,
+    preprocess_text, contains_negation, text_features, text_features_batch, bert_similarity_batch,
+    split_text_by_questions, strip_bounds, split_image_by_question_count, ssim_input,
+    *IMAGE_SIMILARITY_BACKENDS.values(), image_marks, PageAnalysis,
+    _batched_forward, _local_clip_embed, clip_embeddings, clip_embedding, clip_similarity,
+    _local_dino_embed, dino_embeddings, dino_embedding, dino_similarity,
+    embedding_similarities, orb_features, orb_similarity, extract_diagram_labels, label_features,
+    ocr_label_similarity, diagram_features, _weighted_diagram_score, diagram_similarity_details,
+    score_diagram_pairs, diagram_marks, grade_page, score_text_items, build_comparison,
+)
+SCORING_SETTINGS = {
+    "ocr": [OCR_BACKEND, OCR_PROMPT_VERSION, GEMINI_OCR_MODEL, GEMINI_OCR_PROMPT, PDF_RENDER_ZOOM],
+    "questions": QUESTION_PATTERN,
+    "cross_encoder": [CROSS_ENCODER_TIER, CROSS_ENCODER_TIERS.get(CROSS_ENCODER_TIER)],
+    "negation_words": sorted(negation_words),
+    "diagram": [DIAGRAM_WEIGHTS, DIAGRAM_CHEAP_MODELS, DIAGRAM_CASCADE, DIAGRAM_CASCADE_MARGIN],
+    "image": [FAST_SSIM_SCALES, DIAGRAM_STRIP_SIZE, PAGE_STORE_SCALE],
+    "salt": os.getenv("GRADEX_SCORING_SALT", ""),
+}
+
+
+def _code_source(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):   # no source shipped → fall back to the name
+        return getattr(obj, "__qualname__", repr(obj))
+
+
+def scoring_version():
+    h = hashlib.sha256(json.dumps(SCORING_SETTINGS, sort_keys=True, default=str).encode())
+    for obj in SCORING_CODE:
+        h.update(_code_source(obj).encode())
+    return h.hexdigest()[:16]
+
+
+SCORING_VERSION = scoring_version()
+
+
+def script_key(answer_key, digest):
+    """Result cache / memo key of one student PDF graded against answer_key."""
+    return (answer_key.key_hash(), digest, SCORING_VERSION)
+
+
+class ResultCache:
+    def __init__(self, collection, enabled=True):
+        self.collection = collection
+        self.enabled = enabled
+
+    @staticmethod
+    def _filter(key):
+        key_hash, digest, version = key
+        return {"key_hash": key_hash, "pdf_sha256": digest, "scoring_version": version}
+
+    @staticmethod
+    def _storable(value):
+        """Plain JSON types only (numpy scalars become floats)."""
+        return json.loads(json.dumps(value, default=float))
+
+    def get(self, key):
+        """Stored comparisons for key, or None (also when Mongo is unavailable)."""
+        if not self.enabled:
+            return None
+        try:
+            doc = self.collection.find_one(self._filter(key), {"_id": 0, "comparisons": 1})
+        except Exception as e:
+            print(f"⚠️  Result cache lookup failed: {e}")
+            RESULT_CACHE_LOOKUPS.inc(outcome="error")
+            return None
+        RESULT_CACHE_LOOKUPS.inc(outcome="hit" if doc else "miss")
+        if doc is None:
+            return None
+        # Mongo keys are strings; comparisons are numbered from 1
+        return {int(question): comparison for question, comparison in doc["comparisons"].items()}
+
+    def put(self, key, comparisons, artifacts=None, students=()):
+        """Stores a graded script, its artifacts (Script Artifacts) and the students it belongs to."""
+        if not self.enabled:
+            return
+        fields = {"comparisons": {str(question): comparison for question, comparison in comparisons.items()}}
+        if artifacts is not None:
+            fields["page_texts"] = artifacts["page_texts"]
+            fields["questions"] = artifacts["questions"]
+        fields = self._storable(fields)
+        fields["created_at"] = datetime.utcnow()   # BSON date for the TTL index
+        update = {"$set": fields}
+        if students:
+            update["$addToSet"] = {"students": {"$each": list(students)}}
+        try:
+            with mongo_write("result_cache"):
+                self.collection.update_one(self._filter(key), update, upsert=True)
+        except Exception as e:
+            print(f"⚠️  Result cache write failed: {e}")
+
+    def link(self, key, student):
+        """Records that student submitted this script (cache hits included)."""
+        if not self.enabled:
+            return
+        try:
+            with mongo_write("result_cache"):
+                self.collection.update_one(self._filter(key), {"$addToSet": {"students": student}})
+        except Exception as e:
+            print(f"⚠️  Result cache write failed: {e}")
+
+
+result_cache = ResultCache(graded_results_collection, RESULT_CACHE_ENABLED)
+
+
+def script_student(session, student_name, roll_number):
+    """Student record linked to a stored result; None without a roll number (no report to update)."""
+    if not roll_number:
+        return None
+    return {
+        "exam_id": session.exam_id,
+        "exam_name": session.exam_name,
+        "student_name": student_name,
+        "roll_number": roll_number,
+    }
+
+
+def grade_script(pdf_data, digest, answer_key, student=None, **pipeline_options):
+    """
+    Returns (comparisons, cached) for one uploaded PDF: the memo, then the
+    result cache, then grade_script_pipelined (pipeline_options are its callbacks).
+
+    student → optional script_student() record, linked to the stored result so a
+              key revision (/exams/<exam_id>/revise) can update that student's report.
+    A grade with failed pages (reported through on_error) is returned but not stored.
+    """
+    key = script_key(answer_key, digest)
+    from_store, failed = [], []
+    on_error = pipeline_options.get("on_error")
+    if on_error:
+        def track_error(page_idx, message):
+            failed.append(page_idx)
+            on_error(page_idx, message)
+        pipeline_options["on_error"] = track_error
+
+    def compute():
+        comparisons = result_cache.get(key)
+        if comparisons is not None:
+            from_store.append(True)
+            return comparisons, True
+        artifacts = {}
+        comparisons = grade_script_pipelined(pdf_data, answer_key, artifacts=artifacts, **pipeline_options)
+        if not failed:
+            result_cache.put(key, comparisons, artifacts, [student] if student else ())
+        return comparisons, not failed
+
+    comparisons, shared = graded_scripts.grade(key, compute)
+    if student and not failed and (shared or from_store):
+        result_cache.link(key, student)
+    return comparisons, shared or bool(from_store)
+
+
+# ------------------------
+# Answer Key Revisions ✅ (incremental re-grading)
+# POST /exams/<exam_id>/revise fixes answers in the teacher key and
+# re-scores only the questions whose teacher answer changed. This covers
+# every script of the class kept in the result cache with its
+# artifacts. Nothing is OCR'd, split or run through a diagram model
+# again. The affected questions of the whole class share one text
+# scoring batch: cross-encoder plus SBERT for the revised teacher answers
+# only. Each linked student's saved report is then updated in place.
+#   {"answers": [{"page": 2, "question": 1, "text": "…"},   ← one answer
+#                {"page": 3, "text": "…"}]}                  ← whole page text
+# page and question are 1-based. A revision must keep every page's
+# question count, because the image strips depend on it; structural
+# changes need a new /upload/teacher. Scripts without stored artifacts
+# (graded with the result cache off, or under an older SCORING_VERSION)
+# are listed in `reports_not_rescored` for a full re-grade.
+# ------------------------
+def apply_key_revisions(session, revisions):
+    """Returns (revised page texts, [(page_idx, q_idx)] of changed answers); ValueError if invalid."""
+    page_texts = list(session.page_texts)
+    for revision in revisions:
+        try:
+            page_idx = int(revision["page"]) - 1
+            q_idx = int(revision["question"]) - 1 if revision.get("question") is not None else None
+            text = str(revision["text"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Each revision needs a numeric page, an optional question and the text") from None
+
+        if not 0 <= page_idx < len(page_texts):
+            raise ValueError(f"Page {page_idx + 1} is not in the answer key")
+        if q_idx is None:
+            page_texts[page_idx] = text
+            continue
+        if not 0 <= q_idx < len(split_text_by_questions(page_texts[page_idx])):
+            raise ValueError(f"Page {page_idx + 1} has no question {q_idx + 1}")
+        revised = revise_question_text(page_texts[page_idx], q_idx, text)
+        if revised is None:
+            raise ValueError(
+                f"Question {q_idx + 1} on page {page_idx + 1} cannot be revised on its own; "
+                "send the whole page text instead"
+            )
+        page_texts[page_idx] = revised
+
+    affected = []
+    for page_idx, (old_text, new_text) in enumerate(zip(session.page_texts, page_texts)):
+        if old_text == new_text:
+            continue
+        old_questions = session.answer_key.questions(page_idx)
+        new_questions = split_text_by_questions(new_text)
+        if len(old_questions) != len(new_questions):
+            raise ValueError(
+                f"Page {page_idx + 1} would go from {len(old_questions)} to {len(new_questions)} "
+                "questions; upload a new key for structural changes"
+            )
+        affected += [
+            (page_idx, q_idx)
+            for q_idx, ((_, old_answer), (_, new_answer)) in enumerate(zip(old_questions, new_questions))
+            if old_answer != new_answer
+        ]
+    return page_texts, affected
+
+
+def rescore_class(exam_id, old_key, answer_key, affected):
+    """
+    Re-scores the affected questions of every stored script of the exam that
+    was graded against old_key, and stores the results under answer_key.
+    Returns ([(students, comparisons)] per script, questions re-scored).
+    """
+    docs = graded_results_collection.find(
+        {
+            "key_hash": old_key.key_hash(),
+            "scoring_version": SCORING_VERSION,
+            "questions": {"$exists": True},
+            "students.exam_id": exam_id,
+        },
+        {"_id": 0, "pdf_sha256": 1, "page_texts": 1, "questions": 1, "students": 1},
     )
+    affected = set(affected)
+    scripts, to_score = [], []
+    for doc in docs:
+        items = [dict(artifact) for artifact in doc["questions"]]
+        for item in items:
+            if (item["page"], item["q_idx"]) in affected:
+                item["teacher_text"] = answer_key.questions(item["page"])[item["q_idx"]][1]
+                to_score.append(item)
+        scripts.append((doc, items))
+
+    # ✅ One text batch for the whole class; student SBERT features come from the artifacts
+    score_text_items(to_score, answer_key)
+
+    rescored = []
+    for doc, items in scripts:
+        comparisons = {question: build_comparison(item) for question, item in enumerate(items, start=1)}
+        students = [student for student in doc["students"] if student["exam_id"] == exam_id]
+        key = script_key(answer_key, doc["pdf_sha256"])
+        artifacts = {"page_texts": doc["page_texts"], "questions": [question_artifact(item) for item in items]}
+        result_cache.put(key, comparisons, artifacts, students)
+        graded_scripts.put(key, comparisons)
+        rescored.append((students, comparisons))
+    return rescored, sum(1 for item in to_score if item["has_meaningful_text"])
+
+
+def update_class_reports(session, rescored):
+    """Rewrites the saved report of every re-scored student; returns how many matched."""
+    revised_at = datetime.utcnow().isoformat()
+    operations = []
+    for students, comparisons in rescored:
+        for student in students:
+            report = build_report(student["student_name"], student["roll_number"], comparisons)
+            report.update(exam_id=session.exam_id, exam_name=session.exam_name, revised_at=revised_at)
+            operations.append(UpdateOne(
+                {"exam_id": session.exam_id, "roll_number": student["roll_number"]},
+                {"$set": ResultCache._storable(report)},   # string question keys for Mongo
+            ))
+    if not operations:
+        return 0
+    with mongo_write("revision_reports"):
+        result = reports_collection.bulk_write(operations, ordered=False)
+    invalidate_analytics(session.exam_id, session.exam_name)
+    return result.matched_count
+
+
+@app.route("/exams/<exam_id>/revise", methods=["POST"])
+def revise_exam_key(exam_id):
+    session = exam_store.get(exam_id)
+    if session is None:
+        return jsonify({"error": "Exam not found"}), 404
+
+    revisions = (request.get_json(silent=True) or {}).get("answers")
+    if not isinstance(revisions, list) or not revisions:
+        return jsonify({"error": "Provide the revised answers as a non-empty `answers` list"}), 400
+
+    try:
+        page_texts, affected = apply_key_revisions(session, revisions)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    questions_revised = [{"page": page_idx + 1, "question": q_idx + 1} for page_idx, q_idx in affected]
+    if not affected:
+        return jsonify({
+            "message": "The revision does not change any answer",
+            "examId": exam_id,
+            "questions_revised": [],
+        }), 200
+
+    # ✅ Re-score against the unsaved key first; the stored key only changes once that worked
+    started = time.perf_counter()
+    revised = session.revised(page_texts)
+    saved = False
+    try:
+        rescored, questions_rescored = rescore_class(exam_id, session.answer_key, revised.answer_key, affected)
+        exam_store.save(revised)
+        saved = True
+        reports_updated = update_class_reports(revised, rescored)
+        rescored_rolls = {student["roll_number"] for students, _ in rescored for student in students}
+        saved_rolls = reports_collection.distinct("roll_number", {"exam_id": exam_id})
+    except Exception as e:
+        print(f"Re-scoring exam {exam_id} after a key revision failed: {e}")
+        if saved:
+            try:
+                exam_store.save(session)   # roll back to the key the reports were graded with
+            except Exception as rollback_error:
+                print(f"Rolling back the key of exam {exam_id} failed: {rollback_error}")
+        return jsonify({
+            "error": "Re-scoring the class failed; the answer key was not revised",
+            "examId": exam_id,
+            "questions_revised": [],
+        }), 500
+
+    return jsonify({
+        "message": "Answer key revised and class re-scored ✅",
+        "examId": exam_id,
+        "questions_revised": questions_revised,
+        "scripts_rescored": len(rescored),
+        "questions_rescored": questions_rescored,
+        "reports_updated": reports_updated,
+        "reports_not_rescored": sorted(str(roll) for roll in saved_rolls if roll and roll not in rescored_rolls),
+        "seconds": round(time.perf_counter() - started, 3),
+    }), 200
 
 
 # ------------------------
@@ -592,272 +3399,668 @@ def upload_teacher_pdf():
 # ------------------------
 @app.route("/upload/student_api", methods=["POST"])
 def upload_student_pdf_api():
-    global processing_mode, teacher_answers
-    global student_page_images
+    student_name = request.form.get("studentName")
+    roll_number = request.form.get("rollNumber")
+
+    session = resolve_exam(request_exam_id())
+    if session is None or len(session.page_texts) == 0:
+        return jsonify({"error": "Teacher key not uploaded yet"}), 400
+
+    if "pdf" not in request.files:
+        return jsonify({"error": "No file"}), 400
+
+    pdf_file = request.files["pdf"]
+
+    # ✅ Job mode: queue the script and return a job id right away
+    if _is_truthy(request.args.get("async") or request.form.get("async")):
+        return _submit_student_job(session, pdf_file, student_name, roll_number)
+
+    # ✅ Graded from memory; an identical re-submission returns the earlier grade
+    pdf_data, digest = read_pdf_upload(pdf_file)
+    comparisons, cached = grade_script(
+        pdf_data, digest, session.answer_key, student=script_student(session, student_name, roll_number)
+    )
+
+    return jsonify(
+        {
+            "examId": session.exam_id,
+            "student_name": student_name,
+            "roll_number": roll_number,
+            "comparisons": comparisons,
+            "cached": cached,
+        }
+    )
+
+
+# ------------------------
+# Student Upload, streamed (Server-Sent Events) ✅
+# Same form fields as /upload/student_api. Each page is graded as soon
+# as its OCR text arrives, so results start flowing within seconds:
+#   event: page     → {"page", "total_pages"} when a page's text is ready
+#   event: question → {"question", "page", …comparison fields}
+#   event: summary  → build_report() totals plus the full `comparisons` dict
+#                     ("cached": true when an identical upload was already graded)
+#   event: error    → {"error"}
+# A comment line is sent every SSE_KEEPALIVE_SECONDS so proxies keep
+# long scripts open.
+# ------------------------
+SSE_KEEPALIVE_SECONDS = float(os.getenv("GRADEX_SSE_KEEPALIVE_SECONDS", "15"))
+
 
-    processing_mode = "student"
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
+
+@app.route("/upload/student_stream", methods=["POST"])
+def upload_student_pdf_stream():
     student_name = request.form.get("studentName")
     roll_number = request.form.get("rollNumber")
 
-    if not teacher_answers or len(teacher_answers) == 0:
+    session = resolve_exam(request_exam_id())
+    if session is None or len(session.page_texts) == 0:
         return jsonify({"error": "Teacher key not uploaded yet"}), 400
 
     if "pdf" not in request.files:
         return jsonify({"error": "No file"}), 400
 
-    # ✅ reset student images each time
-    student_page_images.clear()
+    pdf_data, digest = read_pdf_upload(request.files["pdf"])
+    events = queue.Queue()
 
-    pdf_file = request.files["pdf"]
-    pdf_path = os.path.join(UPLOAD_FOLDER, pdf_file.filename)
-    pdf_file.save(pdf_path)
+    def grade():
+        cached = False
+        try:
+            comparisons, cached = grade_script(
+                pdf_data, digest, session.answer_key,
+                student=script_student(session, student_name, roll_number),
+                on_extracted=lambda page_idx, total: events.put(
+                    ("page", {"page": page_idx + 1, "total_pages": total})
+                ),
+                on_question=lambda question, page_idx, comparison: events.put(
+                    ("question", {"question": question, "page": page_idx + 1, **comparison})
+                ),
+                on_error=lambda page_idx, message: events.put(
+                    ("error", {"error": message, "page": page_idx + 1 if page_idx is not None else None})
+                ),
+            )
+            if cached:
+                # Already graded: replay the stored questions right away
+                for question, comparison in comparisons.items():
+                    events.put(("question", {"question": question, "page": None, **comparison}))
+        except Exception as e:
+            print(f"Streaming grading failed: {e}")
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(("done", {"cached": cached}))
+
+    threading.Thread(target=grade, name="gradex-stream", daemon=True).start()
+
+    def generate():
+        comparisons = {}
+        failed_pages, failed = set(), False
+        yield _sse_event("start", {
+            "examId": session.exam_id, "student_name": student_name, "roll_number": roll_number,
+        })
+        while True:
+            try:
+                event = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+
+            kind, data = event
+            if kind == "done":
+                cached = data["cached"]
+                break
+            if kind == "question":
+                comparisons[data["question"]] = {
+                    field: value for field, value in data.items() if field not in ("question", "page")
+                }
+            elif kind == "error":
+                failed = True
+                if data.get("page") is not None:
+                    failed_pages.add(data["page"])
+            yield _sse_event(kind, data)
+
+        # ✅ A script with failed pages is partial: the client shows it but doesn't save it
+        report = build_report(student_name, roll_number, comparisons)
+        report["comparisons"] = report.pop("details")
+        yield _sse_event("summary", {
+            **report, "examId": session.exam_id, "cached": cached,
+            "complete": not failed, "failed_pages": sorted(failed_pages),
+        })
+
+    return app.response_class(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    extracted_answers = extract_text_from_pdf(pdf_path)
 
-    comparisons = {}
-    question_counter = 1
+# ------------------------
+# Background Grading Jobs ✅
+# Scripts are queued on a bounded worker pool; clients poll for
+# status, per-page progress and the final `comparisons` payload.
+# ------------------------
+def _is_truthy(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _prune_finished_jobs():
+    """Drops finished jobs older than JOB_RETENTION_SECONDS. Caller holds the lock."""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    expired = [
+        job_id for job_id, job in grading_jobs.items()
+        if job["finished_at"] is not None and job["finished_at"] < cutoff
+    ]
+    for job_id in expired:
+        del grading_jobs[job_id]
+
+    expired_batches = [
+        batch_id for batch_id, batch in grading_batches.items()
+        if batch["finished_at"] is not None and batch["finished_at"] < cutoff
+    ]
+    for batch_id in expired_batches:
+        del grading_batches[batch_id]
+
+
+def _update_job(job_id, **fields):
+    with grading_jobs_lock:
+        job = grading_jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+
+def _job_status_payload(job):
+    payload = {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "student_name": job["student_name"],
+        "roll_number": job["roll_number"],
+        "exam_id": job["exam_id"],
+        "exam_name": job["exam_name"],
+        "progress": {
+            "stage": job["stage"],
+            "pages_total": job["pages_total"],
+            "pages_extracted": job["pages_extracted"],
+            "pages_scored": job["pages_scored"],
+        },
+        "submitted_at": job["submitted_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "cached": job["cached"],
+    }
+    if job["error"]:
+        payload["error"] = job["error"]
+    return payload
+
+
+def _run_student_job(job_id, pdf_data, digest, answer_key, student=None, on_finished=None):
+    _update_job(job_id, status="running", stage="extracting", started_at=time.time())
+    try:
+        def on_extracted(page_idx, total_pages):
+            _update_job(job_id, pages_total=total_pages, pages_extracted=page_idx + 1)
 
-    # ✅ Compare page-wise, but split each page into individual questions
-    for page_idx, (student_page_text, teacher_page_text) in enumerate(
-        zip(extracted_answers, teacher_answers)
-    ):
-        # ── Split text into per-question segments ──
-        teacher_questions = split_text_by_questions(teacher_page_text)
-        student_questions = split_text_by_questions(student_page_text)
-
-        num_questions = max(len(teacher_questions), len(student_questions))
-
-        # ── Split page images into per-question strips ──
-        teacher_img_full = teacher_page_images.get(page_idx)
-        student_img_full = student_page_images.get(page_idx)
-
-        teacher_strips = split_image_by_question_count(teacher_img_full, num_questions) if teacher_img_full else [None] * num_questions
-        student_strips = split_image_by_question_count(student_img_full, num_questions) if student_img_full else [None] * num_questions
-
-        # Pad shorter list so zip works safely
-        while len(teacher_questions) < num_questions:
-            teacher_questions.append((len(teacher_questions) + 1, ""))
-        while len(student_questions) < num_questions:
-            student_questions.append((len(student_questions) + 1, ""))
-
-        # ── Evaluate each question on this page ──
-        for q_idx in range(num_questions):
-            _, teacher_text = teacher_questions[q_idx]
-            _, student_text = student_questions[q_idx]
-
-            teacher_img = teacher_strips[q_idx] if q_idx < len(teacher_strips) else None
-            student_img = student_strips[q_idx] if q_idx < len(student_strips) else None
-
-            # ── Determine what content exists in this question strip ──
-            has_meaningful_text = bool(
-                student_text.strip()
-                and student_text not in ("NO_TEXT_DETECTED", "OCR_ERROR", "EXTRACTION_ERROR")
-                and len(student_text.strip()) > 5
-            )
+        def on_scored(page_idx, total_pages):
+            _update_job(job_id, stage="scoring", pages_scored=page_idx + 1)
 
-            has_visual = False
-            evaluation_type = "text"
-            img_sim = 0.0
-            img_score = 0
+        # Pages are scored while later pages are still being extracted
+        comparisons, cached = grade_script(
+            pdf_data, digest, answer_key, student=student, on_extracted=on_extracted, on_page=on_scored
+        )
+        _update_job(
+            job_id, status="completed", stage="done", comparisons=comparisons, cached=cached,
+            finished_at=time.time(),
+        )
+    except Exception as e:
+        print(f"Grading job {job_id} failed: {e}")
+        _update_job(job_id, status="failed", stage="done", error=str(e), finished_at=time.time())
+
+    if on_finished:
+        on_finished(job_id)
+
+
+def _new_job(session, student_name, roll_number, batch_id=None):
+    """Registers a queued job record and returns its id. Caller holds the lock."""
+    job_id = uuid.uuid4().hex
+    grading_jobs[job_id] = {
+        "job_id": job_id,
+        "batch_id": batch_id,
+        "status": "queued",
+        "stage": "queued",
+        "student_name": student_name,
+        "roll_number": roll_number,
+        "exam_id": session.exam_id,
+        "exam_name": session.exam_name,
+        "pages_total": None,
+        "pages_extracted": 0,
+        "pages_scored": 0,
+        "comparisons": None,
+        "cached": False,
+        "error": None,
+        "submitted_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    return job_id
+
+
+def _submit_student_job(session, pdf_file, student_name, roll_number):
+    # Read the upload first so a failed read never leaves a job stuck in "queued"
+    pdf_data, digest = read_pdf_upload(pdf_file)
+
+    with grading_jobs_lock:
+        _prune_finished_jobs()
+        pending = sum(
+            1 for job in grading_jobs.values()
+            if job["status"] in ("queued", "running") and job["batch_id"] is None
+        )
+        if pending >= MAX_PENDING_JOBS:
+            return jsonify({"error": "Grading queue is full, try again later"}), 503
 
-            if teacher_img is not None and student_img is not None:
-                has_diagram = detect_diagram(teacher_img) or detect_diagram(student_img)
-                if has_diagram:
-                    has_visual = True
-                    diag_sim = advanced_diagram_similarity(teacher_img, student_img)
-                    img_score = diagram_marks(diag_sim)
-                    img_sim = round(diag_sim, 3)
-                    evaluation_type = "diagram" if not has_meaningful_text else "mixed_diagram"
-                else:
-                    # Check whether the strip has any non-trivial image content
-                    # (pure white / near-blank strips → no visual to evaluate)
-                    img_arr = cv2.cvtColor(np.array(teacher_img), cv2.COLOR_RGB2GRAY)
-                    non_white = np.sum(img_arr < 240) / img_arr.size
-                    if non_white > 0.02:          # >2% non-white pixels → real image content
-                        has_visual = True
-                        raw_sim = image_similarity(student_img, teacher_img)
-                        img_score = image_marks(raw_sim)
-                        img_sim = round(raw_sim, 3)
-                        evaluation_type = "image" if not has_meaningful_text else "mixed_image"
-
-            # ── Compute text score only when there is text to evaluate ──
-            if has_meaningful_text:
-                similarity_score, contextual_score = bert_similarity(student_text, teacher_text)
-                text_score = 10 * (
-                    0.4 * (similarity_score / 100) + 0.6 * (contextual_score / 100)
-                )
-            else:
-                similarity_score, contextual_score, text_score = 0.0, 0.0, 0.0
-
-            # ── Final score based on content type ──
-            if has_meaningful_text and has_visual:
-                # Mixed: 70% text + 30% image/diagram
-                final_score = round((0.7 * text_score) + (0.3 * img_score), 1)
-                # Normalise evaluation_type label for the frontend
-                evaluation_type = "diagram" if "diagram" in evaluation_type else "image"
-            elif has_meaningful_text:
-                # Text only: 100% text score
-                final_score = round(text_score, 1)
-                evaluation_type = "text"
-            elif has_visual:
-                # Visual only: 100% image/diagram score
-                final_score = round(float(img_score), 1)
-                evaluation_type = "diagram" if "diagram" in evaluation_type else "image"
-            else:
-                # Nothing detected
-                final_score = 0.0
-                evaluation_type = "none"
-
-            comparisons[question_counter] = {
-                "student_text": student_text if has_meaningful_text else "",
-                "teacher_text": teacher_text if has_meaningful_text else "",
-                "similarity_score": round(similarity_score, 1) if has_meaningful_text else 0,
-                "contextual_score": round(contextual_score, 1) if has_meaningful_text else 0,
-                "text_marks": round(text_score, 1) if has_meaningful_text else 0,
-                "image_similarity": img_sim,
-                "image_marks": img_score,
-                "evaluation_type": evaluation_type,
-                "total_score": final_score,
-            }
+        job_id = _new_job(session, student_name, roll_number)
 
-            question_counter += 1
+    # Hold on to the exam's compiled key so a re-upload doesn't change a running job
+    grading_executor.submit(
+        _run_student_job, job_id, pdf_data, digest, session.answer_key,
+        script_student(session, student_name, roll_number),
+    )
 
     return jsonify(
         {
-            "student_name": student_name,
-            "roll_number": roll_number,
-            "comparisons": comparisons,
+            "message": "Student answer sheet queued for grading ✅",
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "result_url": f"/jobs/{job_id}/result",
         }
+    ), 202
+
+
+@app.route("/jobs/student", methods=["POST"])
+def submit_student_job():
+    session = resolve_exam(request_exam_id())
+    if session is None or len(session.page_texts) == 0:
+        return jsonify({"error": "Teacher key not uploaded yet"}), 400
+
+    if "pdf" not in request.files:
+        return jsonify({"error": "No file"}), 400
+
+    return _submit_student_job(
+        session,
+        request.files["pdf"],
+        request.form.get("studentName"),
+        request.form.get("rollNumber"),
     )
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    with grading_jobs_lock:
+        job = grading_jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(_job_status_payload(job)), 200
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    with grading_jobs_lock:
+        job = grading_jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if job["status"] == "failed":
+            return jsonify(_job_status_payload(job)), 500
+        if job["status"] != "completed":
+            return jsonify(_job_status_payload(job)), 202
+
+        # Same shape as the synchronous /upload/student_api response
+        return jsonify(
+            {
+                "job_id": job_id,
+                "student_name": job["student_name"],
+                "roll_number": job["roll_number"],
+                "comparisons": job["comparisons"],
+            }
+        ), 200
+
+
 # ------------------------
-# (Optional) Student Upload HTML page (kept)
+# Bulk Class Grading ✅
+# One call per class: a ZIP archive or a multipart list of student
+# PDFs plus a roster CSV (filename, studentName, rollNumber).
+# Scripts are graded on a per-core worker pool and reports are
+# written to reports_collection in bulk as they finish.
 # ------------------------
-@app.route("/upload/student", methods=["POST"])
-def upload_student_pdf():
-    global processing_mode
-    processing_mode = "student"
+def build_report(student_name, roll_number, comparisons):
+    """Builds the same report document the Results page posts to /save-report."""
+    cumulative = sum(result.get("total_score", 0) or 0 for result in comparisons.values())
+    max_total = len(comparisons) * 10
+    percentage = f"{(cumulative / max_total) * 100:.2f}" if max_total > 0 else "0.00"
+
+    return {
+        "student_name": student_name,
+        "roll_number": roll_number,
+        "total_marks": cumulative,
+        "max_marks": max_total,
+        "percentage": percentage,
+        "page_marks": [
+            {"page": str(q_num), "marks": result.get("total_score")}
+            for q_num, result in comparisons.items()
+        ],
+        "details": comparisons,
+    }
+
+
+def parse_roster(roster_bytes):
+    """
+    Reads the roster CSV into {filename: (student_name, roll_number)}.
+    Accepts camelCase (studentName) or snake_case (student_name) headers.
+    """
+    text = roster_bytes.decode("utf-8-sig")
+    roster = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {(k or "").strip(): (v or "").strip() for k, v in row.items()}
+        filename = row.get("filename") or row.get("file")
+        if not filename:
+            continue
+        roster[os.path.basename(filename)] = (
+            row.get("studentName") or row.get("student_name") or "",
+            row.get("rollNumber") or row.get("roll_number") or "",
+        )
+    return roster
 
-    if "pdf" not in request.files:
-        return jsonify({"error": "No file provided"}), 400
 
-    pdf_file = request.files["pdf"]
-    pdf_path = os.path.join(app.config["UPLOAD_FOLDER"], pdf_file.filename)
-    pdf_file.save(pdf_path)
+def _batch_archive_members(zf, uploaded_files):
+    """
+    PDF members of the batch ZIP, validated from its directory alone.
+    Raises ValueError when the batch has too many scripts, a member is too
+    large, or the archive would decompress to more than MAX_BATCH_TOTAL_MB.
+    """
+    members = [
+        member for member in zf.infolist()
+        if not member.is_dir() and os.path.basename(member.filename).lower().endswith(".pdf")
+    ]
+    if len(members) + uploaded_files > MAX_BATCH_SIZE:
+        raise ValueError(f"Batch too large (max {MAX_BATCH_SIZE} scripts)")
+
+    max_member = MAX_BATCH_MEMBER_MB * 1024 * 1024
+    for member in members:
+        if member.file_size > max_member:
+            raise ValueError(f"{member.filename} is larger than {MAX_BATCH_MEMBER_MB:g} MB uncompressed")
+    if sum(member.file_size for member in members) > MAX_BATCH_TOTAL_MB * 1024 * 1024:
+        raise ValueError(f"Batch is larger than {MAX_BATCH_TOTAL_MB:g} MB uncompressed")
+    return members
+
+
+def _read_batch_file(src, name, max_member):
+    data = src.read(max_member + 1)   # sizes from the client or the ZIP directory are only claims
+    if len(data) > max_member:
+        raise ValueError(f"{name} is larger than {MAX_BATCH_MEMBER_MB:g} MB uncompressed")
+    return data
+
+
+def _collect_batch_pdfs():
+    """
+    Reads uploaded PDFs (ZIP members or multipart files) → {filename: (bytes, sha256)}.
+    The roster matches scripts by file name, so two scripts with the same name are rejected.
+    """
+    pdfs = {}
+    uploaded = request.files.getlist("pdfs") + request.files.getlist("pdf")
+    if len(uploaded) > MAX_BATCH_SIZE:
+        raise ValueError(f"Batch too large (max {MAX_BATCH_SIZE} scripts)")
+    max_member = int(MAX_BATCH_MEMBER_MB * 1024 * 1024)
+    remaining = int(MAX_BATCH_TOTAL_MB * 1024 * 1024)
+
+    def add(filename, data):
+        nonlocal remaining
+        if filename in pdfs:
+            raise ValueError(f"More than one script is named {filename}")
+        remaining -= len(data)
+        if remaining < 0:
+            raise ValueError(f"Batch is larger than {MAX_BATCH_TOTAL_MB:g} MB uncompressed")
+        pdfs[filename] = (data, upload_store.put(data))
+
+    archive = request.files.get("archive")
+    if archive:
+        with zipfile.ZipFile(archive.stream) as zf:
+            for member in _batch_archive_members(zf, len(uploaded)):
+                with zf.open(member) as src:
+                    data = _read_batch_file(src, member.filename, max_member)
+                add(os.path.basename(member.filename), data)
+
+    for pdf_file in uploaded:
+        filename = os.path.basename(pdf_file.filename or "")
+        if not filename:
+            continue
+        add(filename, _read_batch_file(pdf_file.stream, filename, max_member))
 
-    extracted_answers = extract_text_from_pdf(pdf_path)
+    return pdfs
 
-    comparisons = {}
-    question_counter = 1
 
-    for page_idx, (student_page_text, teacher_page_text) in enumerate(
-        zip(extracted_answers, teacher_answers)
-    ):
-        teacher_questions = split_text_by_questions(teacher_page_text)
-        student_questions = split_text_by_questions(student_page_text)
+def _flush_batch_reports(batch_id, reports):
+    """Upserts a chunk of reports with one bulk_write (same key as /save-report)."""
+    if not reports:
+        return
+    operations = [
+        UpdateOne(
+            {"exam_id": report["exam_id"], "roll_number": report["roll_number"]},
+            {"$set": report},
+            upsert=True,
+        )
+        for report in reports
+    ]
+    try:
+        with mongo_write("batch_reports"):
+            reports_collection.bulk_write(operations, ordered=False)
+        for exam_id, exam_name in {(r.get("exam_id"), r["exam_name"]) for r in reports}:
+            invalidate_analytics(exam_id, exam_name)
+        with grading_jobs_lock:
+            grading_batches[batch_id]["reports_written"] += len(reports)
+    except Exception as e:
+        print(f"Bulk report write failed for batch {batch_id}: {e}")
+        with grading_jobs_lock:
+            grading_batches[batch_id]["report_errors"].append(str(e))
+
+
+def _on_batch_job_finished(batch_id, job_id):
+    to_flush = []
+    with grading_jobs_lock:
+        batch = grading_batches[batch_id]
+        job = grading_jobs[job_id]
+        if job["status"] == "completed":
+            report = build_report(job["student_name"], job["roll_number"], job["comparisons"])
+            report["exam_id"] = batch["exam_id"]
+            report["exam_name"] = batch["exam_name"]
+            report["created_at"] = datetime.utcnow().isoformat()
+            batch["pending_reports"].append(report)
+
+        batch["jobs_finished"] += 1
+        all_done = batch["jobs_finished"] == len(batch["job_ids"])
+        if all_done or len(batch["pending_reports"]) >= BATCH_REPORT_FLUSH_SIZE:
+            to_flush = batch["pending_reports"]
+            batch["pending_reports"] = []
+
+    _flush_batch_reports(batch_id, to_flush)
+
+    if all_done:
+        with grading_jobs_lock:
+            grading_batches[batch_id]["finished_at"] = time.time()
+
+
+@app.route("/upload/student_batch", methods=["POST"])
+def upload_student_batch():
+    # Bound the request body before the form is parsed (roster and multipart overhead on top)
+    request.max_content_length = int((MAX_BATCH_TOTAL_MB + 16) * 1024 * 1024)
+    session = resolve_exam(request_exam_id())
+    if session is None or len(session.page_texts) == 0:
+        return jsonify({"error": "Teacher key not uploaded yet"}), 400
 
-        num_questions = max(len(teacher_questions), len(student_questions))
+    if "roster" not in request.files:
+        return jsonify({"error": "Missing roster CSV"}), 400
 
-        teacher_img_full = teacher_page_images.get(page_idx)
-        student_img_full = student_page_images.get(page_idx)
+    if "archive" not in request.files and not (
+        request.files.getlist("pdfs") or request.files.getlist("pdf")
+    ):
+        return jsonify({"error": "No student PDFs or ZIP archive provided"}), 400
 
-        teacher_strips = split_image_by_question_count(teacher_img_full, num_questions) if teacher_img_full else [None] * num_questions
-        student_strips = split_image_by_question_count(student_img_full, num_questions) if student_img_full else [None] * num_questions
+    try:
+        roster = parse_roster(request.files["roster"].read())
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Invalid roster CSV: {e}"}), 400
 
-        while len(teacher_questions) < num_questions:
-            teacher_questions.append((len(teacher_questions) + 1, ""))
-        while len(student_questions) < num_questions:
-            student_questions.append((len(student_questions) + 1, ""))
+    batch_id = uuid.uuid4().hex
 
-        for q_idx in range(num_questions):
-            _, teacher_text = teacher_questions[q_idx]
-            _, student_text = student_questions[q_idx]
+    try:
+        pdfs = _collect_batch_pdfs()
+    except zipfile.BadZipFile:
+        return jsonify({"error": "Invalid ZIP archive"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if len(pdfs) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch too large (max {MAX_BATCH_SIZE} scripts)"}), 400
+
+    skipped = sorted(filename for filename in pdfs if filename not in roster)
+    graded = {filename: pdf for filename, pdf in pdfs.items() if filename in roster}
+    if not graded:
+        return jsonify({"error": "No uploaded PDFs match the roster", "skipped": skipped}), 400
+
+    # One compiled teacher key for the whole class
+    answer_key = session.answer_key
+
+    with grading_jobs_lock:
+        _prune_finished_jobs()
+        grading_batches[batch_id] = {
+            "batch_id": batch_id,
+            "exam_id": session.exam_id,
+            "exam_name": session.exam_name,
+            "job_ids": [],
+            "files": {},
+            "jobs_finished": 0,
+            "pending_reports": [],
+            "reports_written": 0,
+            "report_errors": [],
+            "skipped": skipped,
+            "submitted_at": time.time(),
+            "finished_at": None,
+        }
+        for filename in sorted(graded):
+            student_name, roll_number = roster[filename]
+            job_id = _new_job(session, student_name, roll_number, batch_id=batch_id)
+            grading_batches[batch_id]["job_ids"].append(job_id)
+            grading_batches[batch_id]["files"][job_id] = filename
+
+    for job_id in grading_batches[batch_id]["job_ids"]:
+        filename = grading_batches[batch_id]["files"][job_id]
+        pdf_data, digest = graded[filename]
+        batch_executor.submit(
+            _run_student_job, job_id, pdf_data, digest, answer_key, script_student(session, *roster[filename]),
+            lambda finished_id: _on_batch_job_finished(batch_id, finished_id),
+        )
 
-            teacher_img = teacher_strips[q_idx] if q_idx < len(teacher_strips) else None
-            student_img = student_strips[q_idx] if q_idx < len(student_strips) else None
+    return jsonify(
+        {
+            "message": f"{len(graded)} student answer sheets queued for grading ✅",
+            "batch_id": batch_id,
+            "scripts": len(graded),
+            "skipped": skipped,
+            "status_url": f"/batches/{batch_id}",
+        }
+    ), 202
+
+
+@app.route("/batches/<batch_id>", methods=["GET"])
+def get_batch_status(batch_id):
+    with grading_jobs_lock:
+        batch = grading_batches.get(batch_id)
+        if batch is None:
+            return jsonify({"error": "Batch not found"}), 404
+
+        jobs = []
+        counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0}
+        for job_id in batch["job_ids"]:
+            job = grading_jobs.get(job_id)
+            if job is None:
+                continue
+            counts[job["status"]] += 1
+            entry = {
+                "job_id": job_id,
+                "filename": batch["files"][job_id],
+                "student_name": job["student_name"],
+                "roll_number": job["roll_number"],
+                "status": job["status"],
+            }
+            if job["comparisons"] is not None:
+                entry["total_marks"] = sum(
+                    r.get("total_score", 0) or 0 for r in job["comparisons"].values()
+                )
+            if job["error"]:
+                entry["error"] = job["error"]
+            jobs.append(entry)
+
+        return jsonify(
+            {
+                "batch_id": batch_id,
+                "exam_id": batch["exam_id"],
+                "exam_name": batch["exam_name"],
+                "status": "completed" if batch["finished_at"] else "running",
+                "scripts": len(batch["job_ids"]),
+                "counts": counts,
+                "reports_written": batch["reports_written"],
+                "report_errors": batch["report_errors"],
+                "skipped": batch["skipped"],
+                "jobs": jobs,
+            }
+        ), 200
 
-            has_meaningful_text = bool(
-                student_text.strip()
-                and student_text not in ("NO_TEXT_DETECTED", "OCR_ERROR", "EXTRACTION_ERROR")
-                and len(student_text.strip()) > 5
-            )
 
-            has_visual = False
-            evaluation_type = "text"
-            img_sim = 0.0
-            img_score = 0
+# ------------------------
+# (Optional) Student Upload HTML page (kept)
+# ------------------------
+@app.route("/upload/student", methods=["POST"])
+def upload_student_pdf():
+    session = resolve_exam(request_exam_id())
+    if session is None:
+        return jsonify({"error": "Teacher key not uploaded yet"}), 400
 
-            if teacher_img is not None and student_img is not None:
-                has_diagram = detect_diagram(teacher_img) or detect_diagram(student_img)
-                if has_diagram:
-                    has_visual = True
-                    diag_sim = advanced_diagram_similarity(teacher_img, student_img)
-                    img_score = diagram_marks(diag_sim)
-                    img_sim = round(diag_sim, 3)
-                    evaluation_type = "diagram" if not has_meaningful_text else "mixed_diagram"
-                else:
-                    img_arr = cv2.cvtColor(np.array(teacher_img), cv2.COLOR_RGB2GRAY)
-                    non_white = np.sum(img_arr < 240) / img_arr.size
-                    if non_white > 0.02:
-                        has_visual = True
-                        raw_sim = image_similarity(student_img, teacher_img)
-                        img_score = image_marks(raw_sim)
-                        img_sim = round(raw_sim, 3)
-                        evaluation_type = "image" if not has_meaningful_text else "mixed_image"
-
-            if has_meaningful_text:
-                similarity_score, contextual_score = bert_similarity(student_text, teacher_text)
-                text_score = 10 * (0.4 * (similarity_score / 100) + 0.6 * (contextual_score / 100))
-            else:
-                similarity_score, contextual_score, text_score = 0.0, 0.0, 0.0
-
-            if has_meaningful_text and has_visual:
-                final_score = round((0.7 * text_score) + (0.3 * img_score), 1)
-                evaluation_type = "diagram" if "diagram" in evaluation_type else "image"
-            elif has_meaningful_text:
-                final_score = round(text_score, 1)
-                evaluation_type = "text"
-            elif has_visual:
-                final_score = round(float(img_score), 1)
-                evaluation_type = "diagram" if "diagram" in evaluation_type else "image"
-            else:
-                final_score = 0.0
-                evaluation_type = "none"
-
-            comparisons[question_counter] = {
-                "student_text": student_text if has_meaningful_text else "",
-                "teacher_text": teacher_text if has_meaningful_text else "",
-                "text_marks": round(text_score, 1) if has_meaningful_text else 0,
-                "image_marks": img_score,
-                "evaluation_type": evaluation_type,
-                "final_score": final_score,
-            }
+    if "pdf" not in request.files:
+        return jsonify({"error": "No file provided"}), 400
 
-            question_counter += 1
+    pdf_data, digest = read_pdf_upload(request.files["pdf"])
+    comparisons, _ = grade_script(pdf_data, digest, session.answer_key)
+    # result.html reads final_score; copies keep the memoised grade untouched
+    comparisons = {
+        question: {**comparison, "final_score": comparison["total_score"]}
+        for question, comparison in comparisons.items()
+    }
 
     return render_template("result.html", comparisons=comparisons)
 
 
 # ------------------------
-# ✅ Save Report (Single DB + exam_name + created_at + no duplicates)
+# ✅ Save Report (Single DB + exam_id + created_at + no duplicates)
 # ------------------------
 @app.route("/save-report", methods=["POST"])
 def save_report():
+    session = resolve_exam(request_exam_id())
+    if session is None:
+        return jsonify({"error": "Exam not found"}), 404
+
     try:
-        global exam_name
         data = request.json
-
-        data["exam_name"] = exam_name if exam_name else "Unknown Exam"
+        data.pop("examId", None)
+        data["exam_id"] = session.exam_id
+        data["exam_name"] = session.exam_name
         data["created_at"] = datetime.utcnow().isoformat()
 
-        # ✅ Prevent duplicates: same exam + roll number will update
-        reports_collection.update_one(
-            {"exam_name": data["exam_name"], "roll_number": data["roll_number"]},
-            {"$set": data},
-            upsert=True,
-        )
+        # ✅ Prevent duplicates: same exam id + roll number will update
+        with mongo_write("save_report"):
+            reports_collection.update_one(
+                {"exam_id": data["exam_id"], "roll_number": data["roll_number"]},
+                {"$set": data},
+                upsert=True,
+            )
+        invalidate_analytics(data["exam_id"], data["exam_name"])
 
         return jsonify({"message": "Report saved successfully ✅"}), 200
 
@@ -868,35 +4071,389 @@ def save_report():
 
 # ------------------------
 # ✅ Fetch Reports (Sorted latest first)
+# Query parameters (all optional):
+#   examId / exam → only one exam (by id or by name)
+#   from / to     → created_at range, ISO dates (to is inclusive of that day)
+#   details=1     → include per-question details (left out by default)
+#   limit, cursor → keyset pagination; the response becomes
+#                   {"reports": [...], "next_cursor": ...}
+# Without limit/cursor the response stays a plain array for older clients.
 # ------------------------
+REPORTS_MAX_PAGE = int(os.getenv("GRADEX_REPORTS_MAX_PAGE", "500"))
+REPORT_DETAIL_FIELDS = ("details", "comparisons")
+
+
+def encode_report_cursor(report):
+    raw = json.dumps({"created_at": report.get("created_at"), "id": str(report["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_report_cursor(cursor):
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    return data["created_at"], ObjectId(data["id"])
+
+
+def report_filters(args):
+    """Mongo filter for the exam and date-range query parameters."""
+    query = {}
+    if args.get("examId"):
+        query["exam_id"] = args["examId"]
+    elif args.get("exam"):
+        query["exam_name"] = args["exam"]
+
+    created = {}
+    if args.get("from"):
+        created["$gte"] = args["from"]
+    if args.get("to"):
+        # created_at is an ISO string; a bare date covers the whole day
+        created["$lte"] = args["to"] + ("T23:59:59.999999" if len(args["to"]) == 10 else "")
+    if created:
+        query["created_at"] = created
+    return query
+
+
 @app.route("/reports", methods=["GET"])
 def get_reports():
     try:
-        reports = list(reports_collection.find({}, {"_id": 0}).sort("created_at", -1))
-        return jsonify(reports), 200
+        query = report_filters(request.args)
+        projection = None if _is_truthy(request.args.get("details")) else {f: 0 for f in REPORT_DETAIL_FIELDS}
+        paginated = "limit" in request.args or "cursor" in request.args
+
+        if not paginated:
+            reports = list(reports_collection.find(query, projection).sort([("created_at", -1), ("_id", -1)]))
+            for report in reports:
+                report.pop("_id", None)
+            return jsonify(reports), 200
+
+        try:
+            limit = max(1, min(int(request.args.get("limit", 50)), REPORTS_MAX_PAGE))
+            cursor = request.args.get("cursor")
+            if cursor:
+                created_at, last_id = decode_report_cursor(cursor)
+                query = {"$and": [query, {"$or": [
+                    {"created_at": {"$lt": created_at}},
+                    {"created_at": created_at, "_id": {"$lt": last_id}},
+                ]}]}
+        except (ValueError, KeyError, InvalidId):
+            return jsonify({"error": "Invalid limit or cursor"}), 400
+
+        reports = list(
+            reports_collection.find(query, projection)
+            .sort([("created_at", -1), ("_id", -1)])
+            .limit(limit + 1)
+        )
+        next_cursor = encode_report_cursor(reports[limit - 1]) if len(reports) > limit else None
+        reports = reports[:limit]
+        for report in reports:
+            report.pop("_id", None)
+        return jsonify({"reports": reports, "next_cursor": next_cursor}), 200
     except Exception as e:
         print(f"Error fetching reports: {e}")
         return jsonify({"error": "Failed to fetch reports"}), 500
 
 
 # ------------------------
-# Reset teacher answers
+# ✅ Exam Analytics (MongoDB aggregation)
+# GET /analytics?examId=… or ?exam=<name> → one exam: score summary,
+#   percentage distribution (10-point buckets), per-question mean and
+#   variance, evaluation-type breakdown, top and bottom performers.
+# GET /analytics → per-exam overview.
+# Results are cached per exam and dropped when /save-report or a batch
+# writes to that exam; GRADEX_ANALYTICS_TTL bounds staleness from writes
+# made by other worker processes.
+# ------------------------
+ANALYTICS_TTL = float(os.getenv("GRADEX_ANALYTICS_TTL", "300"))
+ANALYTICS_TOP_N = int(os.getenv("GRADEX_ANALYTICS_TOP_N", "5"))
+analytics_cache = {}   # cache key → (computed_at, payload)
+analytics_cache_lock = threading.Lock()
+
+# percentage is stored as a string ("83.33") by the Results page
+_PERCENTAGE_AS_DOUBLE = {
+    "$convert": {"input": "$percentage", "to": "double", "onError": None, "onNull": None}
+}
+
+
+def invalidate_analytics(exam_id=None, exam_name=None):
+    with analytics_cache_lock:
+        for key in (("examId", exam_id), ("exam", exam_name), ("all", None)):
+            analytics_cache.pop(key, None)
+
+
+def _performer(doc):
+    return {
+        "student_name": doc.get("student_name"),
+        "roll_number": doc.get("roll_number"),
+        "total_marks": doc.get("total_marks"),
+        "max_marks": doc.get("max_marks"),
+        "percentage": doc.get("pct"),
+    }
+
+
+def exam_analytics(match):
+    question_stages = [
+        {"$project": {"question": {"$objectToArray": {"$ifNull": ["$details", {}]}}}},
+        {"$unwind": "$question"},
+    ]
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {"pct": _PERCENTAGE_AS_DOUBLE}},
+        {"$facet": {
+            "summary": [{"$group": {
+                "_id": None,
+                "students": {"$sum": 1},
+                "mean_percentage": {"$avg": "$pct"},
+                "stddev_percentage": {"$stdDevPop": "$pct"},
+                "min_percentage": {"$min": "$pct"},
+                "max_percentage": {"$max": "$pct"},
+                "mean_marks": {"$avg": "$total_marks"},
+            }}],
+            "distribution": [
+                {"$match": {"pct": {"$ne": None}}},
+                {"$bucket": {
+                    "groupBy": "$pct",
+                    "boundaries": [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100.0001],
+                    "default": "other",
+                    "output": {"count": {"$sum": 1}},
+                }},
+            ],
+            "questions": question_stages + [{"$group": {
+                "_id": "$question.k",
+                "attempts": {"$sum": 1},
+                "mean": {"$avg": "$question.v.total_score"},
+                "stddev": {"$stdDevPop": "$question.v.total_score"},
+            }}],
+            "evaluation_types": question_stages + [{"$group": {
+                "_id": "$question.v.evaluation_type",
+                "count": {"$sum": 1},
+            }}],
+            "top": [
+                {"$match": {"pct": {"$ne": None}}},
+                {"$sort": {"pct": -1, "_id": 1}},
+                {"$limit": ANALYTICS_TOP_N},
+            ],
+            "bottom": [
+                {"$match": {"pct": {"$ne": None}}},
+                {"$sort": {"pct": 1, "_id": 1}},
+                {"$limit": ANALYTICS_TOP_N},
+            ],
+        }},
+    ]
+    result = next(reports_collection.aggregate(pipeline), {})
+
+    summary = (result.get("summary") or [{}])[0]
+    summary.pop("_id", None)
+    for key, value in list(summary.items()):
+        if isinstance(value, float):
+            summary[key] = round(value, 2)
+
+    def question_order(doc):
+        key = str(doc["_id"])
+        return (0, int(key)) if key.isdigit() else (1, key)
+
+    questions = [
+        {
+            "question": doc["_id"],
+            "attempts": doc["attempts"],
+            "mean": round(doc["mean"], 2) if doc["mean"] is not None else None,
+            "variance": round(doc["stddev"] ** 2, 3) if doc["stddev"] is not None else None,
+        }
+        for doc in sorted(result.get("questions", []), key=question_order)
+    ]
+    buckets = result.get("distribution", [])
+    distribution = [
+        {
+            "range": "other" if b["_id"] == "other" else f"{int(b['_id'])}-{int(b['_id']) + 10}",
+            "count": b["count"],
+        }
+        for b in buckets
+    ]
+
+    return {
+        "summary": summary,
+        "distribution": distribution,
+        "questions": questions,
+        "evaluation_types": {str(doc["_id"]): doc["count"] for doc in result.get("evaluation_types", [])},
+        "top_performers": [_performer(doc) for doc in result.get("top", [])],
+        "bottom_performers": [_performer(doc) for doc in result.get("bottom", [])],
+    }
+
+
+def exams_overview():
+    pipeline = [
+        # Sort first so it walks the created_at index, and $last is the most recent report's exam;
+        # then keep only the fields the overview needs (no per-question details)
+        {"$sort": {"created_at": 1}},
+        {"$project": {"_id": 0, "exam_name": 1, "exam_id": 1, "created_at": 1, "pct": _PERCENTAGE_AS_DOUBLE}},
+        {"$group": {
+            "_id": "$exam_name",
+            "exam_id": {"$last": "$exam_id"},
+            "students": {"$sum": 1},
+            "mean_percentage": {"$avg": "$pct"},
+            "max_percentage": {"$max": "$pct"},
+            "min_percentage": {"$min": "$pct"},
+            "last_report_at": {"$max": "$created_at"},
+        }},
+        {"$sort": {"last_report_at": -1}},
+    ]
+    exams = []
+    for doc in reports_collection.aggregate(pipeline):
+        doc["exam_name"] = doc.pop("_id")
+        for key in ("mean_percentage", "max_percentage", "min_percentage"):
+            if doc[key] is not None:
+                doc[key] = round(doc[key], 2)
+        exams.append(doc)
+    return {"exams": exams}
+
+
+@app.route("/analytics", methods=["GET"])
+def get_analytics():
+    exam_id = request.args.get("examId")
+    exam_name = request.args.get("exam")
+    if exam_id:
+        key, match = ("examId", exam_id), {"exam_id": exam_id}
+    elif exam_name:
+        key, match = ("exam", exam_name), {"exam_name": exam_name}
+    else:
+        key, match = ("all", None), None
+
+    with analytics_cache_lock:
+        cached = analytics_cache.get(key)
+    if cached is not None and time.time() - cached[0] < ANALYTICS_TTL:
+        return jsonify({**cached[1], "cached": True}), 200
+
+    try:
+        payload = exam_analytics(match) if match is not None else exams_overview()
+    except Exception as e:
+        print(f"Error computing analytics: {e}")
+        return jsonify({"error": "Failed to compute analytics"}), 500
+
+    with analytics_cache_lock:
+        analytics_cache[key] = (time.time(), payload)
+    return jsonify({**payload, "cached": False}), 200
+
+
+# ------------------------
+# OCR cache statistics
 # ------------------------
-@app.route("/reset/teacher", methods=["GET"])
-def reset_teacher():
-    global teacher_answers, exam_name
-    global teacher_page_images, student_page_images
+@app.route("/ocr-cache/stats", methods=["GET"])
+def get_ocr_cache_stats():
+    if ocr_cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(ocr_cache.stats()), 200
+
+
+# ------------------------
+# Warmup + Health ✅
+# /health/live  → process is up (always 200)
+# /health/ready → 200 once every model in GRADEX_READY_MODELS is loaded, else 503
+# /warmup       → loads models now (all, or ?models=sbert,clip) and returns their stats
+# ------------------------
+READY_MODELS = [
+    name.strip()
+    for name in os.getenv("GRADEX_READY_MODELS", "nltk,sbert,cross_encoder").split(",")
+    if name.strip()
+]
+WARMUP_ON_START = os.getenv("GRADEX_WARMUP_ON_START", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def warmup_models(names=None):
+    names = names or models.names()
+    remote = [name for name in names if inference_client is not None and name in REMOTE_MODELS]
+    for name in names:
+        if name not in remote:
+            models.try_get(name)
+    if remote:
+        try:
+            inference_client.call("warmup", remote)
+        except Exception as e:
+            print(f"⚠️  Inference server warmup failed: {e}")
+    return model_status()
+
+
+@app.route("/warmup", methods=["GET", "POST"])
+def warmup():
+    requested = request.args.get("models")
+    names = [n.strip() for n in requested.split(",") if n.strip()] if requested else None
+    unknown = [n for n in names or [] if n not in models.names()]
+    if unknown:
+        return jsonify({"error": f"Unknown models: {', '.join(unknown)}", "models": models.names()}), 400
+
+    started = time.perf_counter()
+    status = warmup_models(names)
+    rss = _rss_mb()
+    return jsonify({
+        "seconds": round(time.perf_counter() - started, 3),
+        "rss_mb": round(rss, 1) if rss else None,
+        "models": status,
+    }), 200
+
+
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    return jsonify({"status": "alive"}), 200
+
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    status = model_status()
+    missing = [name for name in READY_MODELS if not status.get(name, {}).get("loaded")]
+    payload = {"status": "ready" if not missing else "loading", "missing": missing, "models": status}
+    return jsonify(payload), 200 if not missing else 503
+
+
+# ------------------------
+# /metrics ✅ (Prometheus text format)
+# ------------------------
+def _job_counts():
+    counts = {}
+    with grading_jobs_lock:
+        for job in grading_jobs.values():
+            counts[(job["status"],)] = counts.get((job["status"],), 0) + 1
+    return counts
+
+
+def _jobs_in_flight():
+    with grading_jobs_lock:
+        return {(): sum(1 for job in grading_jobs.values() if job["status"] in ("queued", "running"))}
+
+
+def _ocr_cache_counts():
+    if ocr_cache is None:
+        return {}
+    return {("hit",): ocr_cache.hits, ("miss",): ocr_cache.misses}
+
+
+def _ocr_cache_hit_ratio():
+    if ocr_cache is None:
+        return {}
+    lookups = ocr_cache.hits + ocr_cache.misses
+    return {(): round(ocr_cache.hits / lookups, 4) if lookups else 0.0}
+
+
+CallbackMetric("gradex_jobs", "Grading jobs held by this process, by status.", _job_counts, ("status",))
+CallbackMetric("gradex_jobs_in_flight", "Queued or running grading jobs.", _jobs_in_flight)
+CallbackMetric(
+    "gradex_ocr_cache_lookups_total", "OCR cache lookups by result.", _ocr_cache_counts, ("result",), kind="counter"
+)
+CallbackMetric("gradex_ocr_cache_hit_ratio", "OCR cache hits / lookups since start.", _ocr_cache_hit_ratio)
+CallbackMetric(
+    "gradex_model_loaded", "1 when the model is loaded in this process.",
+    lambda: {(name,): int(models.is_loaded(name)) for name in models.names()}, ("model",),
+)
+CallbackMetric("gradex_process_rss_bytes", "Resident set size of this process.",
+               lambda: {(): int(_rss_mb() * 1024 * 1024)} if _rss_mb() else {})
 
-    teacher_answers = []
-    exam_name = None
-    teacher_page_images.clear()
-    student_page_images.clear()
 
-    return jsonify({"message": "Teacher answers reset successfully ✅"})
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return app.response_class(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 # ------------------------
 # Run
 # ------------------------
 if __name__ == "__main__":
+    if WARMUP_ON_START:
+        # Serve /health/live immediately; /health/ready flips once loading finishes
+        threading.Thread(target=warmup_models, daemon=True).start()
     app.run(debug=True)
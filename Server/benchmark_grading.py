@@ -0,0 +1,320 @@
+# ------------------------
+# End-to-End Grading Benchmark ✅
+# Generates a synthetic answer key and student scripts, grades every
+# script through the same path as /upload/student_api (rasterize → OCR →
+# split → diagram detection → diagram + text scoring), and reports
+# per-stage time, scripts/min and peak RSS as JSON so runs can be
+# compared across commits.
+#
+# Usage:
+#   python benchmark_grading.py --students 20 --pages 2 --questions 4 \
+#       --diagram-density 0.4 --output bench.json
+#
+# OCR uses a local "bench" backend with GRADEX_STUB_OCR_LATENCY of
+# simulated network time, so no API key is needed. The OCR cache is off
+# unless --ocr-cache is given, so every run measures real OCR calls.
+# Stage times are summed across threads (busy time), so concurrent
+# stages can add up to more than the wall time.
+# ------------------------
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+if "--ocr-cache" not in sys.argv:
+    os.environ.setdefault("GRADEX_OCR_CACHE", "0")
+os.environ.setdefault("GRADEX_ENSURE_INDEXES", "0")
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+import app
+
+STAGES = (
+    "rasterization",
+    "ocr",
+    "question_splitting",
+    "diagram_detection",
+    "advanced_diagram_similarity",
+    "bert_similarity",
+)
+
+ANSWER_SENTENCES = [
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The mitochondria produce ATP through cellular respiration.",
+    "Newton's second law states that force equals mass times acceleration.",
+    "An electric current flows from higher potential to lower potential.",
+    "Evaporation absorbs heat, which is why sweating cools the body.",
+    "A binary search halves the search space at every comparison.",
+    "Supply and demand together determine the market price of a good.",
+    "The water cycle moves water through evaporation, condensation and precipitation.",
+    "Enzymes lower the activation energy of biochemical reactions.",
+    "Ohm's law relates voltage, current and resistance in a circuit.",
+    "Tectonic plates move slowly over the semi-fluid asthenosphere.",
+    "A stack is a last-in first-out data structure.",
+]
+
+
+# ------------------------
+# Stage timing
+# ------------------------
+class StageTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.seconds[stage] += elapsed
+                    self.calls[stage] += 1
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.seconds.clear()
+            self.calls.clear()
+
+    def report(self):
+        return {
+            stage: {
+                "calls": self.calls[stage],
+                "seconds": round(self.seconds[stage], 4),
+                "mean_ms": round(1000 * self.seconds[stage] / self.calls[stage], 3) if self.calls[stage] else 0.0,
+            }
+            for stage in STAGES
+        }
+
+
+def instrument(timer, questions):
+    """Wraps the stage entry points in app (looked up at call time) with timers."""
+    fitz.Page.get_pixmap = timer.wrap("rasterization", fitz.Page.get_pixmap)
+
+    def bench_ocr(image):
+        time.sleep(app.STUB_OCR_LATENCY)
+        rng = random.Random(hashlib.sha1(image.tobytes()).hexdigest())
+        return "\n".join(
+            f"{q}) Question {q}\n{rng.choice(ANSWER_SENTENCES)} {rng.choice(ANSWER_SENTENCES)}"
+            for q in range(1, questions + 1)
+        )
+
+    app.register_ocr_backend("bench", timer.wrap("ocr", bench_ocr))
+    app.OCR_BACKEND = "bench"
+
+    app.split_text_by_questions = timer.wrap("question_splitting", app.split_text_by_questions)
+    app.split_image_by_question_count = timer.wrap("question_splitting", app.split_image_by_question_count)
+    app.PageAnalysis = timer.wrap("diagram_detection", app.PageAnalysis)
+    app.score_diagram_pairs = timer.wrap("advanced_diagram_similarity", app.score_diagram_pairs)
+    app.bert_similarity_batch = timer.wrap("bert_similarity", app.bert_similarity_batch)
+
+
+# ------------------------
+# Synthetic answer sheets
+# ------------------------
+def draw_diagram(page, rect, rng, jitter=0.0):
+    """A flowchart-like figure: boxes joined by arrows, plus a circle."""
+    shape = page.new_shape()
+    boxes = rng.randint(2, 4)
+    box_w = rect.width / (boxes * 1.6)
+    for b in range(boxes):
+        x0 = rect.x0 + b * box_w * 1.6 + rng.uniform(-jitter, jitter)
+        y0 = rect.y0 + rect.height * 0.3 + rng.uniform(-jitter, jitter)
+        shape.draw_rect(fitz.Rect(x0, y0, x0 + box_w, y0 + rect.height * 0.35))
+        if b < boxes - 1:
+            mid_y = y0 + rect.height * 0.175
+            shape.draw_line(fitz.Point(x0 + box_w, mid_y), fitz.Point(x0 + box_w * 1.6, mid_y))
+    shape.draw_circle(
+        fitz.Point(rect.x1 - rect.height * 0.25, rect.y0 + rect.height * 0.5),
+        rect.height * 0.2 + rng.uniform(-jitter, jitter),
+    )
+    shape.finish(width=2, color=(0, 0, 0))
+    shape.commit()
+
+
+def perturb_answer(answer, rng, word_drop=0.15):
+    words = [w for w in answer.split() if rng.random() > word_drop]
+    return " ".join(words) if words else answer
+
+
+def build_page(doc, layout, rng, student=False):
+    page = doc.new_page()
+    strip_h = page.rect.height / len(layout)
+    jitter = 6.0 if student else 0.0
+    for q_idx, (answer, has_diagram) in enumerate(layout):
+        top = q_idx * strip_h
+        page.insert_text((40, top + 36), f"{q_idx + 1}) Question {q_idx + 1}", fontsize=12)
+        text = perturb_answer(answer, rng) if student else answer
+        text_bottom = top + strip_h * (0.5 if has_diagram else 0.9)
+        page.insert_textbox(fitz.Rect(48 + jitter, top + 48, page.rect.width - 48, text_bottom), text, fontsize=11)
+        if has_diagram:
+            draw_diagram(page, fitz.Rect(60, text_bottom, page.rect.width - 60, top + strip_h - 12), rng, jitter)
+    return page
+
+
+def scan_like(page, rng):
+    """Rasterizes a page and adds handwriting/scanner-like noise, returns PNG bytes."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY)
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width).copy()
+    h, w = img.shape
+    # Slight skew, uneven stroke thickness, blur and sensor noise
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-1.5, 1.5), 1.0)
+    img = cv2.warpAffine(img, rotation, (w, h), borderValue=255)
+    if rng.random() < 0.5:
+        img = cv2.erode(img, np.ones((2, 2), np.uint8))
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    noise = np.random.default_rng(rng.randint(0, 2**31)).normal(0, 8, img.shape)
+    img = np.clip(img.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def generate_exam(out_dir, students, pages, questions, diagram_density, seed):
+    rng = random.Random(seed)
+    layouts = [
+        [(" ".join(rng.sample(ANSWER_SENTENCES, 2)), rng.random() < diagram_density) for _ in range(questions)]
+        for _ in range(pages)
+    ]
+
+    teacher_path = os.path.join(out_dir, "teacher.pdf")
+    with fitz.open() as doc:
+        for layout in layouts:
+            build_page(doc, layout, rng)
+        doc.save(teacher_path)
+
+    student_paths = []
+    for s in range(students):
+        path = os.path.join(out_dir, f"student_{s:03d}.pdf")
+        with fitz.open() as scratch, fitz.open() as doc:
+            for layout in layouts:
+                clean = build_page(scratch, layout, rng, student=True)
+                scanned = doc.new_page(width=clean.rect.width, height=clean.rect.height)
+                scanned.insert_image(scanned.rect, stream=scan_like(clean, rng))
+            doc.save(path)
+        student_paths.append(path)
+    return teacher_path, student_paths
+
+
+# ------------------------
+# Benchmark
+# ------------------------
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024   # KB on Linux
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def grade_script(answer_key, pdf_path):
+    return app.grade_script_pipelined(pdf_path, answer_key)
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="gradex-bench-")
+    try:
+        started = time.perf_counter()
+        teacher_path, student_paths = generate_exam(
+            work_dir, args.students, args.pages, args.questions, args.diagram_density, args.seed
+        )
+        generate_seconds = time.perf_counter() - started
+
+        timer = StageTimer()
+        instrument(timer, args.questions)
+
+        model_seconds = 0.0
+        if not args.no_warmup:
+            started = time.perf_counter()
+            app.warmup_models(["nltk", "sbert", "cross_encoder", "clip", "dino"])
+            model_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        teacher_images = app.PageStore()
+        teacher_texts = app.extract_text_from_pdf(teacher_path, mode="teacher", page_images=teacher_images)
+        answer_key = app.CompiledAnswerKey(teacher_texts, teacher_images).compile()
+        teacher_seconds = time.perf_counter() - started
+        teacher_stages = timer.report()
+        timer.reset()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(lambda path: grade_script(answer_key, path), student_paths))
+        wall = time.perf_counter() - started
+
+        questions_graded = sum(len(r) for r in results)
+        return {
+            "commit": git_commit(),
+            "config": {
+                "students": args.students,
+                "pages": args.pages,
+                "questions": args.questions,
+                "diagram_density": args.diagram_density,
+                "workers": args.workers,
+                "seed": args.seed,
+                "ocr_latency": app.STUB_OCR_LATENCY,
+                "ocr_concurrency": app.OCR_CONCURRENCY,
+                "ocr_cache": app.ocr_cache is not None,
+                "cross_encoder_tier": app.CROSS_ENCODER_TIER,
+                "diagram_cascade": app.DIAGRAM_CASCADE,
+                "image_similarity": app.IMAGE_SIMILARITY_BACKEND,
+                "pipeline_depth": app.PIPELINE_DEPTH,
+            },
+            "generate_seconds": round(generate_seconds, 3),
+            "model_load_seconds": round(model_seconds, 3),
+            "teacher_seconds": round(teacher_seconds, 3),
+            "teacher_stages": teacher_stages,
+            "wall_seconds": round(wall, 3),
+            "scripts_per_min": round(60 * args.students / wall, 2) if wall > 0 else None,
+            "questions_graded": questions_graded,
+            "stages": timer.report(),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end GradeX grading benchmark on synthetic scripts.")
+    parser.add_argument("--students", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=2, help="pages per script")
+    parser.add_argument("--questions", type=int, default=3, help="questions per page")
+    parser.add_argument("--diagram-density", type=float, default=0.3, help="fraction of questions with a diagram")
+    parser.add_argument("--workers", type=int, default=1, help="scripts graded concurrently")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ocr-cache", action="store_true", help="keep the OCR cache enabled")
+    parser.add_argument("--no-warmup", action="store_true", help="include model loading in the stage times")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Benchmark report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# ------------------------
+# Image Similarity Backend Benchmark ✅
+# Scores strip pairs with every image similarity backend and reports
+# per-pair latency plus agreement with the skimage reference, both on
+# the raw score and on the image_marks band the student would receive.
+#
+# Usage:
+#   python benchmark_image_similarity.py answer_key.pdf student_scripts/*.pdf --questions 3
+#   python benchmark_image_similarity.py strips/ --output image_benchmark.json
+#
+# Inputs are PDFs (every page is split into --questions strips) or
+# directories of strip images. Every strip is paired with a lightly
+# perturbed copy of itself (shift + noise, like a rescanned answer) and
+# with the next strip (a different answer).
+# ------------------------
+import argparse
+import json
+import os
+import time
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+from app import (
+    IMAGE_SIMILARITY_BACKENDS,
+    image_marks,
+    non_white_ratio,
+    split_image_by_question_count,
+    ssim_input,
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def load_strips(paths, num_questions):
+    strips = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    strips.append(cv2.imread(os.path.join(path, name), cv2.IMREAD_GRAYSCALE))
+        elif path.lower().endswith(".pdf"):
+            with fitz.open(path) as doc:
+                for page in doc:
+                    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY)
+                    page_img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+                    strips.extend(split_image_by_question_count(page_img, num_questions))
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            strips.append(cv2.imread(path, cv2.IMREAD_GRAYSCALE))
+    # Same rule as grading: only strips with real ink reach image_similarity
+    return [s for s in strips if s is not None and non_white_ratio(s) > 0.02]
+
+
+def perturb(gray, rng):
+    """Rescan-like copy: small shift plus sensor noise."""
+    dx, dy = rng.integers(-6, 7, size=2)
+    shifted = cv2.warpAffine(
+        gray, np.float32([[1, 0, dx], [0, 1, dy]]), (gray.shape[1], gray.shape[0]),
+        borderValue=255,
+    )
+    noise = rng.normal(0, 6, gray.shape)
+    return np.clip(shifted.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+
+def build_pairs(strips, seed=0):
+    rng = np.random.default_rng(seed)
+    inputs = [ssim_input(s) for s in strips]
+    pairs = [(g, ssim_input(perturb(s, rng))) for s, g in zip(strips, inputs)]
+    if len(inputs) > 1:
+        pairs += [(inputs[i], inputs[(i + 1) % len(inputs)]) for i in range(len(inputs))]
+    return pairs
+
+
+def benchmark(pairs, backends):
+    results = {}
+    for name in backends:
+        compare = IMAGE_SIMILARITY_BACKENDS[name]
+        compare(*pairs[0])   # warm-up
+        started = time.perf_counter()
+        scores = [float(compare(a, b)) for a, b in pairs]
+        elapsed = time.perf_counter() - started
+        results[name] = {"ms_per_pair": round(1000 * elapsed / len(pairs), 3), "scores": scores}
+        print(f"✅ {name}: {results[name]['ms_per_pair']} ms/pair")
+
+    reference = results["skimage"]["scores"]
+    report = {"pairs": len(pairs), "backends": {}}
+    for name, result in results.items():
+        scores = result["scores"]
+        diffs = [abs(a - b) for a, b in zip(scores, reference)]
+        report["backends"][name] = {
+            "ms_per_pair": result["ms_per_pair"],
+            "speedup_vs_skimage": round(results["skimage"]["ms_per_pair"] / result["ms_per_pair"], 2),
+            "mean_abs_diff": round(sum(diffs) / len(diffs), 4),
+            "max_abs_diff": round(max(diffs), 4),
+            "band_agreement": round(
+                sum(image_marks(a) == image_marks(b) for a, b in zip(scores, reference)) / len(scores), 4
+            ),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare image similarity backends against skimage SSIM.")
+    parser.add_argument("inputs", nargs="+", help="PDFs, strip images or directories of strip images")
+    parser.add_argument("--questions", type=int, default=1, help="strips per PDF page")
+    parser.add_argument("--backends", default=",".join(IMAGE_SIMILARITY_BACKENDS), help="comma-separated backends")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    strips = load_strips(args.inputs, args.questions)
+    if not strips:
+        raise SystemExit("No inked strips found in the inputs.")
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in IMAGE_SIMILARITY_BACKENDS]
+    if unknown:
+        raise SystemExit(f"Unknown backends: {', '.join(unknown)}")
+    if "skimage" not in backends:
+        backends.insert(0, "skimage")   # every backend is compared against skimage
+
+    report = benchmark(build_pairs(strips), backends)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Benchmark report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
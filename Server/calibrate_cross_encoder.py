@@ -0,0 +1,134 @@
+# ------------------------
+# Cross-Encoder Tier Calibration ✅
+# Scores a held-out set of (student, teacher) answers with every
+# cross-encoder tier and reports agreement with the full
+# stsb-roberta-large model plus per-pair latency.
+#
+# Usage:
+#   python calibrate_cross_encoder.py held_out.csv --output calibration.json
+#
+# The input is a CSV or JSONL file with `student_answer` and
+# `teacher_answer` fields (one answer pair per row).
+# ------------------------
+import argparse
+import csv
+import json
+import time
+
+import torch
+from scipy.stats import pearsonr, spearmanr
+
+from app import CROSS_ENCODER_TIERS, TEXT_BATCH_SIZE, load_cross_encoder, preprocess_text
+
+
+def load_pairs(path):
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+    return [
+        (preprocess_text(row["student_answer"]), preprocess_text(row["teacher_answer"]))
+        for row in rows
+        if row.get("student_answer") and row.get("teacher_answer")
+    ]
+
+
+def contextual_scores(model, tokenizer, pairs, batch_size=TEXT_BATCH_SIZE):
+    """Same contextual score as bert_similarity_batch (sigmoid(logit) * 100), without the negation penalty."""
+    scores = []
+    for offset in range(0, len(pairs), batch_size):
+        chunk = pairs[offset: offset + batch_size]
+        inputs = tokenizer(
+            [student for student, _ in chunk],
+            [teacher for _, teacher in chunk],
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+        )
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        scores.extend((torch.sigmoid(logits[:, 0]) * 100).tolist())
+    return scores
+
+
+def model_size_mb(model):
+    """Approximate in-memory size of the weights (int8 packed params included)."""
+    state = model.state_dict()
+    total = 0
+    for value in state.values():
+        if isinstance(value, torch.Tensor):
+            total += value.numel() * value.element_size()
+        elif isinstance(value, tuple):
+            total += sum(v.numel() * v.element_size() for v in value if isinstance(v, torch.Tensor))
+    return total / (1024 * 1024)
+
+
+def calibrate(pairs, tiers):
+    results = {}
+    for tier in tiers:
+        model, tokenizer = load_cross_encoder(tier)
+        # Warm-up pass so one-time allocation doesn't skew latency
+        contextual_scores(model, tokenizer, pairs[:1])
+
+        started = time.perf_counter()
+        scores = contextual_scores(model, tokenizer, pairs)
+        elapsed = time.perf_counter() - started
+
+        results[tier] = {
+            "model": CROSS_ENCODER_TIERS[tier],
+            "size_mb": round(model_size_mb(model), 1),
+            "ms_per_pair": round(1000 * elapsed / len(pairs), 2),
+            "scores": scores,
+        }
+        print(f"✅ {tier}: {results[tier]['ms_per_pair']} ms/pair, {results[tier]['size_mb']} MB")
+
+    reference = results["full"]["scores"]
+    report = {"pairs": len(pairs), "batch_size": TEXT_BATCH_SIZE, "tiers": {}}
+    for tier, result in results.items():
+        scores = result["scores"]
+        diffs = [abs(a - b) for a, b in zip(scores, reference)]
+        # text_marks = 10 * (0.4 * sbert + 0.6 * contextual) / 100, so a
+        # contextual difference of d moves text_marks by 0.06 * d
+        mark_diffs = [0.06 * d for d in diffs]
+        report["tiers"][tier] = {
+            "model": result["model"],
+            "size_mb": result["size_mb"],
+            "ms_per_pair": result["ms_per_pair"],
+            "speedup_vs_full": round(results["full"]["ms_per_pair"] / result["ms_per_pair"], 2),
+            "pearson": round(float(pearsonr(scores, reference)[0]), 4) if len(pairs) > 1 else None,
+            "spearman": round(float(spearmanr(scores, reference)[0]), 4) if len(pairs) > 1 else None,
+            "mean_abs_diff": round(sum(diffs) / len(diffs), 3),
+            "max_abs_diff": round(max(diffs), 3),
+            "within_half_mark": round(sum(d <= 0.5 for d in mark_diffs) / len(mark_diffs), 4),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cross-encoder tiers against the full model.")
+    parser.add_argument("held_out", help="CSV or JSONL file with student_answer/teacher_answer fields")
+    parser.add_argument("--tiers", default=",".join(CROSS_ENCODER_TIERS), help="comma-separated tiers to compare")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.held_out)
+    if not pairs:
+        raise SystemExit("No answer pairs found in the held-out file.")
+
+    tiers = [t.strip() for t in args.tiers.split(",") if t.strip()]
+    if "full" not in tiers:
+        tiers.insert(0, "full")   # every tier is compared against the full model
+
+    report = calibrate(pairs, tiers)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Calibration report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# ------------------------
+# Inference Sidecar ✅
+# Owns SBERT, the cross-encoder, CLIP and DINO for every web worker on
+# the host, so model memory stays flat as workers are added. Requests
+# that arrive within GRADEX_INFERENCE_BATCH_WAIT_MS of each other are
+# merged into one model call (cross-request batching).
+#
+# Usage:
+#   export GRADEX_INFERENCE_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+#   GRADEX_INFERENCE_ADDRESS=127.0.0.1:6001 python inference_server.py
+#   GRADEX_INFERENCE_ADDRESS=127.0.0.1:6001 gunicorn -w 4 app:app
+#
+# The server only binds to loopback or a Unix socket unless --allow-remote
+# is given, and refuses to start without GRADEX_INFERENCE_AUTHKEY.
+#
+# Protocol: multiprocessing.connection messages (op, payload) answered
+# with ("ok", result) or ("error", message).
+# ------------------------
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Listener
+
+from app import (
+    INFERENCE_AUTHKEY,
+    LOOPBACK_HOSTS,
+    REMOTE_MODELS,
+    TEXT_BATCH_SIZE,
+    _local_clip_embed,
+    _local_cross_encoder_scores,
+    _local_dino_embed,
+    _local_sbert_encode,
+    models,
+    parse_inference_address,
+)
+
+INFERENCE_MAX_BATCH = int(os.getenv("GRADEX_INFERENCE_MAX_BATCH", str(TEXT_BATCH_SIZE * 4)))
+INFERENCE_BATCH_WAIT = float(os.getenv("GRADEX_INFERENCE_BATCH_WAIT_MS", "5")) / 1000
+
+
+class MicroBatcher:
+    """
+    Runs fn over the items of every request queued within max_wait of the
+    first one (up to max_batch items) and hands each caller its slice.
+    """
+
+    def __init__(self, name, fn, max_batch=INFERENCE_MAX_BATCH, max_wait=INFERENCE_BATCH_WAIT):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        threading.Thread(target=self._run, name=f"batch-{name}", daemon=True).start()
+
+    def submit(self, items):
+        future = Future()
+        self.queue.put((items, future))
+        return future
+
+    def _run(self):
+        while True:
+            requests = [self.queue.get()]
+            size = len(requests[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request[0])
+
+            flat = [item for items, _ in requests for item in items]
+            try:
+                results = self.fn(flat)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(flat)
+            offset = 0
+            for items, future in requests:
+                future.set_result(results[offset: offset + len(items)])
+                offset += len(items)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else 0,
+        }
+
+
+def _to_numpy(embeddings):
+    return [None if e is None else e.detach().cpu().float().numpy() for e in embeddings]
+
+
+batchers = {
+    "sbert_encode": MicroBatcher("sbert", lambda texts: list(_local_sbert_encode(texts).cpu().float().numpy())),
+    "cross_encoder": MicroBatcher("cross_encoder", _local_cross_encoder_scores),
+    "clip_embed": MicroBatcher("clip", lambda images: _to_numpy(_local_clip_embed(images))),
+    "dino_embed": MicroBatcher("dino", lambda images: _to_numpy(_local_dino_embed(images))),
+}
+
+
+def handle(op, payload):
+    if op in batchers:
+        if not payload:
+            return []
+        return batchers[op].submit(payload).result()
+    if op == "available":
+        return models.try_get(payload) is not None
+    if op == "warmup":
+        for name in payload or REMOTE_MODELS:
+            models.try_get(name)
+        return None
+    if op == "status":
+        status = models.status()
+        return {name: status[name] for name in REMOTE_MODELS}
+    if op == "stats":
+        return {op_name: batcher.stats() for op_name, batcher in batchers.items()}
+    raise ValueError(f"unknown op '{op}'")
+
+
+def serve_connection(conn):
+    with conn:
+        while True:
+            try:
+                op, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", handle(op, payload))
+            except Exception as e:
+                reply = ("error", str(e))
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared model inference server for GradeX web workers.")
+    parser.add_argument("--address", default=os.getenv("GRADEX_INFERENCE_ADDRESS", "127.0.0.1:6001"),
+                        help="host:port or Unix socket path")
+    parser.add_argument("--no-warmup", action="store_true", help="load models on first request instead of at start")
+    parser.add_argument("--allow-remote", action="store_true", help="allow binding to a non-loopback host")
+    args = parser.parse_args()
+
+    if not INFERENCE_AUTHKEY:
+        parser.error("set GRADEX_INFERENCE_AUTHKEY to a shared secret before starting the inference server")
+    address = parse_inference_address(args.address)
+    if isinstance(address, tuple) and address[0] not in LOOPBACK_HOSTS and not args.allow_remote:
+        parser.error(f"refusing to listen on {address[0]}; use a loopback host, a Unix socket or --allow-remote")
+
+    if not args.no_warmup:
+        handle("warmup", None)
+
+    with Listener(address, authkey=INFERENCE_AUTHKEY) as listener:
+        print(f"🧠 Inference server listening on {args.address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"⚠️  Rejected inference connection: {e}")
+                continue
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    main()